@@ -0,0 +1,367 @@
+# encoding: utf-8
+import asyncio
+import os
+import urllib
+import aiohttp
+from xhs_utils.http_util import API_TIMEOUT, HTTP_POOL_MAXSIZE, IMAGE_TIMEOUT, VIDEO_DEADLINE, VIDEO_TIMEOUT
+from xhs_utils.media_downloader import CHUNK_SIZE, IncompleteDownloadError, parse_total_size
+from xhs_utils.retry_util import with_backoff_async
+from xhs_utils.scheduler import TokenBucket
+from xhs_utils.xhs_util import splice_str, generate_request_params, generate_x_b3_traceid
+
+# 没有传入 acquire 时接口请求的平均间隔(秒), 和同步版本一起跑时传入共用的 Scheduler.acquire_async
+ASYNC_API_INTERVAL = float(os.getenv('XHS_ASYNC_API_INTERVAL', '5'))
+# 同时在途的接口请求数和下载数
+ASYNC_API_CONCURRENCY = int(os.getenv('XHS_ASYNC_API_CONCURRENCY', '8'))
+ASYNC_DOWNLOAD_CONCURRENCY = int(os.getenv('XHS_ASYNC_DOWNLOAD_CONCURRENCY', '64'))
+
+
+def to_proxy(proxies):
+    """requests 风格的 proxies 字典转成 aiohttp 的 proxy 地址"""
+    if not proxies:
+        return None
+    if isinstance(proxies, str):
+        return proxies
+    return proxies.get('https') or proxies.get('http')
+
+
+def to_client_timeout(timeout, total=None):
+    """(连接超时, 读取超时) 转成 aiohttp.ClientTimeout"""
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return aiohttp.ClientTimeout(total=total, sock_connect=connect, sock_read=read)
+
+
+"""
+    获小红书的api, 异步版本, 接口和返回值与 XHS_Apis 一致
+    用法:
+        async with AsyncXHS_Apis() as xhs_apis:
+            success, msg, res_json = await xhs_apis.search_note('健康食谱', cookies_str)
+"""
+class AsyncXHS_Apis():
+    def __init__(self, session: aiohttp.ClientSession = None, api_concurrency=ASYNC_API_CONCURRENCY,
+                 download_concurrency=ASYNC_DOWNLOAD_CONCURRENCY, acquire=None):
+        """
+            :param session: 共用的 aiohttp.ClientSession, 默认第一次请求时新建
+            :param api_concurrency: 同时在途的接口请求数
+            :param download_concurrency: 同时在途的下载数
+            :param acquire: 频率控制, async 函数, 比如 Scheduler.acquire_async; 每次接口请求和重试前调用, 见 with_backoff_async
+                            默认每 XHS_ASYNC_API_INTERVAL 秒一个请求
+        """
+        self.base_url = "https://edith.xiaohongshu.com"
+        self.acquire = acquire or TokenBucket(ASYNC_API_INTERVAL).acquire_async
+        self.session = session
+        self.own_session = session is None
+        self.api_semaphore = asyncio.Semaphore(api_concurrency)
+        self.download_semaphore = asyncio.Semaphore(download_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            # 不保存服务端下发的cookie, 与同步版本一样每次请求显式传入
+            connector = aiohttp.TCPConnector(limit=HTTP_POOL_MAXSIZE * 4, limit_per_host=HTTP_POOL_MAXSIZE)
+            self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                                 timeout=to_client_timeout(API_TIMEOUT))
+            self.own_session = True
+        return self.session
+
+    async def close(self):
+        if self.own_session and self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def _request(self, method, api, cookies_str, data=None, proxies=None):
+        """
+            签名放到线程池里执行, 不阻塞事件循环
+            返回 success, msg, res_json
+        """
+        res_json = None
+        try:
+            loop = asyncio.get_running_loop()
+            if data is None:
+                headers, cookies, trans_data = await loop.run_in_executor(None, generate_request_params, cookies_str, api)
+                body = None
+            else:
+                headers, cookies, trans_data = await loop.run_in_executor(None, generate_request_params, cookies_str, api, data)
+                body = trans_data.encode('utf-8')
+            async with self.api_semaphore:
+                async with self._get_session().request(method, self.base_url + api, headers=headers, data=body,
+                                                       cookies=cookies, proxy=to_proxy(proxies)) as response:
+                    res_json = await response.json(content_type=None)
+            success, msg = res_json["success"], res_json["msg"]
+        except Exception as e:
+            success = False
+            # asyncio 的超时异常没有信息, 用类型名让 with_backoff_async 能分类
+            msg = str(e) or type(e).__name__
+        return success, msg, res_json
+
+    @with_backoff_async
+    async def get_user_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
+        """
+            获取用户指定位置的笔记
+            :param user_id: 你想要获取的用户的id
+            :param cursor: 你想要获取的笔记的cursor
+            :param cookies_str: 你的cookies
+            返回用户指定位置的笔记
+        """
+        api = f"/api/sns/web/v1/user_posted"
+        params = {
+            "num": "30",
+            "cursor": cursor,
+            "user_id": user_id,
+            "image_formats": "jpg,webp,avif",
+            "xsec_token": xsec_token,
+            "xsec_source": xsec_source,
+        }
+        return await self._request('GET', splice_str(api, params), cookies_str, proxies=proxies)
+
+    @with_backoff_async
+    async def get_note_info(self, url: str, cookies_str: str, proxies: dict = None):
+        """
+            获取笔记的详细
+            :param url: 你想要获取的笔记的url
+            :param cookies_str: 你的cookies
+            返回笔记的详细
+        """
+        try:
+            urlParse = urllib.parse.urlparse(url)
+            note_id = urlParse.path.split("/")[-1]
+            kvs = urlParse.query.split('&')
+            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+            api = f"/api/sns/web/v1/feed"
+            data = {
+                "source_note_id": note_id,
+                "image_formats": [
+                    "jpg",
+                    "webp",
+                    "avif"
+                ],
+                "extra": {
+                    "need_body_topic": "1"
+                },
+                "xsec_source": kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search",
+                "xsec_token": kvDist['xsec_token']
+            }
+        except Exception as e:
+            return False, str(e), None
+        return await self._request('POST', api, cookies_str, data, proxies)
+
+    @with_backoff_async
+    async def search_note(self, query: str, cookies_str: str, page=1, sort="general", note_type=0, proxies: dict = None):
+        """
+            获取搜索笔记的结果
+            :param query 搜索的关键词
+            :param cookies_str 你的cookies
+            :param page 搜索的页数
+            :param sort 排序方式 general:综合排序, time_descending:时间排序, popularity_descending:热度排序
+            :param note_type 笔记类型 0:全部, 1:视频, 2:图文
+            返回搜索的结果
+        """
+        api = "/api/sns/web/v1/search/notes"
+        data = {
+            "keyword": query,
+            "page": page,
+            "page_size": 20,
+            "search_id": generate_x_b3_traceid(21),
+            "sort": sort,
+            "note_type": note_type,
+            "ext_flags": [],
+            "image_formats": [
+                "jpg",
+                "webp",
+                "avif"
+            ]
+        }
+        return await self._request('POST', api, cookies_str, data, proxies)
+
+    @with_backoff_async
+    async def get_note_out_comment(self, note_id: str, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取指定位置的笔记一级评论
+            :param note_id 笔记的id
+            :param cursor 指定位置的评论的cursor
+            :param cookies_str 你的cookies
+            返回指定位置的笔记一级评论
+        """
+        api = "/api/sns/web/v2/comment/page"
+        params = {
+            "note_id": note_id,
+            "cursor": cursor,
+            "top_comment_id": "",
+            "image_formats": "jpg,webp,avif",
+            "xsec_token": xsec_token
+        }
+        return await self._request('GET', splice_str(api, params), cookies_str, proxies=proxies)
+
+    async def get_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取笔记的全部一级评论
+            :param note_id 笔记的id
+            :param cookies_str 你的cookies
+            返回笔记的全部一级评论
+        """
+        cursor = ''
+        note_out_comment_list = []
+        try:
+            while True:
+                success, msg, res_json = await self.get_note_out_comment(note_id, cursor, xsec_token, cookies_str, proxies)
+                if not success:
+                    raise Exception(msg)
+                comments = res_json["data"]["comments"]
+                if 'cursor' in res_json["data"]:
+                    cursor = str(res_json["data"]["cursor"])
+                else:
+                    break
+                note_out_comment_list.extend(comments)
+                if len(note_out_comment_list) == 0 or not res_json["data"]["has_more"]:
+                    break
+        except Exception as e:
+            success = False
+            msg = str(e)
+        return success, msg, note_out_comment_list
+
+    @with_backoff_async
+    async def get_note_inner_comment(self, comment: dict, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取指定位置的笔记二级评论
+            :param comment 笔记的一级评论
+            :param cursor 指定位置的评论的cursor
+            :param cookies_str 你的cookies
+            返回指定位置的笔记二级评论
+        """
+        api = "/api/sns/web/v2/comment/sub/page"
+        params = {
+            "note_id": comment['note_id'],
+            "root_comment_id": comment['id'],
+            "num": "10",
+            "cursor": cursor,
+            "image_formats": "jpg,webp,avif",
+            "top_comment_id": '',
+            "xsec_token": xsec_token
+        }
+        return await self._request('GET', splice_str(api, params), cookies_str, proxies=proxies)
+
+    async def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None):
+        """
+            获取笔记的全部二级评论
+            :param comment 笔记的一级评论
+            :param cookies_str 你的cookies
+            返回笔记的全部二级评论
+        """
+        success, msg = True, 'success'
+        try:
+            if not comment['sub_comment_has_more']:
+                return True, 'success', comment
+            cursor = comment['sub_comment_cursor']
+            inner_comment_list = []
+            while True:
+                success, msg, res_json = await self.get_note_inner_comment(comment, cursor, xsec_token, cookies_str, proxies)
+                if not success:
+                    raise Exception(msg)
+                comments = res_json["data"]["comments"]
+                if 'cursor' in res_json["data"]:
+                    cursor = str(res_json["data"]["cursor"])
+                else:
+                    break
+                inner_comment_list.extend(comments)
+                if not res_json["data"]["has_more"]:
+                    break
+            comment['sub_comments'].extend(inner_comment_list)
+        except Exception as e:
+            success = False
+            msg = str(e)
+        return success, msg, comment
+
+    async def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None):
+        """
+            获取一篇文章的所有评论, 各条一级评论的二级评论并发展开
+            :param url: 你想要获取的笔记的url
+            :param cookies_str: 你的cookies
+            返回一篇文章的所有评论
+        """
+        out_comment_list = []
+        try:
+            urlParse = urllib.parse.urlparse(url)
+            note_id = urlParse.path.split("/")[-1]
+            kvs = urlParse.query.split('&')
+            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+            success, msg, out_comment_list = await self.get_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies)
+            if not success:
+                raise Exception(msg)
+            results = await asyncio.gather(*[
+                self.get_note_all_inner_comment(comment, kvDist['xsec_token'], cookies_str, proxies)
+                for comment in out_comment_list
+            ])
+            for success, msg, _ in results:
+                if not success:
+                    raise Exception(msg)
+        except Exception as e:
+            success = False
+            msg = str(e)
+        return success, msg, out_comment_list
+
+    async def download_media(self, path, name, url, type, proxies: dict = None):
+        """
+            下载图片或视频, 与 media_downloader.fetch_media 的文件名和续传方式一致
+            先写入 .part 文件, 大小和 Content-Length 对上后再改名; .part 已有内容时用 Range 续传
+            文件读写放到线程池里执行, 不阻塞事件循环
+            :param type: image / video
+            返回 success, msg, 文件路径
+        """
+        if type == 'image':
+            file_path, timeout = path + '/' + name + '.jpg', to_client_timeout(IMAGE_TIMEOUT)
+        else:
+            file_path, timeout = path + '/' + name + '.mp4', to_client_timeout(VIDEO_TIMEOUT, VIDEO_DEADLINE)
+        part_path = file_path + '.part'
+        try:
+            async with self.download_semaphore:
+                await self._fetch_media(file_path, part_path, url, timeout, proxies)
+            success, msg = True, '成功'
+        except Exception as e:
+            success = False
+            msg = str(e) or type(e).__name__
+        return success, msg, file_path
+
+    async def _fetch_media(self, file_path, part_path, url, timeout, proxies):
+        loop = asyncio.get_running_loop()
+        if await loop.run_in_executor(None, os.path.exists, file_path):
+            # 只有校验过的文件才会改成正式文件名, 存在即完整
+            return
+        offset = await loop.run_in_executor(None, lambda: os.path.getsize(part_path) if os.path.exists(part_path) else 0)
+        # 要求服务端不压缩, Content-Length 和断点都按文件本身的字节算
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+        async with self._get_session().get(url, headers=headers, proxy=to_proxy(proxies), timeout=timeout) as response:
+            if offset and response.status == 416:
+                # .part 正好是完整文件时直接改名, 否则服务端的文件变了, 丢掉重下
+                if parse_total_size(response, 0) == offset:
+                    await loop.run_in_executor(None, os.replace, part_path, file_path)
+                    return
+                await loop.run_in_executor(None, os.remove, part_path)
+                raise IncompleteDownloadError(f'断点无效, 重新下载: {url}')
+            response.raise_for_status()
+            # 服务端仍然压缩时拿到的是解压后的字节, 不能续传, 也没法和 Content-Length 比较
+            encoded = response.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+            if offset and (response.status != 206 or encoded):
+                offset = 0
+            total = None if encoded else parse_total_size(response, offset)
+            size = offset
+            f = await loop.run_in_executor(None, open, part_path, 'ab' if offset else 'wb')
+            try:
+                async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                    await loop.run_in_executor(None, f.write, chunk)
+                    size += len(chunk)
+            except BaseException:
+                await loop.run_in_executor(None, f.close)
+                if encoded:
+                    await loop.run_in_executor(None, os.remove, part_path)
+                raise
+            await loop.run_in_executor(None, f.close)
+        if total is not None and size != total:
+            # 已下载的部分留在 .part 里, 下次续传
+            raise IncompleteDownloadError(f'文件不完整 {size}/{total} 字节: {url}')
+        await loop.run_in_executor(None, os.replace, part_path, file_path)
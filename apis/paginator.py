@@ -0,0 +1,151 @@
+# encoding: utf-8
+from concurrent.futures import ThreadPoolExecutor
+from xhs_utils.data_util import note_id_time
+
+
+def next_cursor(data, cursor):
+    """游标翻页: 下一页的游标在返回的 cursor 字段里, 没有该字段说明已经到底"""
+    if 'cursor' not in data:
+        return None
+    return str(data['cursor'])
+
+
+def next_page(data, page):
+    """页码翻页"""
+    return page + 1
+
+
+def throttled(fetch, acquire=None):
+    """每次请求一页之前先调用 acquire 拿频率控制的令牌, 比如 Scheduler.acquire"""
+    if acquire is None:
+        return fetch
+
+    def wrapper(cursor):
+        acquire()
+        return fetch(cursor)
+    return wrapper
+
+
+def reached_note(stop_at):
+    """
+        增量爬取用户笔记的停止条件: 翻到 stop_at 这篇或者更早发布的笔记
+        用户笔记按发布时间从新到旧排列, 置顶笔记除外, 置顶的不作为停止依据
+    """
+    stop_time = note_id_time(stop_at)
+
+    def stop_when(note):
+        if note.get('interact_info', {}).get('sticky'):
+            return False
+        if note.get('note_id') == stop_at:
+            return True
+        note_time = note_id_time(note.get('note_id'))
+        return stop_time is not None and note_time is not None and note_time <= stop_time
+    return stop_when
+
+
+class Paginator():
+    """
+        翻页迭代器, 每拿到一页就逐条产出, 不再先攒成完整的列表
+        :param fetch: fetch(cursor) -> (success, msg, res_json), 一般就是 XHS_Apis 里取单页的方法
+        :param items_key: res_json["data"] 里列表的键
+        :param cursor: 起始游标(或页码), 传入上次的 paginator.cursor 即可断点续爬
+        :param get_next: get_next(data, cursor) 返回下一页的游标, 返回 None 表示没有下一页
+        :param limit: 最多产出的条数, None 不限
+        :param stop_on_empty: 'page' 某一页为空时停止, 'total' 一条都没拿到时停止, None 不检查
+        :param prefetch: 产出当前页时在后台线程里提前请求下一页
+        :param stop_when: stop_when(item) 返回 True 时在这一条之前停止, 不再翻页, 用于增量爬取
+        :param on_page: 每消费完一页调用 on_page(下一页的cursor, 这一页的条目), 用于记录断点
+        :param has_more_key: 是否还有下一页的字段, 返回里没有该字段算失败; None 表示接口没有这个字段, 一直翻到 get_next 返回 None
+        :param allow_missing_items: 返回里没有 items_key 时当作到底, 默认算失败(比如返回格式变了)
+        迭代中出错不会抛异常, 结束后通过 success / msg 查看结果, 已经产出的条目不受影响
+        cursor 始终指向还没消费完的那一页, 提前 break 后再次迭代会从这一页重新开始
+        page_items 是正在产出的这一页的全部条目, 用于按页批量处理(比如一次签名这一页要展开的二级评论)
+    """
+    def __init__(self, fetch, items_key, cursor='', get_next=next_cursor, limit=None, stop_on_empty=None, prefetch=False,
+                 stop_when=None, on_page=None, has_more_key='has_more', allow_missing_items=False):
+        self.fetch = fetch
+        self.items_key = items_key
+        self.cursor = cursor
+        self.get_next = get_next
+        self.limit = limit
+        self.stop_on_empty = stop_on_empty
+        self.prefetch = prefetch
+        self.stop_when = stop_when
+        self.on_page = on_page
+        self.has_more_key = has_more_key
+        self.allow_missing_items = allow_missing_items
+        self.stopped = False
+        self.count = 0
+        self.pages = 0
+        self.page_items = []
+        self.done = False
+        self.success = True
+        self.msg = 'success'
+
+    def _fetch(self, cursor):
+        try:
+            return self.fetch(cursor)
+        except Exception as e:
+            return False, str(e), None
+
+    def __iter__(self):
+        if self.done:
+            return
+        executor = ThreadPoolExecutor(max_workers=1) if self.prefetch else None
+        future = None
+        try:
+            while True:
+                if self.limit is not None and self.count >= self.limit:
+                    return
+                success, msg, res_json = future.result() if future is not None else self._fetch(self.cursor)
+                future = None
+                try:
+                    if not success:
+                        raise Exception(msg)
+                    data = res_json["data"]
+                    if self.allow_missing_items and self.items_key not in data:
+                        self.done = True
+                        return
+                    items = data[self.items_key]
+                    cursor = self.get_next(data, self.cursor)
+                    if cursor is None:
+                        self.done = True
+                        return
+                    last_page = (self.stop_on_empty == 'page' and len(items) == 0) or (
+                        self.stop_on_empty == 'total' and self.count + len(items) == 0) or (
+                        self.has_more_key is not None and not data[self.has_more_key])
+                    if self.stop_when is not None and any(self.stop_when(item) for item in items):
+                        last_page = True
+                except Exception as e:
+                    self.success = False
+                    self.msg = str(e)
+                    return
+                self.pages += 1
+                self.page_items = items
+                if executor is not None and not last_page:
+                    future = executor.submit(self._fetch, cursor)
+                for item in items:
+                    if self.limit is not None and self.count >= self.limit:
+                        return
+                    if self.stop_when is not None and self.stop_when(item):
+                        self.stopped = self.done = True
+                        return
+                    self.count += 1
+                    yield item
+                self.cursor = cursor
+                if self.on_page is not None:
+                    self.on_page(cursor, items)
+                if last_page:
+                    self.done = True
+                    return
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def collect(self):
+        """
+            取完全部条目
+            返回 success, msg, 条目列表, 与原来的 get_all_* 接口一致
+        """
+        items = list(self)
+        return self.success, self.msg, items
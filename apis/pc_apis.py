@@ -1,9 +1,14 @@
 # encoding: utf-8
 import json
 import re
+import time
 import urllib
 import requests
-from xhs_utils.xhs_util import splice_str, generate_request_params, generate_x_b3_traceid, get_common_headers
+from apis.paginator import Paginator, next_page, reached_note, throttled
+from xhs_utils.http_util import API_TIMEOUT, create_session, preconnect
+from xhs_utils.retry_util import with_backoff
+from xhs_utils.xhs_util import SIGN_CACHE_TTL, splice_str, generate_request_params, generate_request_params_batch, \
+    generate_x_b3_traceid, get_common_headers
 from loguru import logger
 
 """
@@ -11,9 +16,24 @@ from loguru import logger
     :param cookies_str: 你的cookies
 """
 class XHS_Apis():
-    def __init__(self):
+    def __init__(self, session=None, acquire=None):
+        """
+            :param session: 共用的 requests.Session, 默认新建一个带连接池的 session
+            :param acquire: 频率控制, 比如 Scheduler.acquire, 接口失败重试前调用, 见 with_backoff
+        """
         self.base_url = "https://edith.xiaohongshu.com"
+        self.session = session or create_session()
+        self.acquire = acquire
+
+    def preconnect(self, num=1, proxies: dict = None):
+        """
+            提前和 edith.xiaohongshu.com 建立连接, 第一批请求不用再等握手
+            :param num: 建立的连接数
+            返回成功建立的连接数
+        """
+        return preconnect(self.session, self.base_url, proxies, num)
 
+    @with_backoff
     def get_homefeed_all_channel(self, cookies_str: str, proxies: dict = None):
         """
             获取主页的所有频道
@@ -23,7 +43,7 @@ class XHS_Apis():
         try:
             api = "/api/sns/web/v1/homefeed/category"
             headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -31,6 +51,7 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    @with_backoff
     def get_homefeed_recommend(self, category, cursor_score, refresh_type, note_index, cookies_str: str, proxies: dict = None):
         """
             获取主页推荐的笔记
@@ -63,7 +84,7 @@ class XHS_Apis():
                 "need_filter_image": False
             }
             headers, cookies, trans_data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=trans_data, cookies=cookies, proxies=proxies)
+            response = self.session.post(self.base_url + api, headers=headers, data=trans_data, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -71,6 +92,18 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_homefeed_recommend(self, category, cookies_str: str, require_num=None, prefetch=False, proxies: dict = None):
+        """
+            逐条获取主页推荐的笔记
+            :param category: 你想要获取的频道
+            :param cookies_str: 你的cookies
+            :param require_num: 最多获取的数量, None 不限
+            返回 Paginator, cursor 为 (cursor_score, refresh_type, note_index)
+        """
+        return Paginator(lambda c: self.get_homefeed_recommend(category, *c, cookies_str, proxies), "items", ("", 1, 0),
+                         get_next=lambda data, c: (data["cursor_score"], 3, c[2] + 20), limit=require_num, prefetch=prefetch,
+                         has_more_key=None, allow_missing_items=True)
+
     def get_homefeed_recommend_by_num(self, category, require_num, cookies_str: str, proxies: dict = None):
         """
             根据数量获取主页推荐的笔记
@@ -79,29 +112,9 @@ class XHS_Apis():
             :param cookies_str: 你的cookies
             根据数量返回主页推荐的笔记
         """
-        cursor_score, refresh_type, note_index = "", 1, 0
-        note_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_homefeed_recommend(category, cursor_score, refresh_type, note_index, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "items" not in res_json["data"]:
-                    break
-                notes = res_json["data"]["items"]
-                note_list.extend(notes)
-                cursor_score = res_json["data"]["cursor_score"]
-                refresh_type = 3
-                note_index += 20
-                if len(note_list) > require_num:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        if len(note_list) > require_num:
-            note_list = note_list[:require_num]
-        return success, msg, note_list
+        return self.iter_homefeed_recommend(category, cookies_str, require_num, proxies=proxies).collect()
 
+    @with_backoff
     def get_user_info(self, user_id: str, cookies_str: str, proxies: dict = None):
         """
             获取用户的信息
@@ -117,7 +130,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -125,6 +138,7 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    @with_backoff
     def get_user_self_info(self, cookies_str: str, proxies: dict = None):
         """
             获取用户自己的信息1
@@ -135,7 +149,7 @@ class XHS_Apis():
         try:
             api = f"/api/sns/web/v1/user/selfinfo"
             headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -144,6 +158,7 @@ class XHS_Apis():
         return success, msg, res_json
 
 
+    @with_backoff
     def get_user_self_info2(self, cookies_str: str, proxies: dict = None):
         """
             获取用户自己的信息2
@@ -154,7 +169,7 @@ class XHS_Apis():
         try:
             api = f"/api/sns/web/v2/user/me"
             headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -162,6 +177,7 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    @with_backoff
     def get_user_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
         """
             获取用户指定位置的笔记
@@ -183,7 +199,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -192,39 +208,50 @@ class XHS_Apis():
         return success, msg, res_json
 
 
-    def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None):
+    def iter_user_notes(self, user_url: str, cookies_str: str, cursor='', prefetch=False, proxies: dict = None, stop_at=None,
+                        on_page=None):
         """
-           获取用户所有笔记
-           :param user_id: 你想要获取的用户的id
-           :param cookies_str: 你的cookies
-           返回用户的所有笔记
+            逐条获取用户笔记, 每拿到一页就产出
+            :param user_url: 用户主页的url
+            :param cookies_str: 你的cookies
+            :param cursor: 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            :param prefetch: 处理当前页时提前请求下一页
+            :param stop_at: 上次爬到的最新笔记id, 翻到这篇或更早的笔记就停止, 只取新发布的笔记
+            :param on_page: 每消费完一页的回调, 见 Paginator
+            返回 Paginator
+        """
+        urlParse = urllib.parse.urlparse(user_url)
+        user_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
+        return Paginator(lambda c: self.get_user_note_info(user_id, c, cookies_str, xsec_token, xsec_source, proxies),
+                         "notes", cursor, stop_on_empty='page', prefetch=prefetch,
+                         stop_when=reached_note(stop_at) if stop_at else None, on_page=on_page)
+
+    def get_user_all_notes(self, user_url: str, cookies_str: str, proxies: dict = None, stop_at=None, checkpoint=None):
+        """
+            获取用户所有笔记
+            :param user_url: 用户主页的url
+            :param cookies_str: 你的cookies
+            :param stop_at: 上次爬到的最新笔记id, 传入时只取比它新的笔记
+            :param checkpoint: 断点, 提供 load() -> (cursor, 已取到的条目), save(cursor, 条目), clear()
+                               传入时从上次失败的那一页继续, 每取完一页记录一次, 全部成功后清除
+            返回用户的所有笔记
         """
-        cursor = ''
-        note_list = []
+        cursor, notes = checkpoint.load() if checkpoint is not None else ('', [])
         try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
-            while True:
-                success, msg, res_json = self.get_user_note_info(user_id, cursor, cookies_str, xsec_token, xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
+            paginator = self.iter_user_notes(user_url, cookies_str, cursor=cursor, proxies=proxies, stop_at=stop_at,
+                                             on_page=checkpoint.save if checkpoint is not None else None)
         except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_list
+            return False, str(e), notes
+        success, msg, new_notes = paginator.collect()
+        if success and checkpoint is not None:
+            checkpoint.clear()
+        return success, msg, notes + new_notes
 
+    @with_backoff
     def get_user_like_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
         """
             获取用户指定位置喜欢的笔记
@@ -246,7 +273,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -254,40 +281,38 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_user_like_notes(self, user_url: str, cookies_str: str, cursor='', prefetch=False, proxies: dict = None):
+        """
+            逐条获取用户喜欢的笔记, 每拿到一页就产出
+            :param user_url: 用户主页的url
+            :param cookies_str: 你的cookies
+            :param cursor: 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            :param prefetch: 处理当前页时提前请求下一页
+            返回 Paginator
+        """
+        urlParse = urllib.parse.urlparse(user_url)
+        user_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_user"
+        return Paginator(lambda c: self.get_user_like_note_info(user_id, c, cookies_str, xsec_token, xsec_source, proxies),
+                         "notes", cursor, stop_on_empty='page', prefetch=prefetch)
+
     def get_user_all_like_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
         """
             获取用户所有喜欢笔记
-            :param user_id: 你想要获取的用户的id
+            :param user_url: 用户主页的url
             :param cookies_str: 你的cookies
             返回用户的所有喜欢笔记
         """
-        cursor = ''
-        note_list = []
         try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_user"
-            while True:
-                success, msg, res_json = self.get_user_like_note_info(user_id, cursor, cookies_str, xsec_token,
-                                                                      xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
+            paginator = self.iter_user_like_notes(user_url, cookies_str, proxies=proxies)
         except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_list
+            return False, str(e), []
+        return paginator.collect()
 
+    @with_backoff
     def get_user_collect_note_info(self, user_id: str, cursor: str, cookies_str: str, xsec_token='', xsec_source='', proxies: dict = None):
         """
             获取用户指定位置收藏的笔记
@@ -309,7 +334,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -317,40 +342,38 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_user_collect_notes(self, user_url: str, cookies_str: str, cursor='', prefetch=False, proxies: dict = None):
+        """
+            逐条获取用户收藏的笔记, 每拿到一页就产出
+            :param user_url: 用户主页的url
+            :param cookies_str: 你的cookies
+            :param cursor: 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            :param prefetch: 处理当前页时提前请求下一页
+            返回 Paginator
+        """
+        urlParse = urllib.parse.urlparse(user_url)
+        user_id = urlParse.path.split("/")[-1]
+        kvs = urlParse.query.split('&')
+        kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
+        xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
+        xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
+        return Paginator(lambda c: self.get_user_collect_note_info(user_id, c, cookies_str, xsec_token, xsec_source, proxies),
+                         "notes", cursor, stop_on_empty='page', prefetch=prefetch)
+
     def get_user_all_collect_note_info(self, user_url: str, cookies_str: str, proxies: dict = None):
         """
             获取用户所有收藏笔记
-            :param user_id: 你想要获取的用户的id
+            :param user_url: 用户主页的url
             :param cookies_str: 你的cookies
             返回用户的所有收藏笔记
         """
-        cursor = ''
-        note_list = []
         try:
-            urlParse = urllib.parse.urlparse(user_url)
-            user_id = urlParse.path.split("/")[-1]
-            kvs = urlParse.query.split('&')
-            kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            xsec_token = kvDist['xsec_token'] if 'xsec_token' in kvDist else ""
-            xsec_source = kvDist['xsec_source'] if 'xsec_source' in kvDist else "pc_search"
-            while True:
-                success, msg, res_json = self.get_user_collect_note_info(user_id, cursor, cookies_str, xsec_token,
-                                                                         xsec_source, proxies)
-                if not success:
-                    raise Exception(msg)
-                notes = res_json["data"]["notes"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_list.extend(notes)
-                if len(notes) == 0 or not res_json["data"]["has_more"]:
-                    break
+            paginator = self.iter_user_collect_notes(user_url, cookies_str, proxies=proxies)
         except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_list
+            return False, str(e), []
+        return paginator.collect()
 
+    @with_backoff
     def get_note_info(self, url: str, cookies_str: str, proxies: dict = None):
         """
             获取笔记的详细
@@ -380,7 +403,7 @@ class XHS_Apis():
                 "xsec_token": kvDist['xsec_token']
             }
             headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data, cookies=cookies, proxies=proxies)
+            response = self.session.post(self.base_url + api, headers=headers, data=data, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -389,6 +412,7 @@ class XHS_Apis():
         return success, msg, res_json
 
 
+    @with_backoff
     def get_search_keyword(self, word: str, cookies_str: str, proxies: dict = None):
         """
             获取搜索关键词
@@ -404,7 +428,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -412,6 +436,7 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    @with_backoff
     def search_note(self, query: str, cookies_str: str, page=1, sort="general", note_type=0, proxies: dict = None):
         """
             获取搜索笔记的结果
@@ -440,7 +465,7 @@ class XHS_Apis():
                 ]
             }
             headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
+            response = self.session.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -448,6 +473,21 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_search_notes(self, query: str, cookies_str: str, require_num=None, sort="general", note_type=0, page=1, prefetch=False, proxies: dict = None):
+        """
+            逐条获取搜索笔记的结果
+            :param query 搜索的关键词
+            :param cookies_str 你的cookies
+            :param require_num 最多获取的数量, None 不限
+            :param sort 排序方式 general:综合排序, time_descending:时间排序, popularity_descending:热度排序
+            :param note_type 笔记类型 0:全部, 1:视频, 2:图文
+            :param page 起始页码
+            返回 Paginator, cursor 为页码
+        """
+        # 搜索结果翻到底时返回里没有 items, 当作结束
+        return Paginator(lambda p: self.search_note(query, cookies_str, p, sort, note_type, proxies), "items", page,
+                         get_next=next_page, limit=require_num, prefetch=prefetch, allow_missing_items=True)
+
     def search_some_note(self, query: str, require_num: int, cookies_str: str, sort="popularity_descending", note_type=0, proxies: dict = None):
         """
             指定数量搜索笔记，设置排序方式和笔记类型和笔记数量
@@ -458,27 +498,9 @@ class XHS_Apis():
             :param note_type 笔记类型 0:全部, 1:视频, 2:图文
             返回搜索的结果
         """
-        page = 1
-        note_list = []
-        try:
-            while True:
-                success, msg, res_json = self.search_note(query, cookies_str, page, sort, note_type, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "items" not in res_json["data"]:
-                    break
-                notes = res_json["data"]["items"]
-                note_list.extend(notes)
-                page += 1
-                if len(note_list) >= require_num or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        if len(note_list) > require_num:
-            note_list = note_list[:require_num]
-        return success, msg, note_list
+        return self.iter_search_notes(query, cookies_str, require_num, sort, note_type, proxies=proxies).collect()
 
+    @with_backoff
     def search_user(self, query: str, cookies_str: str, page=1, proxies: dict = None):
         """
             获取搜索用户的结果
@@ -501,7 +523,7 @@ class XHS_Apis():
                 }
             }
             headers, cookies, data = generate_request_params(cookies_str, api, data)
-            response = requests.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
+            response = self.session.post(self.base_url + api, headers=headers, data=data.encode('utf-8'), cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -509,6 +531,19 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_search_users(self, query: str, cookies_str: str, require_num=None, page=1, prefetch=False, proxies: dict = None):
+        """
+            逐条获取搜索用户的结果
+            :param query 搜索的关键词
+            :param cookies_str 你的cookies
+            :param require_num 最多获取的数量, None 不限
+            :param page 起始页码
+            返回 Paginator, cursor 为页码
+        """
+        # 搜索结果翻到底时返回里没有 users, 当作结束
+        return Paginator(lambda p: self.search_user(query, cookies_str, p, proxies), "users", page,
+                         get_next=next_page, limit=require_num, prefetch=prefetch, allow_missing_items=True)
+
     def search_some_user(self, query: str, require_num: int, cookies_str: str, proxies: dict = None):
         """
             指定数量搜索用户
@@ -517,27 +552,9 @@ class XHS_Apis():
             :param cookies_str 你的cookies
             返回搜索的结果
         """
-        page = 1
-        user_list = []
-        try:
-            while True:
-                success, msg, res_json = self.search_user(query, cookies_str, page, proxies)
-                if not success:
-                    raise Exception(msg)
-                if "users" not in res_json["data"]:
-                    break
-                users = res_json["data"]["users"]
-                user_list.extend(users)
-                page += 1
-                if len(user_list) >= require_num or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        if len(user_list) > require_num:
-            user_list = user_list[:require_num]
-        return success, msg, user_list
+        return self.iter_search_users(query, cookies_str, require_num, proxies=proxies).collect()
 
+    @with_backoff
     def get_note_out_comment(self, note_id: str, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
             获取指定位置的笔记一级评论
@@ -558,7 +575,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -566,6 +583,20 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_note_out_comments(self, note_id: str, xsec_token: str, cookies_str: str, cursor='', prefetch=False, proxies: dict = None,
+                               on_page=None, acquire=None):
+        """
+            逐条获取笔记的一级评论
+            :param note_id 笔记的id
+            :param cookies_str 你的cookies
+            :param cursor 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            :param on_page 每消费完一页的回调, 见 Paginator
+            :param acquire 每页请求前调用的频率控制, 比如 Scheduler.acquire
+            返回 Paginator
+        """
+        return Paginator(throttled(lambda c: self.get_note_out_comment(note_id, c, xsec_token, cookies_str, proxies), acquire), "comments",
+                         cursor, stop_on_empty='total', prefetch=prefetch, on_page=on_page)
+
     def get_note_all_out_comment(self, note_id: str, xsec_token: str, cookies_str: str, proxies: dict = None):
         """
             获取笔记的全部一级评论
@@ -573,49 +604,58 @@ class XHS_Apis():
             :param cookies_str 你的cookies
             返回笔记的全部一级评论
         """
-        cursor = ''
-        note_out_comment_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_note_out_comment(note_id, cursor, xsec_token, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                comments = res_json["data"]["comments"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                note_out_comment_list.extend(comments)
-                if len(note_out_comment_list) == 0 or not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, note_out_comment_list
+        return self.iter_note_out_comments(note_id, xsec_token, cookies_str, proxies=proxies).collect()
 
-    def get_note_inner_comment(self, comment: dict, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None):
+    @staticmethod
+    def inner_comment_api(comment: dict, cursor: str, xsec_token: str):
+        """二级评论接口带参数的路径, 签名和请求都用它"""
+        api = "/api/sns/web/v2/comment/sub/page"
+        params = {
+            "note_id": comment['note_id'],
+            "root_comment_id": comment['id'],
+            "num": "10",
+            "cursor": cursor,
+            "image_formats": "jpg,webp,avif",
+            "top_comment_id": '',
+            "xsec_token": xsec_token
+        }
+        return splice_str(api, params)
+
+    def sign_inner_comments(self, comments: list, xsec_token: str, cookies_str: str):
+        """
+            一次js调用签好多条一级评论各自的第一页二级评论请求, 每条一级评论自带 sub_comment_cursor, 互不依赖
+            :param comments 同一页的一级评论, 没有更多二级评论的跳过
+            返回 {一级评论id: (splice_api, headers, cookies)}, 传给 get_note_inner_comment 的 signed
+        """
+        comments = [comment for comment in comments if comment.get('sub_comment_has_more')]
+        if not comments:
+            return {}
+        apis = [self.inner_comment_api(comment, comment['sub_comment_cursor'], xsec_token) for comment in comments]
+        rets, cookies = generate_request_params_batch(cookies_str, [(api, '') for api in apis])
+        return {comment['id']: (api, headers, cookies) for comment, api, (headers, data) in zip(comments, apis, rets)}
+
+    @with_backoff
+    def get_note_inner_comment(self, comment: dict, cursor: str, xsec_token: str, cookies_str: str, proxies: dict = None,
+                               signed: dict = None):
         """
             获取指定位置的笔记二级评论
             :param comment 笔记的一级评论
             :param cursor 指定位置的评论的cursor
             :param cookies_str 你的cookies
+            :param signed sign_inner_comments 提前签好的请求, 用过就移除, 重试或者签名过期时重新签名
             返回指定位置的笔记二级评论
         """
         res_json = None
         try:
-            api = "/api/sns/web/v2/comment/sub/page"
-            params = {
-                "note_id": comment['note_id'],
-                "root_comment_id": comment['id'],
-                "num": "10",
-                "cursor": cursor,
-                "image_formats": "jpg,webp,avif",
-                "top_comment_id": '',
-                "xsec_token": xsec_token
-            }
-            splice_api = splice_str(api, params)
-            headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            splice_api = self.inner_comment_api(comment, cursor, xsec_token)
+            presigned = signed.pop(comment['id'], None) if signed is not None else None
+            # 有频率控制时排在后面的评论要等很久, 签名超过缓存有效期就重新签
+            if presigned is not None and presigned[0] == splice_api and \
+                    time.time() - int(presigned[1]['x-t']) / 1000 < SIGN_CACHE_TTL:
+                _, headers, cookies = presigned
+            else:
+                headers, cookies, data = generate_request_params(cookies_str, splice_api)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -623,41 +663,49 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
-    def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None):
+    def iter_note_inner_comments(self, comment: dict, xsec_token: str, cookies_str: str, cursor=None, prefetch=False, proxies: dict = None,
+                                 signed: dict = None, acquire=None):
+        """
+            逐条获取一级评论下还没展开的二级评论
+            :param comment 笔记的一级评论
+            :param cookies_str 你的cookies
+            :param cursor 起始cursor, 默认从一级评论自带的 sub_comment_cursor 开始
+            :param signed sign_inner_comments 提前签好的请求
+            :param acquire 每页请求前调用的频率控制
+            返回 Paginator
+        """
+        paginator = Paginator(throttled(lambda c: self.get_note_inner_comment(comment, c, xsec_token, cookies_str, proxies, signed),
+                                        acquire), "comments",
+                              comment['sub_comment_cursor'] if cursor is None else cursor, prefetch=prefetch)
+        paginator.done = not comment['sub_comment_has_more']
+        return paginator
+
+    def get_note_all_inner_comment(self, comment: dict, xsec_token: str, cookies_str: str, proxies: dict = None, signed: dict = None,
+                                   acquire=None):
         """
             获取笔记的全部二级评论
             :param comment 笔记的一级评论
             :param cookies_str 你的cookies
+            :param signed sign_inner_comments 提前签好的请求
+            :param acquire 每页请求前调用的频率控制
             返回笔记的全部二级评论
         """
         try:
-            if not comment['sub_comment_has_more']:
-                return True, 'success', comment
-            cursor = comment['sub_comment_cursor']
-            inner_comment_list = []
-            while True:
-                success, msg, res_json = self.get_note_inner_comment(comment, cursor, xsec_token, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                comments = res_json["data"]["comments"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                inner_comment_list.extend(comments)
-                if not res_json["data"]["has_more"]:
-                    break
-            comment['sub_comments'].extend(inner_comment_list)
+            success, msg, inner_comment_list = self.iter_note_inner_comments(comment, xsec_token, cookies_str, proxies=proxies,
+                                                                             signed=signed, acquire=acquire).collect()
         except Exception as e:
-            success = False
-            msg = str(e)
+            return False, str(e), comment
+        if success:
+            comment['sub_comments'].extend(inner_comment_list)
         return success, msg, comment
 
-    def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None):
+    def get_note_all_comment(self, url: str, cookies_str: str, proxies: dict = None, checkpoint=None, acquire=None):
         """
             获取一篇文章的所有评论
             :param note_id: 你想要获取的笔记的id
             :param cookies_str: 你的cookies
+            :param checkpoint: 断点, 见 get_user_all_notes; 记录的是展开了二级评论之后的一级评论
+            :param acquire: 一级和二级评论每页请求前调用的频率控制, 比如 Scheduler.acquire
             返回一篇文章的所有评论
         """
         out_comment_list = []
@@ -666,18 +714,32 @@ class XHS_Apis():
             note_id = urlParse.path.split("/")[-1]
             kvs = urlParse.query.split('&')
             kvDist = {kv.split('=')[0]: kv.split('=')[1] for kv in kvs}
-            success, msg, out_comment_list = self.get_note_all_out_comment(note_id, kvDist['xsec_token'], cookies_str, proxies)
-            if not success:
-                raise Exception(msg)
-            for comment in out_comment_list:
-                success, msg, new_comment = self.get_note_all_inner_comment(comment, kvDist['xsec_token'], cookies_str, proxies)
+            cursor, out_comment_list = checkpoint.load() if checkpoint is not None else ('', [])
+            # 每条一级评论取出来就展开二级评论, 一页全部展开后才记录断点
+            paginator = self.iter_note_out_comments(note_id, kvDist['xsec_token'], cookies_str, cursor, proxies=proxies,
+                                                    on_page=checkpoint.save if checkpoint is not None else None, acquire=acquire)
+            signed_page, signed = None, {}
+            for comment in paginator:
+                if signed_page != paginator.pages:
+                    # 新的一页: 这一页要展开的一级评论一次签好第一页二级评论的请求
+                    signed_page = paginator.pages
+                    signed = self.sign_inner_comments(paginator.page_items, kvDist['xsec_token'], cookies_str)
+                success, msg, new_comment = self.get_note_all_inner_comment(comment, kvDist['xsec_token'], cookies_str, proxies,
+                                                                            signed, acquire)
                 if not success:
                     raise Exception(msg)
+                out_comment_list.append(comment)
+            success, msg = paginator.success, paginator.msg
+            if not success:
+                raise Exception(msg)
+            if checkpoint is not None:
+                checkpoint.clear()
         except Exception as e:
             success = False
             msg = str(e)
         return success, msg, out_comment_list
 
+    @with_backoff
     def get_unread_message(self, cookies_str: str, proxies: dict = None):
         """
             获取未读消息
@@ -688,7 +750,7 @@ class XHS_Apis():
         try:
             api = "/api/sns/web/unread_count"
             headers, cookies, data = generate_request_params(cookies_str, api)
-            response = requests.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -696,6 +758,7 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    @with_backoff
     def get_metions(self, cursor: str, cookies_str: str, proxies: dict = None):
         """
             获取评论和@提醒
@@ -712,7 +775,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -720,32 +783,24 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_metions(self, cookies_str: str, cursor='', prefetch=False, proxies: dict = None):
+        """
+            逐条获取评论和@提醒
+            :param cookies_str: 你的cookies
+            :param cursor: 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            返回 Paginator
+        """
+        return Paginator(lambda c: self.get_metions(c, cookies_str, proxies), "message_list", cursor, prefetch=prefetch)
+
     def get_all_metions(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的评论和@提醒
             :param cookies_str: 你的cookies
             返回全部的评论和@提醒
         """
-        cursor = ''
-        metions_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_metions(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                metions = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                metions_list.extend(metions)
-                if not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, metions_list
+        return self.iter_metions(cookies_str, proxies=proxies).collect()
 
+    @with_backoff
     def get_likesAndcollects(self, cursor: str, cookies_str: str, proxies: dict = None):
         """
             获取赞和收藏
@@ -762,7 +817,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -770,32 +825,24 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_likesAndcollects(self, cookies_str: str, cursor='', prefetch=False, proxies: dict = None):
+        """
+            逐条获取赞和收藏
+            :param cookies_str: 你的cookies
+            :param cursor: 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            返回 Paginator
+        """
+        return Paginator(lambda c: self.get_likesAndcollects(c, cookies_str, proxies), "message_list", cursor, prefetch=prefetch)
+
     def get_all_likesAndcollects(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的赞和收藏
             :param cookies_str: 你的cookies
             返回全部的赞和收藏
         """
-        cursor = ''
-        likesAndcollects_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_likesAndcollects(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                likesAndcollects = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                likesAndcollects_list.extend(likesAndcollects)
-                if not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, likesAndcollects_list
+        return self.iter_likesAndcollects(cookies_str, proxies=proxies).collect()
 
+    @with_backoff
     def get_new_connections(self, cursor: str, cookies_str: str, proxies: dict = None):
         """
             获取新增关注
@@ -812,7 +859,7 @@ class XHS_Apis():
             }
             splice_api = splice_str(api, params)
             headers, cookies, data = generate_request_params(cookies_str, splice_api)
-            response = requests.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
+            response = self.session.get(self.base_url + splice_api, headers=headers, cookies=cookies, proxies=proxies)
             res_json = response.json()
             success, msg = res_json["success"], res_json["msg"]
         except Exception as e:
@@ -820,31 +867,22 @@ class XHS_Apis():
             msg = str(e)
         return success, msg, res_json
 
+    def iter_new_connections(self, cookies_str: str, cursor='', prefetch=False, proxies: dict = None):
+        """
+            逐条获取新增关注
+            :param cookies_str: 你的cookies
+            :param cursor: 起始cursor, 断点续爬时传入上次的 paginator.cursor
+            返回 Paginator
+        """
+        return Paginator(lambda c: self.get_new_connections(c, cookies_str, proxies), "message_list", cursor, prefetch=prefetch)
+
     def get_all_new_connections(self, cookies_str: str, proxies: dict = None):
         """
             获取全部的新增关注
             :param cookies_str: 你的cookies
             返回全部的新增关注
         """
-        cursor = ''
-        connections_list = []
-        try:
-            while True:
-                success, msg, res_json = self.get_new_connections(cursor, cookies_str, proxies)
-                if not success:
-                    raise Exception(msg)
-                connections = res_json["data"]["message_list"]
-                if 'cursor' in res_json["data"]:
-                    cursor = str(res_json["data"]["cursor"])
-                else:
-                    break
-                connections_list.extend(connections)
-                if not res_json["data"]["has_more"]:
-                    break
-        except Exception as e:
-            success = False
-            msg = str(e)
-        return success, msg, connections_list
+        return self.iter_new_connections(cookies_str, proxies=proxies).collect()
 
     @staticmethod
     def get_note_no_water_video(note_id):
@@ -859,7 +897,7 @@ class XHS_Apis():
         try:
             headers = get_common_headers()
             url = f"https://www.xiaohongshu.com/explore/{note_id}"
-            response = requests.get(url, headers=headers)
+            response = requests.get(url, headers=headers, timeout=API_TIMEOUT)
             res = response.text
             video_addr = re.findall(r'<meta name="og:video" content="(.*?)">', res)[0]
         except Exception as e:
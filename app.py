@@ -1,7 +1,5 @@
 # app.py
 import os
-import sqlite3
-import random
 import threading
 import uuid
 import re
@@ -11,8 +9,12 @@ from loguru import logger
 from pathlib import Path
 from apis.pc_apis import XHS_Apis
 from xhs_utils.common_utils import init
-from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx
-import time
+from xhs_utils.db_util import DBWriteError, get_db, note_id_from_url
+from xhs_utils.data_util import handle_note_info, handle_user_info, handle_comment_info, download_note, save_to_xlsx, \
+    materialize_existing, MATERIALIZE_EXISTING
+from xhs_utils.scheduler import Scheduler
+from xhs_utils.watchdog import TaskWatchdog
+from xhs_utils.xhs_util import warmup
 import sys
 
 # 初始化Flask应用
@@ -42,8 +44,13 @@ cookies_str, base_path = init()
 
 # 任务状态存储
 task_status = defaultdict(dict)
+watchdog = TaskWatchdog(task_status)
 
 SLEEP_TIME =  40
+# 爬用户笔记时只翻到上次爬过的最新笔记为止; 旧笔记点赞数后来超过阈值的不会补上, 需要时传 full=true
+INCREMENTAL_USER_CRAWL = os.getenv('XHS_INCREMENTAL_USER_CRAWL', '1') == '1'
+# 笔记里的作者昵称和头像已经写进 users 表; 要粉丝数等详情时打开, 每个用户任务多一次接口请求
+SAVE_USER_INFO = os.getenv('XHS_SAVE_USER_INFO', '0') == '1'
 
 
 
@@ -52,13 +59,11 @@ class FlaskDataSpider:
     video_count = 0
 
     def __init__(self):
-        self.xhs_apis = XHS_Apis()
+        self.scheduler = Scheduler(SLEEP_TIME, jitter=10)
+        # 接口失败重试时也要先拿令牌
+        self.xhs_apis = XHS_Apis(acquire=self.scheduler.acquire)
         self.liked_regex = re.compile(r"^(\d+\.?\d*)([万万千]?)")
 
-    def _get_db_connection(self):
-        """获取线程安全的数据库连接"""
-        return sqlite3.connect('downloaded_notes.db', check_same_thread=False)
-
     def _parse_liked_count(self, liked_str):
         """解析中文格式的点赞数"""
         try:
@@ -81,23 +86,24 @@ class FlaskDataSpider:
             return 0
 
     def _save_media_files(self, note_info, save_path):
-        """保存媒体文件"""
+        """保存媒体文件, 失败时抛出异常, 后台执行时记为失败的任务"""
+        if not os.path.exists(save_path):
+            os.makedirs(save_path, exist_ok=True)
+        note_type = note_info['note_type']
+        logger.info(f"正在保存: {note_type}")
         try:
-            if not os.path.exists(save_path):
-                os.makedirs(save_path, exist_ok=True)
-            note_type = note_info['note_type']
-            logger.info(f"正在保存: {note_type}")
-            download_note(note_info, save_path)
-            logger.info(f"媒体文件已保存到: {save_path}")
-            if note_type == '视频':
-                self.video_count += 1
-                logger.info(f"已经保存: {self.video_count} 视频")
-            else:
-                self.pic_count += 1
-                logger.info(f"已经保存: {self.pic_count} 图文")
-
+            media_dir = download_note(note_info, save_path)
         except Exception as e:
             logger.error(f"媒体文件保存失败: {str(e)}")
+            raise
+        get_db().set_media_dir(note_info['note_id'], media_dir, True)
+        logger.info(f"媒体文件已保存到: {save_path}")
+        if note_type == '视频':
+            self.video_count += 1
+            logger.info(f"已经保存: {self.video_count} 视频")
+        else:
+            self.pic_count += 1
+            logger.info(f"已经保存: {self.pic_count} 图文")
 
     def _save_excel_file(self, note_list, excel_path, query):
         """保存Excel文件"""
@@ -109,28 +115,35 @@ class FlaskDataSpider:
         except Exception as e:
             logger.error(f"Excel保存失败: {str(e)}")
 
-    def spider_note(self, note_url: str, save_path: str, proxies=None):
-        """处理单个笔记爬取并保存"""
-        conn = self._get_db_connection()
+    def _materialize_note(self, note_info, save_path):
+        """已下载的笔记链接到当前目录, 不请求接口也不下载"""
+        try:
+            if materialize_existing(get_db(), note_info, save_path):
+                return True, '笔记已存在, 已链接到当前目录', note_info
+            return True, '笔记已存在', note_info
+        except Exception as e:
+            logger.warning(f'笔记链接失败: {str(e)}')
+            return True, '笔记已存在', None
+
+    def spider_note(self, note_url: str, save_path: str, proxies=None, futures=None):
+        """
+            处理单个笔记爬取并保存
+            :param futures: 传入列表时媒体文件放到后台下载, Future 追加到该列表
+        """
         note_info = None
         logger.info(f'开始爬 {note_url} ！！！！！')
         try:
-            c = conn.cursor()
-            rewrite_url = re.sub(r'\?xsec_token=.*', '', note_url)
-            sql_sentence = "SELECT note_info FROM downloaded_notes WHERE url like '%"+ rewrite_url+ "%'"
-            c.execute(sql_sentence)
-
-            logger.info(f' {sql_sentence} ')
-
-            if c.fetchone():
+            note_id = note_id_from_url(note_url)
+            # 内存里没有的一定是新笔记, 不用查库
+            existing = get_db().find_note(note_id)
+            if existing is not None:
                 logger.info(f'笔记 {note_url} 已存在')
+                if MATERIALIZE_EXISTING:
+                    return self._materialize_note(existing, save_path)
                 return True, '笔记已存在', None
 
-            # 添加随机休眠
-            sleep_time = random.randint(SLEEP_TIME, SLEEP_TIME + 10)
-            logger.info(f'休眠 {sleep_time} ！！！！！')
-            time.sleep(sleep_time)
-
+            # 所有任务共用的频率控制, 等待期间上一篇笔记的媒体文件在后台下载
+            self.scheduler.acquire()
 
             success, msg, note_info = self.xhs_apis.get_note_info(note_url, cookies_str, proxies)
             if success:
@@ -140,23 +153,37 @@ class FlaskDataSpider:
 
                 # 保存到数据库
                 rewrite_url = re.sub(r'\?xsec_token=.*', '', note_url)
-                c.execute("INSERT INTO downloaded_notes VALUES (?,?)",
-                          (rewrite_url, str(note_info)))
-                conn.commit()
+                get_db().save_note(note_id, rewrite_url, note_info, track=os.path.basename(save_path))
 
                 # 保存媒体文件
-                self._save_media_files(note_info, save_path)
+                if futures is None:
+                    self._save_media_files(note_info, save_path)
+                else:
+                    futures.append(self.scheduler.submit(self._save_media_files, note_info, save_path))
 
 
             return success, msg, note_info
         except Exception as e:
             logger.error(f"爬取失败: {str(e)}")
             return False, str(e), None
-        finally:
-            conn.close()
 
-    def spider_user_notes(self, task_id, user_url, save_choice, min_likes, proxies=None):
-        """处理用户所有笔记"""
+    def _save_user_info(self, user_id, proxies=None):
+        """获取用户详情存库, 失败只记日志, 不影响爬笔记"""
+        try:
+            self.scheduler.acquire()
+            success, msg, res_json = self.xhs_apis.get_user_info(user_id, cookies_str, proxies)
+            if not success:
+                logger.warning(f'用户详情获取失败 {user_id}: {msg}')
+                return
+            get_db().save_user(handle_user_info(res_json['data'], user_id))
+        except Exception as e:
+            logger.warning(f'用户详情保存失败 {user_id}: {str(e)}')
+
+    def spider_user_notes(self, task_id, user_url, save_choice, min_likes, proxies=None, full=False):
+        """
+            处理用户所有笔记
+            :param full: 忽略上次的爬取记录, 重新翻完用户的全部笔记
+        """
         try:
             # 初始化任务状态
             task_status[task_id] = {
@@ -165,9 +192,11 @@ class FlaskDataSpider:
                 "total": 0,
                 "success": 0,
                 "failed": 0,
+                "failed_media": 0,
                 "details": [],
                 "current_url": None
             }
+            watchdog.beat(task_id, "获取用户笔记")
 
             # 创建用户目录
             user_id = user_url.split('/')[-1].split('?')[0]
@@ -175,11 +204,24 @@ class FlaskDataSpider:
             user_excel_dir = os.path.join(base_path['excel'], f"user_{user_id}")
             excel_path = os.path.join(user_excel_dir, f"user_{user_id}_notes.xlsx")
 
-            # 获取用户笔记
-            success, msg, notes = self.xhs_apis.get_user_all_notes(user_url, cookies_str, proxies)
+            if SAVE_USER_INFO:
+                self._save_user_info(user_id, proxies)
+
+            # 获取用户笔记, 增量模式下翻到上次的最新笔记就停
+            crawl = None if full or not INCREMENTAL_USER_CRAWL else get_db().get_user_crawl(user_id)
+            stop_at = crawl['newest_note_id'] if crawl else None
+            # 每取完一页记录断点, 上次中途失败的话从失败的那一页继续
+            checkpoint = get_db().checkpoint(f'user_posted:{user_id}')
+            success, msg, notes = self.xhs_apis.get_user_all_notes(user_url, cookies_str, proxies, stop_at=stop_at,
+                                                                   checkpoint=checkpoint)
+            task_status[task_id].update({"recovered_pages": checkpoint.recovered_pages,
+                                         "fetched_pages": checkpoint.fetched_pages})
             if not success:
                 task_status[task_id].update({"status": "failed", "message": msg})
                 return
+            if stop_at:
+                logger.info(f'用户 {user_id} 上次爬到 {crawl["newest_note_time"]}, 新笔记 {len(notes)} 条')
+                task_status[task_id]["incremental_since"] = crawl["newest_note_time"]
 
             # 过滤笔记
             filtered = []
@@ -194,14 +236,16 @@ class FlaskDataSpider:
 
             # 处理笔记并保存
             note_list = []
+            futures = []
             for index, note in enumerate(filtered, 1):
                 note_url = None
                 try:
                     note_url = f"https://www.xiaohongshu.com/explore/{note['note_id']}?xsec_token={note['xsec_token']}"
                     task_status[task_id]["current_url"] = note_url
+                    watchdog.beat(task_id, f"爬取笔记 {index}/{len(filtered)}")
 
                     # 下载笔记
-                    success, msg, note_info = self.spider_note(note_url, user_media_dir, proxies)
+                    success, msg, note_info = self.spider_note(note_url, user_media_dir, proxies, futures)
 
                     # 记录结果
                     result = {
@@ -231,6 +275,24 @@ class FlaskDataSpider:
                     })
                     task_status[task_id]["failed"] += 1
 
+            # 等后台的媒体下载结束
+            watchdog.beat(task_id, "等待媒体下载")
+            failed_media = self.scheduler.wait(futures, lambda future: watchdog.beat(task_id, "等待媒体下载"))
+            task_status[task_id]["failed_media"] = failed_media
+
+            # 确认笔记都已写进数据库
+            db_error = None
+            try:
+                get_db().flush()
+            except DBWriteError as e:
+                db_error = str(e)
+                logger.error(f"用户 {user_id} 的笔记写入数据库失败: {db_error}")
+                task_status[task_id]["db_error"] = db_error
+
+            # 笔记、媒体和数据库写入全部成功才记录这次的最新笔记, 有失败的下次还会再翻到
+            if task_status[task_id]["failed"] == 0 and failed_media == 0 and db_error is None:
+                get_db().save_user_crawl(user_id, [note['note_id'] for note in notes])
+
             # 保存Excel
             # if save_choice in ['all', 'excel'] and note_list:
             #     self._save_excel_file(note_list, excel_path, f"user_{user_id}")
@@ -238,7 +300,7 @@ class FlaskDataSpider:
             # 最终状态
             task_status[task_id].update({
                 "status": "completed",
-                "message": f"完成 {len(filtered)}条笔记下载（成功{task_status[task_id]['success']}条）",
+                "message": f"完成 {len(filtered)}条笔记下载（成功{task_status[task_id]['success']}条, 媒体下载失败{failed_media}篇）",
                 "excel_path": excel_path if save_choice in ['all', 'excel'] else None,
                 "current_url": None
             })
@@ -261,10 +323,12 @@ class FlaskDataSpider:
                 "total": 0,
                 "success": 0,
                 "failed": 0,
+                "failed_media": 0,
                 "details": [],
                 "current_url": None,
                 "query": query
             }
+            watchdog.beat(task_id, "搜索笔记")
 
             # 创建搜索目录
             search_media_dir = os.path.join(base_path['media'], query)
@@ -294,6 +358,7 @@ class FlaskDataSpider:
 
             # 处理笔记并保存
             note_list = []
+            futures = []
             for index, note in enumerate(filtered, 1):
                 note_url = None
                 try:
@@ -301,9 +366,10 @@ class FlaskDataSpider:
                     xsec_token = note['xsec_token']
                     note_url = f"https://www.xiaohongshu.com/explore/{note_id}?xsec_token={xsec_token}"
                     task_status[task_id]["current_url"] = note_url
+                    watchdog.beat(task_id, f"爬取笔记 {index}/{len(filtered)}")
 
                     # 下载笔记
-                    success, msg, note_info = self.spider_note(note_url, search_media_dir, proxies)
+                    success, msg, note_info = self.spider_note(note_url, search_media_dir, proxies, futures)
 
                     # 记录结果
                     result = {
@@ -335,6 +401,11 @@ class FlaskDataSpider:
                     })
                     task_status[task_id]["failed"] += 1
 
+            # 等后台的媒体下载结束
+            watchdog.beat(task_id, "等待媒体下载")
+            failed_media = self.scheduler.wait(futures, lambda future: watchdog.beat(task_id, "等待媒体下载"))
+            task_status[task_id]["failed_media"] = failed_media
+
             # 保存Excel
             # if save_choice in ['all', 'excel'] and note_list:
             #     self._save_excel_file(note_list, excel_path, query)
@@ -342,7 +413,7 @@ class FlaskDataSpider:
             # 最终状态
             task_status[task_id].update({
                 "status": "completed",
-                "message": f"完成 {len(filtered)}条搜索下载（成功{task_status[task_id]['success']}条）",
+                "message": f"完成 {len(filtered)}条搜索下载（成功{task_status[task_id]['success']}条, 媒体下载失败{failed_media}篇）",
                 "excel_path": excel_path if save_choice in ['all', 'excel'] else None,
                 "current_url": None
             })
@@ -356,6 +427,50 @@ class FlaskDataSpider:
             })
 
 
+    def spider_note_comments(self, task_id, note_url, proxies=None):
+        """爬取一篇笔记的全部评论, 一级和二级评论都存库"""
+        try:
+            task_status[task_id] = {
+                "status": "processing",
+                "total": 0,
+                "current_url": note_url
+            }
+            watchdog.beat(task_id, "获取笔记评论")
+            note_id = note_id_from_url(note_url)
+            # 评论多的笔记要翻很多页, 每取完一页记录断点, 上次中途失败的话从失败的那一页继续
+            # 一级和二级评论的每一页都过频率控制
+            checkpoint = get_db().checkpoint(f'comments:{note_id}')
+            success, msg, comments = self.xhs_apis.get_note_all_comment(note_url, cookies_str, proxies, checkpoint=checkpoint,
+                                                                        acquire=self.scheduler.acquire)
+            task_status[task_id].update({"recovered_pages": checkpoint.recovered_pages,
+                                         "fetched_pages": checkpoint.fetched_pages})
+            if not success:
+                task_status[task_id].update({"status": "failed", "message": msg, "current_url": None})
+                return
+
+            rows = []
+            for comment in comments:
+                for data in [comment] + comment.get('sub_comments', []):
+                    data.setdefault('note_id', note_id)
+                    data['note_url'] = note_url
+                    rows.append(handle_comment_info(data))
+            get_db().save_comments(rows)
+            task_status[task_id].update({
+                "status": "completed",
+                "total": len(rows),
+                "message": f"完成 {len(comments)}条一级评论, 共{len(rows)}条评论",
+                "current_url": None
+            })
+
+        except Exception as e:
+            logger.error(f"评论处理异常: {str(e)}")
+            task_status[task_id].update({
+                "status": "failed",
+                "message": str(e),
+                "current_url": None
+            })
+
+
 # 初始化爬虫实例
 spider = FlaskDataSpider()
 
@@ -395,7 +510,7 @@ def crawl_user_notes():
     thread = threading.Thread(
         target=spider.spider_user_notes,
         args=(task_id, data['user_url'], data['save_choice'],
-              data['min_likes'], data.get('proxies'))
+              data['min_likes'], data.get('proxies'), data.get('full', False))
     )
     thread.start()
 
@@ -427,6 +542,33 @@ def crawl_search_notes():
     })
 
 
+@app.route('/api/crawl_comments', methods=['POST'])
+def crawl_note_comments():
+    """笔记评论爬取接口"""
+    data = request.json
+    task_id = str(uuid.uuid4())
+
+    thread = threading.Thread(
+        target=spider.spider_note_comments,
+        args=(task_id, data['note_url'], data.get('proxies'))
+    )
+    thread.start()
+
+    return jsonify({
+        "task_id": task_id,
+        "status_url": f"/api/tasks/{task_id}",
+        "message": "任务已接受"
+    })
+
+
+@app.route('/api/top_notes', methods=['GET'])
+def get_top_notes():
+    """已下载笔记按点赞数排序, 可以只看某个目录(search_xxx / user_xxx)"""
+    rows = get_db().top_notes(request.args.get('track'), request.args.get('min_likes', 0, type=int),
+                              request.args.get('limit', 100, type=int))
+    return jsonify([dict(zip(('note_id', 'title', 'liked_count', 'upload_time'), row)) for row in rows])
+
+
 @app.route('/api/tasks/<task_id>', methods=['GET'])
 def get_task_status(task_id):
     """任务状态查询接口"""
@@ -437,12 +579,12 @@ def get_task_status(task_id):
 if __name__ == '__main__':
     # 初始化数据库
     with app.app_context():
-        conn = sqlite3.connect('downloaded_notes.db')
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS downloaded_notes
-                    (url TEXT PRIMARY KEY, note_info TEXT)''')
-        conn.commit()
-        conn.close()
+        get_db()
+
+    # 后台预热签名后端和连接池, 第一个请求不用再等脚本加载和握手
+    threading.Thread(target=warmup, daemon=True).start()
+    watchdog.start()
+    threading.Thread(target=spider.xhs_apis.preconnect, daemon=True).start()
 
     # 启动服务（端口设为8080）
     app.run(host='0.0.0.0', port=8080, threaded=True)
\ No newline at end of file
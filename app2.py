@@ -1,8 +1,6 @@
 # app.py
 import logging
 import os
-import sqlite3
-import random
 import threading
 import uuid
 import re
@@ -14,7 +12,11 @@ from loguru import logger
 from pathlib import Path
 from apis.pc_apis import XHS_Apis
 from xhs_utils.common_utils import init
-from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx
+from xhs_utils.db_util import get_db, note_id_from_url
+from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx, materialize_existing, MATERIALIZE_EXISTING
+from xhs_utils.scheduler import Scheduler
+from xhs_utils.watchdog import TaskWatchdog
+from xhs_utils.xhs_util import warmup
 
 # 初始化Flask应用
 app = Flask(__name__)
@@ -43,36 +45,24 @@ logger.add(
 # ================== 全局初始化 ==================
 cookies_str, base_path = init()
 task_status = defaultdict(dict)
+watchdog = TaskWatchdog(task_status)
 
 
 # ================== 核心爬虫类 ==================
 class FlaskDataSpider:
     def __init__(self):
-        self.xhs_apis = XHS_Apis()
+        # 随机间隔15-25秒, 所有任务共用; 等待期间媒体文件在后台下载
+        self.scheduler = Scheduler(15, jitter=10)
+        # 接口失败重试时也要先拿令牌
+        self.xhs_apis = XHS_Apis(acquire=self.scheduler.acquire)
         self.liked_regex = re.compile(r"^(\d+\.?\d*)([万万千]?)")
-        self.lock = threading.Lock()
-        self.last_request = 0
-        self.request_interval = random.randint(15, 25)  # 随机间隔15-25秒
 
-        logger.info("爬虫实例初始化完成 | 请求间隔: {}秒", self.request_interval)
+        logger.info("爬虫实例初始化完成 | 请求间隔: 15-25秒")
 
     # ================ 工具方法 ================
-    def _get_db_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect('downloaded_notes.db', check_same_thread=False)
-        conn.execute("PRAGMA busy_timeout = 5000")
-        return conn
-
     def _rate_limit(self):
-        """请求频率控制"""
-        with self.lock:
-            elapsed = time.time() - self.last_request
-            if elapsed < self.request_interval:
-                wait_time = self.request_interval - elapsed
-                logger.debug("频率控制 | 需要等待: {:.2f}s", wait_time)
-                time.sleep(wait_time)
-            self.last_request = time.time()
-            logger.debug("频率控制 | 最新请求时间: {}", time.strftime("%H:%M:%S", time.localtime(self.last_request)))
+        """请求频率控制, 等待时不占用锁"""
+        self.scheduler.acquire()
 
     def _parse_liked_count(self, liked_str):
         """解析点赞数"""
@@ -113,6 +103,7 @@ class FlaskDataSpider:
                 "query": query,
                 "start_time": time.strftime("%Y-%m-%d %H:%M:%S")
             }
+            watchdog.beat(task_id, "搜索笔记")
 
             # 创建存储目录
             media_dir = os.path.join(base_path['media'], f"search_{query}")
@@ -148,6 +139,7 @@ class FlaskDataSpider:
 
             # 处理笔记
             note_list = []
+            futures = []
             for idx, note in enumerate(filtered, 1):
                 note_url = None
                 try:
@@ -158,11 +150,12 @@ class FlaskDataSpider:
                     xsec_token = note['xsec_token']
                     note_url = f"https://www.xiaohongshu.com/explore/{note_id}?xsec_token={xsec_token}"
                     task_status[task_id]["current_url"] = note_url
+                    watchdog.beat(task_id, f"爬取笔记 {idx}/{len(filtered)}")
 
                     logger.debug("正在处理笔记 {}/{} | URL: {}", idx, len(filtered), note_url)
 
                     # 处理单个笔记
-                    success, msg, note_info = self.spider_note(note_url, media_dir)
+                    success, msg, note_info = self.spider_note(note_url, media_dir, futures)
                     if success:
                         note_list.append(note_info)
                         task_status[task_id]["success"] += 1
@@ -199,10 +192,17 @@ class FlaskDataSpider:
                         "timestamp": time.strftime("%H:%M:%S")
                     })
 
+            # 等后台的媒体下载结束
+            watchdog.beat(task_id, "等待媒体下载")
+            failed = self.scheduler.wait(futures, lambda future: watchdog.beat(task_id, "等待媒体下载"))
+            if failed:
+                logger.warning("媒体保存失败 | 数量: {}", failed)
+
             # 保存Excel
             if save_choice in ['all', 'excel'] and note_list:
                 excel_path = os.path.join(excel_dir, f"search_{query}.xlsx")
                 logger.info("正在生成Excel文件 | 路径: {}", excel_path)
+                watchdog.beat(task_id, "生成Excel")
                 save_to_xlsx(note_list, excel_path)
                 task_status[task_id]["excel_path"] = excel_path
                 logger.success("Excel文件已保存 | 文件: {}", excel_path)
@@ -229,17 +229,32 @@ class FlaskDataSpider:
                 "current_url": None
             })
 
-    def spider_note(self, note_url: str, save_path: str):
-        """单笔记处理核心方法"""
-        conn = self._get_db_connection()
+    def _save_media(self, processed_info, save_path):
+        """保存媒体文件"""
+        logger.debug("正在保存媒体文件 | 路径: {}", save_path)
+        media_dir = download_note(processed_info, save_path)
+        get_db().set_media_dir(processed_info['note_id'], media_dir, True)
+        logger.success("媒体保存完成 | 路径: {} | 文件数: {}",
+                       save_path, len(processed_info['media']))
+
+    def spider_note(self, note_url: str, save_path: str, futures=None):
+        """
+            单笔记处理核心方法
+            :param futures: 传入列表时媒体文件放到后台下载, Future 追加到该列表
+        """
+        db = get_db()
         try:
             logger.debug("开始处理笔记 | URL: {}", note_url)
 
             # 检查重复
-            c = conn.cursor()
-            c.execute("SELECT note_info FROM downloaded_notes WHERE url=?", (note_url,))
-            if c.fetchone():
+            note_id = note_id_from_url(note_url)
+            # 内存里没有的一定是新笔记, 不用查库
+            existing = db.find_note(note_id)
+            if existing is not None:
                 logger.warning("跳过重复笔记 | URL: {}", note_url)
+                # 出现在新的关键词目录下时, 把已下载的笔记目录链接过来
+                if MATERIALIZE_EXISTING and materialize_existing(db, existing, save_path):
+                    return True, '笔记已存在, 已链接到当前目录', None
                 return True, '笔记已存在', None
 
             # 获取数据
@@ -259,28 +274,21 @@ class FlaskDataSpider:
 
             # 存储到数据库
             logger.debug("正在写入数据库 | URL: {}", note_url)
-            c.execute("INSERT INTO downloaded_notes VALUES (?,?)",
-                      (note_url, str(processed_info)))
-            conn.commit()
-            logger.debug("数据库写入成功 | URL: {}", note_url)
+            db.save_note(note_id, note_url, processed_info)
+            logger.debug("已加入写入队列 | URL: {}", note_url)
 
             # 保存媒体文件
-            logger.debug("正在保存媒体文件 | 路径: {}", save_path)
-            download_note(processed_info, save_path)
-            logger.success("媒体保存完成 | 路径: {} | 文件数: {}",
-                           save_path, len(processed_info['media']))
+            if futures is None:
+                self._save_media(processed_info, save_path)
+            else:
+                futures.append(self.scheduler.submit(self._save_media, processed_info, save_path))
 
             return True, '成功', processed_info
 
         except Exception as e:
-            conn.rollback()
             logger.error("笔记处理失败 | URL: {} | 错误: {}", note_url, str(e), exc_info=True)
             return False, str(e), None
 
-        finally:
-            conn.close()
-            logger.debug("数据库连接已关闭 | URL: {}", note_url)
-
 
 # ================== Flask路由 ==================
 @app.route('/api/crawl_search', methods=['POST'])
@@ -336,18 +344,15 @@ if __name__ == '__main__':
     # 初始化数据库
     with app.app_context():
         try:
-            conn = sqlite3.connect('downloaded_notes.db')
-            conn.execute('''CREATE TABLE IF NOT EXISTS downloaded_notes
-                          (url TEXT PRIMARY KEY, 
-                           note_info TEXT,
-                           create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            conn.commit()
+            get_db()
             logger.success("数据库初始化完成 | 路径: downloaded_notes.db")
         except Exception as e:
             logger.critical("数据库初始化失败 | 错误: {}", str(e))
             sys.exit(1)
-        finally:
-            conn.close()
+
+    # 后台预热签名后端, 第一个请求不用再等脚本加载
+    threading.Thread(target=warmup, daemon=True).start()
+    watchdog.start()
 
     # 启动服务
     logger.info("服务启动 | 端口: 8080 | 媒体存储路径: {}", base_path['media'])
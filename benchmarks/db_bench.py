@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from xhs_utils.db_util import KnownNotes, find_note, migrate
+
+# 离线运行, 在临时目录里造数据, 对比旧的 LIKE '%url%' 和迁移后按 note_id 主键查询
+# 以及用内存里的已下载id集合过滤一页搜索结果的耗时
+PAGE_SIZE = 150
+
+
+def random_note_id(rng):
+    return '%024x' % rng.getrandbits(96)
+
+
+def build_legacy_db(path, rows, rng):
+    """按旧表结构造数据, 一半的 url 带 xsec_token, 返回所有笔记id"""
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE downloaded_notes (url TEXT PRIMARY KEY, note_info TEXT)')
+    note_ids = [random_note_id(rng) for _ in range(rows)]
+    conn.executemany('INSERT INTO downloaded_notes VALUES (?,?)', (
+        (f'https://www.xiaohongshu.com/explore/{note_id}' + ('?xsec_token=ABcd1234=' if i % 2 else ''),
+         str({'note_id': note_id, 'title': '标题'}))
+        for i, note_id in enumerate(note_ids)
+    ))
+    conn.commit()
+    return conn, note_ids
+
+
+def time_lookups(lookup, keys):
+    """返回每次查询的平均耗时(微秒)"""
+    start = time.perf_counter()
+    for key in keys:
+        lookup(key)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def bench_rows(rows, like_lookups, index_lookups, rng):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'downloaded_notes.db')
+        conn, note_ids = build_legacy_db(path, rows, rng)
+        # 一半查已存在的, 一半查不存在的(新笔记, 旧写法要扫完全表)
+        keys = [rng.choice(note_ids) if i % 2 else random_note_id(rng) for i in range(max(like_lookups, index_lookups))]
+
+        def like(note_id):
+            url = f'https://www.xiaohongshu.com/explore/{note_id}'
+            return conn.execute("SELECT note_info FROM downloaded_notes WHERE url like '%" + url + "%'").fetchone()
+
+        like_us = time_lookups(like, keys[:like_lookups])
+        start = time.perf_counter()
+        migrate(conn)
+        migrate_s = time.perf_counter() - start
+        assert find_note(conn, note_ids[0]) is not None
+        index_us = time_lookups(lambda note_id: find_note(conn, note_id), keys[:index_lookups])
+        known = KnownNotes()
+        start = time.perf_counter()
+        known.load(conn)
+        load_s = time.perf_counter() - start
+        pages = [keys[i:i + PAGE_SIZE] for i in range(0, len(keys) - PAGE_SIZE + 1, PAGE_SIZE)]
+        prefilter_us = time_lookups(known.filter_new, pages)
+        conn.close()
+    return {'rows': rows, 'like_us': like_us, 'index_us': index_us, 'migrate_s': migrate_s,
+            'load_s': load_s, 'prefilter_us': prefilter_us}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='去重查询性能测试, 离线运行')
+    parser.add_argument('--rows', default='1000,10000,100000,1000000')
+    parser.add_argument('--like-lookups', type=int, default=20, help='LIKE 查询次数, 大表上每次要扫全表')
+    parser.add_argument('--index-lookups', type=int, default=10000, help='主键查询次数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='结果写入json文件')
+    args = parser.parse_args(argv)
+
+    # 迁移时会打印日志, 这里只看结果
+    from loguru import logger
+    logger.disable('xhs_utils.db_util')
+    rng = random.Random(args.seed)
+    print(f"{'rows':>9} {'LIKE(us)':>12} {'note_id(us)':>12} {'speedup':>9} {'迁移(s)':>8} "
+          f"{'加载(s)':>8} {f'过滤{PAGE_SIZE}条(us)':>12}")
+    results = []
+    for rows in [int(r) for r in args.rows.split(',')]:
+        res = bench_rows(rows, args.like_lookups, args.index_lookups, rng)
+        results.append(res)
+        print(f"{rows:>9} {res['like_us']:>12.1f} {res['index_us']:>12.2f} "
+              f"{res['like_us'] / res['index_us']:>8.0f}x {res['migrate_s']:>8.2f} "
+              f"{res['load_s']:>8.2f} {res['prefilter_us']:>12.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
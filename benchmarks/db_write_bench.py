@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from xhs_utils.db_util import NoteDB, connect, init_db, save_note
+
+# 离线运行, 多个线程同时记录已下载笔记, 对比每篇笔记单独连接提交和 NoteDB 的单写线程批量提交
+
+NOTE_INFO = {'note_id': '', 'title': '标题', 'desc': '描述' * 50, 'image_list': ['http://sns-webpic-qc.xhscdn.com/x'] * 9}
+
+
+def run_threads(threads, notes, work):
+    """threads 个线程各写 notes 篇, 返回 (耗时, 失败次数)"""
+    errors = []
+
+    def worker(t):
+        for i in range(notes):
+            try:
+                work(f'{t:08x}{i:016x}')
+            except sqlite3.OperationalError as e:
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - start, len(errors)
+
+
+def bench_per_note(path, threads, notes):
+    """改造前: 每篇笔记打开一个连接, 写一行, 提交, 关闭"""
+    init_db(path).close()
+
+    def work(note_id):
+        conn = connect(path)
+        try:
+            save_note(conn, note_id, f'https://www.xiaohongshu.com/explore/{note_id}', dict(NOTE_INFO, note_id=note_id))
+        finally:
+            conn.close()
+
+    return run_threads(threads, notes, work)
+
+
+def bench_note_db(path, threads, notes, batch_size, batch_ms):
+    """改造后: 放进 NoteDB 的写队列, 最后等全部提交"""
+    db = NoteDB(path, batch_size=batch_size, batch_ms=batch_ms)
+
+    def work(note_id):
+        db.save_note(note_id, f'https://www.xiaohongshu.com/explore/{note_id}', dict(NOTE_INFO, note_id=note_id))
+
+    start = time.perf_counter()
+    elapsed, errors = run_threads(threads, notes, work)
+    db.flush()
+    total = time.perf_counter() - start
+    db.close()
+    return total, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='数据库写入吞吐测试, 离线运行')
+    parser.add_argument('--threads', default='1,4,16')
+    parser.add_argument('--notes', type=int, default=500, help='每个线程写入的笔记数')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--batch-ms', type=float, default=200)
+    parser.add_argument('--json', help='结果写入json文件')
+    args = parser.parse_args(argv)
+
+    from loguru import logger
+    logger.disable('xhs_utils.db_util')
+    print(f"{'threads':>7} {'rows':>7} {'逐条(rows/s)':>14} {'失败':>5} {'NoteDB(rows/s)':>15} {'失败':>5}")
+    results = []
+    for threads in [int(t) for t in args.threads.split(',')]:
+        rows = threads * args.notes
+        with tempfile.TemporaryDirectory() as tmp:
+            before_s, before_err = bench_per_note(os.path.join(tmp, 'before.db'), threads, args.notes)
+            after_s, after_err = bench_note_db(os.path.join(tmp, 'after.db'), threads, args.notes,
+                                               args.batch_size, args.batch_ms)
+        res = {'threads': threads, 'rows': rows, 'before_rows_per_sec': rows / before_s, 'before_errors': before_err,
+               'after_rows_per_sec': rows / after_s, 'after_errors': after_err}
+        results.append(res)
+        print(f"{threads:>7} {rows:>7} {res['before_rows_per_sec']:>14.0f} {before_err:>5} "
+              f"{res['after_rows_per_sec']:>15.0f} {after_err:>5}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import argparse
+import json
+import math
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xhs_utils.xhs_util import ExecjsSigner, SIGN_POOL_SIZE, build_headers, splice_str
+
+# 离线运行, 只测签名, 不发任何请求
+A1 = '18f2a8e1b8dnl6bq5yq0ce2h5xzl8kpl2p7kbhd5h50000356247'
+
+# 取自 pc_apis 里真实的请求体
+PAYLOADS = {
+    'get': (splice_str('/api/sns/web/v1/user_posted', {
+        'num': '30',
+        'cursor': '',
+        'user_id': '5f2b6a3a0000000001006aa1',
+        'image_formats': 'jpg,webp,avif',
+        'xsec_token': 'ABqgW6BAsG4ToyFtnJx8Fg1XuER_1yql5nh9pYrCub3C4=',
+        'xsec_source': 'pc_search',
+    }), ''),
+    'note_info': ('/api/sns/web/v1/feed', {
+        'source_note_id': '67f7bc90000000000e00489d',
+        'image_formats': ['jpg', 'webp', 'avif'],
+        'extra': {'need_body_topic': '1'},
+        'xsec_source': 'pc_search',
+        'xsec_token': 'ABqgW6BAsG4ToyFtnJx8Fg1XuER_1yql5nh9pYrCub3C4=',
+    }),
+    'search': ('/api/sns/web/v1/search/notes', {
+        'keyword': '健康食谱',
+        'page': 1,
+        'page_size': 20,
+        'search_id': '2e0v4pqnm3b1ay9wfd7xk',
+        'sort': 'general',
+        'note_type': 0,
+        'ext_flags': [],
+        'image_formats': ['jpg', 'webp', 'avif'],
+    }),
+}
+# 长关键词, 看请求体变大时签名耗时怎么变化
+PAYLOADS['search_long'] = (PAYLOADS['search'][0], dict(PAYLOADS['search'][1], keyword='考公万能六项框架' * 64))
+
+
+def create_backend(name, pool_size):
+    """按名字创建签名后端, 不可用时返回 None"""
+    if name == 'execjs':
+        return ExecjsSigner()
+    if name == 'node_pool':
+        if not shutil.which('node'):
+            return None
+        from xhs_utils.sign_pool import SignWorkerPool
+        return SignWorkerPool(pool_size)
+    if name == 'embedded':
+        try:
+            from xhs_utils.embedded_signer import EmbeddedSigner
+        except ImportError:
+            return None
+        return EmbeddedSigner()
+    raise ValueError(f'未知的签名后端: {name}')
+
+
+def close_backend(signer):
+    if hasattr(signer, 'close'):
+        signer.close()
+
+
+def sign_once(signer, api, data):
+    """与 generate_headers 相同的路径, 只是签名后端由参数指定"""
+    ret = signer.call('get_request_headers_params', api, data, A1)
+    return build_headers(ret['xs'], ret['xt'], ret['xs_common'], data)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    idx = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[idx]
+
+
+def timed(signer, api, data):
+    start = time.perf_counter()
+    sign_once(signer, api, data)
+    return time.perf_counter() - start
+
+
+def run_case(signer, api, data, threads, requests_num):
+    """
+        threads 个线程并发签名 requests_num 次
+        每个线程先各签一次(不计入结果), 排除进程启动和 context 初始化
+    """
+    barrier = threading.Barrier(threads)
+
+    def warm():
+        sign_once(signer, api, data)
+        barrier.wait()
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(warm) for _ in range(threads)]:
+            future.result()
+        start = time.perf_counter()
+        latencies = list(executor.map(lambda _: timed(signer, api, data), range(requests_num)))
+        wall = time.perf_counter() - start
+    return {
+        'threads': threads,
+        'requests': requests_num,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'signs_per_sec': requests_num / wall,
+    }
+
+
+def bench_backend(name, payloads, threads_list, requests_num, pool_size):
+    """返回 (结果列表, 错误信息), 后端不可用或签名失败时错误信息不为 None"""
+    start = time.perf_counter()
+    try:
+        signer = create_backend(name, pool_size)
+    except Exception as e:
+        print(f'{name}: 创建失败 {e!r}')
+        return [], f'创建失败 {e!r}'
+    if signer is None:
+        print(f'{name}: 不可用, 跳过')
+        return [], '不可用'
+    results = []
+    try:
+        api, data = PAYLOADS[payloads[0]]
+        sign_once(signer, api, data)
+        cold_start = time.perf_counter() - start
+        print(f'{name}: 冷启动到第一次签名 {cold_start * 1000:.1f}ms')
+        for payload in payloads:
+            api, data = PAYLOADS[payload]
+            for threads in threads_list:
+                res = run_case(signer, api, data, threads, max(requests_num, threads))
+                res.update(backend=name, payload=payload, cold_start_ms=cold_start * 1000)
+                results.append(res)
+                print(f"{name:<10} {payload:<12} {threads:>3} {res['requests']:>5} "
+                      f"{res['p50_ms']:>9.1f} {res['p95_ms']:>9.1f} {res['p99_ms']:>9.1f} {res['signs_per_sec']:>9.1f}")
+    except Exception as e:
+        print(f'{name}: 签名失败 {e!r}')
+        return results, f'签名失败 {e!r}'
+    finally:
+        close_backend(signer)
+    return results, None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='签名性能测试, 离线运行')
+    parser.add_argument('--backends', default='execjs,node_pool,embedded')
+    parser.add_argument('--payloads', default=','.join(PAYLOADS))
+    parser.add_argument('--threads', default='1,2,4,8,16,32')
+    parser.add_argument('--requests', type=int, default=64, help='每组的签名次数')
+    parser.add_argument('--pool-size', type=int, default=SIGN_POOL_SIZE, help='node_pool 的进程数')
+    parser.add_argument('--json', help='结果写入json文件')
+    parser.add_argument('--max-p95', type=float, help='任意一组 p95(ms) 超过该值, 或任意后端不可用/签名失败时返回非0')
+    args = parser.parse_args(argv)
+
+    payloads = args.payloads.split(',')
+    threads_list = [int(t) for t in args.threads.split(',')]
+    print(f"{'backend':<10} {'payload':<12} {'thr':>3} {'n':>5} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9} {'signs/s':>9}")
+    results = []
+    failed = {}
+    for name in args.backends.split(','):
+        backend_results, error = bench_backend(name, payloads, threads_list, args.requests, args.pool_size)
+        results += backend_results
+        if error is not None:
+            failed[name] = error
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'results': results, 'failed': failed}, f, ensure_ascii=False, indent=2)
+    if args.max_p95 is not None:
+        # 后端没跑起来不能当作没有超限
+        for name, error in failed.items():
+            print(f'后端失败: {name} {error}')
+        slow = [r for r in results if r['p95_ms'] > args.max_p95]
+        for r in slow:
+            print(f"p95 超限: {r['backend']} {r['payload']} threads={r['threads']} p95={r['p95_ms']:.1f}ms")
+        if failed or slow or not results:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import openpyxl
+from xhs_utils.data_util import XLSX_HEADERS, save_to_xlsx
+
+# 离线运行, 用合成的笔记数据对比原来的 save_to_xlsx 和流式写入
+# 每种写法在单独的子进程里跑, 分别统计耗时和峰值内存
+
+
+def legacy_save_to_xlsx(datas, file_path, type='note'):
+    """改造前的写法: 整个工作簿留在内存里, 每个单元格现编译正则, 最后一次保存"""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(XLSX_HEADERS.get(type, XLSX_HEADERS['comment']))
+    for data in datas:
+        data = {k: re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]').sub(r'', str(v)) for k, v in data.items()}
+        ws.append(list(data.values()))
+    wb.save(file_path)
+
+
+def synthetic_notes(rows):
+    """字段与 handle_note_info 的返回值一致"""
+    for i in range(rows):
+        note_id = '%024x' % (0x65000000 << 64 | i)
+        yield {
+            'note_id': note_id,
+            'note_url': f'https://www.xiaohongshu.com/explore/{note_id}?xsec_token=ABcdEFgh1234=',
+            'note_type': '图集' if i % 3 else '视频',
+            'user_id': '%024x' % (i % 5000),
+            'home_url': f'https://www.xiaohongshu.com/user/profile/{i % 5000:024x}',
+            'nickname': f'用户{i % 5000}',
+            'avatar': 'https://sns-avatar-qc.xhscdn.com/avatar/1040g2jo31abcdefg',
+            'title': f'考公上岸经验分享 第{i}篇',
+            'desc': '今天分享一下备考的心得\x07, 希望对大家有帮助 #考公[话题]# ' * 4,
+            'liked_count': f'{i % 100}.{i % 10}万',
+            'collected_count': str(i % 9999),
+            'comment_count': str(i % 999),
+            'share_count': str(i % 99),
+            'video_cover': None if i % 3 else 'https://sns-webpic-qc.xhscdn.com/cover',
+            'video_addr': None if i % 3 else 'https://sns-video-bd.xhscdn.com/pre_post/1040g0cg31x',
+            'image_list': [f'https://sns-webpic-qc.xhscdn.com/202410181234/{i:032x}/img{k}!nd_dft_wlteh_webp_3' for k in range(6)],
+            'tags': ['考公', '上岸', '经验分享'],
+            'upload_time': '2024-10-18 12:34:56',
+            'ip_location': '上海',
+        }
+
+
+def peak_rss_mb():
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 单位是字节, Linux 是 KB
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+
+def run_worker(impl, rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        file_path = os.path.join(tmp, 'notes.xlsx')
+        start = time.perf_counter()
+        if impl == 'legacy':
+            legacy_save_to_xlsx(synthetic_notes(rows), file_path)
+        else:
+            save_to_xlsx(synthetic_notes(rows), file_path)
+        seconds = time.perf_counter() - start
+        size_mb = os.path.getsize(file_path) / 1024 / 1024
+    print(json.dumps({'impl': impl, 'rows': rows, 'seconds': seconds, 'peak_rss_mb': peak_rss_mb(), 'file_mb': size_mb}))
+
+
+def run_case(impl, rows):
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.xlsx_bench', '--worker', impl, '--rows', str(rows)],
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='xlsx 导出性能测试, 离线运行')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--impls', default='legacy,streaming')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--json', help='结果写入json文件')
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        from loguru import logger
+        logger.disable('xhs_utils.data_util')
+        run_worker(args.worker, args.rows)
+        return 0
+
+    print(f"{'impl':<10} {'rows':>8} {'耗时(s)':>8} {'峰值内存(MB)':>12} {'文件(MB)':>9}")
+    results = []
+    for impl in args.impls.split(','):
+        res = run_case(impl, args.rows)
+        results.append(res)
+        print(f"{impl:<10} {res['rows']:>8} {res['seconds']:>8.1f} {res['peak_rss_mb']:>12.0f} {res['file_mb']:>9.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
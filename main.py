@@ -1,31 +1,37 @@
 import os
-import sqlite3
 import random
 from loguru import logger
 from apis.pc_apis import XHS_Apis
 from xhs_utils.common_utils import init
-from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx
+from xhs_utils.data_util import handle_note_info, download_note, save_to_xlsx, materialize_existing, MATERIALIZE_EXISTING
+from xhs_utils.db_util import get_db, note_id_from_url
+from xhs_utils.scheduler import Scheduler
 import time
 import sys
 
-# 初始化数据库连接
-conn = sqlite3.connect('downloaded_notes.db')
-c = conn.cursor()
-c.execute('''CREATE TABLE IF NOT EXISTS downloaded_notes
-             (url TEXT PRIMARY KEY, note_info TEXT)''')
-conn.commit()
-
 
 class Data_Spider():
     def __init__(self):
-        self.xhs_apis = XHS_Apis()
-
-    def spider_note(self, note_url: str, cookies_str: str, proxies=None):
-        c.execute("SELECT note_info FROM downloaded_notes WHERE url =?", (note_url,))
-        result = c.fetchone()
-        if result:
+        # 每篇笔记间隔2-3秒模拟真人操作, 等待期间上一篇的媒体文件在后台下载
+        self.scheduler = Scheduler(2, jitter=1)
+        # 接口失败重试时也要先拿令牌
+        self.xhs_apis = XHS_Apis(acquire=self.scheduler.acquire)
+
+    def spider_note(self, note_url: str, cookies_str: str, proxies=None, save_path=None):
+        """
+            :param save_path: 媒体目录, 笔记已下载过时把已下载的笔记目录链接到这里
+        """
+        note_id = note_id_from_url(note_url)
+        # 内存里没有的一定是新笔记, 不用查库
+        result = get_db().find_note(note_id)
+        if result is not None:
             logger.info(f'笔记 {note_url} 已经下载过，详细信息如下：')
-            logger.info(result[0])
+            logger.info(result)
+            if save_path is not None and MATERIALIZE_EXISTING:
+                try:
+                    materialize_existing(get_db(), result, save_path)
+                except Exception as e:
+                    logger.warning(f'笔记链接失败: {e}')
             return False, '笔记已下载', None
 
         note_info = None
@@ -35,29 +41,32 @@ class Data_Spider():
                 note_info = note_info['data']['items'][0]
                 note_info['url'] = note_url
                 note_info = handle_note_info(note_info)
-                c.execute("INSERT INTO downloaded_notes VALUES (?,?)", (note_url, str(note_info)))
-                conn.commit()
+                get_db().save_note(note_id, note_url, note_info)
         except Exception as e:
             success = False
             msg = e
         logger.info(f'爬取笔记信息 {note_url}: {success}, msg: {msg}, note_info: {note_info}')
         return success, msg, note_info
 
+    def download_note(self, note_info, path):
+        """下载媒体文件并记录笔记目录"""
+        get_db().set_media_dir(note_info['note_id'], download_note(note_info, path), True)
+
     def spider_some_note(self, notes: list, cookies_str: str, base_path: dict, save_choice: str, excel_name: str = '',
                          proxies=None):
         if (save_choice == 'all' or save_choice == 'excel') and excel_name == '':
             raise ValueError('excel_name 不能为空')
         note_list = []
+        futures = []
         for note_url in notes:
-            sleep_time = random.randint(2, 3)
-            time.sleep(sleep_time)
-            logger.info(f"休眠 {sleep_time} 秒模拟真人操作")
-            success, msg, note_info = self.spider_note(note_url, cookies_str, proxies)
+            self.scheduler.acquire()
+            save_path = base_path['media'] if save_choice == 'all' or save_choice == 'media' else None
+            success, msg, note_info = self.spider_note(note_url, cookies_str, proxies, save_path)
             if note_info is not None and success:
                 note_list.append(note_info)
-        for note_info in note_list:
-            if save_choice == 'all' or save_choice == 'media':
-                download_note(note_info, base_path['media'])
+                if save_path is not None:
+                    futures.append(self.scheduler.submit(self.download_note, note_info, save_path))
+        self.scheduler.wait(futures)
         # if save_choice == 'all' or save_choice == 'excel':
         #     file_path = os.path.abspath(os.path.join(base_path['excel'], f'{excel_name}.xlsx'))
         #     save_to_xlsx(note_list, file_path)
@@ -253,5 +262,7 @@ if __name__ == '__main__':
     #         min_likes=1000  # 设置点赞阈值
     #     )
 
-    conn.close()
+    # 提交剩下的写入, 有写入失败时在这里报出来
+    get_db().flush()
+    get_db().close()
     logger.success("所有任务处理完成")
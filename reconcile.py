@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+from xhs_utils.data_util import note_media_files
+from xhs_utils.db_util import DB_PATH, init_db, note_statements
+
+"""
+    把磁盘上已有的笔记目录补录进数据库
+    目录结构: {媒体根目录}/{search_xxx 或 user_xxx}/{昵称}_{用户id}/{标题}_{笔记id}/info.json
+    多进程扫描, 主进程按大事务批量写入, 可以在爬虫运行时执行, 重复执行只会补全
+    用法: python reconcile.py [--root 媒体根目录] [--workers 8] [--batch 5000]
+"""
+
+# 之前解析不了只剩笔记id的行, 用磁盘上的 info.json 补全
+DELETE_STUB_SQL = 'DELETE FROM notes WHERE note_id = ? AND user_id IS NULL'
+UPDATE_NOTE_SQL = 'UPDATE notes SET media_dir = ?, media_complete = ? WHERE note_id = ?'
+UPDATE_MEDIA_SQL = 'UPDATE media SET file_size = ? WHERE note_id = ? AND idx = ?'
+
+
+def list_user_dirs(root):
+    """第二层的 {昵称}_{用户id} 目录, 返回 [(track, 目录), ...]"""
+    user_dirs = []
+    for track in os.scandir(root):
+        if not track.is_dir() or track.name.startswith('.'):
+            continue
+        for user_dir in os.scandir(track.path):
+            if user_dir.is_dir():
+                user_dirs.append((track.name, user_dir.path))
+    return user_dirs
+
+
+def scan_note_dir(note_dir):
+    """
+        读取一个笔记目录, 返回 (note_info, {序号: 文件大小}, 是否齐全)
+        没有 info.json 或解析失败返回 None
+        文件大小为 0 或还有 .part 的算没下载完
+    """
+    try:
+        with open(os.path.join(note_dir, 'info.json'), encoding='utf-8') as f:
+            note_info = json.loads(f.readline())
+        sizes = {entry.name: entry.stat().st_size for entry in os.scandir(note_dir) if entry.is_file()}
+        files = note_media_files(note_info)
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    present = {}
+    for idx, file_name, _, _ in files:
+        if sizes.get(file_name) and file_name + '.part' not in sizes:
+            present[idx] = sizes[file_name]
+    return note_info, present, len(present) == len(files)
+
+
+def scan_user_dirs(user_dirs):
+    """子进程里执行, 扫描一批用户目录, 返回 [(track, 笔记目录, note_info, 文件大小, 是否齐全), ...]"""
+    records = []
+    for track, user_dir in user_dirs:
+        try:
+            note_dirs = [entry.path for entry in os.scandir(user_dir) if entry.is_dir()]
+        except OSError:
+            continue
+        for note_dir in note_dirs:
+            result = scan_note_dir(note_dir)
+            if result is not None:
+                records.append((track, note_dir) + result)
+    return records
+
+
+def write_records(conn, records):
+    """一批笔记在一个事务里写入"""
+    with conn:
+        for track, note_dir, note_info, present, complete in records:
+            note_id = note_info['note_id']
+            conn.execute(DELETE_STUB_SQL, (note_id,))
+            for sql, params in note_statements(note_id, note_info.get('note_url'), note_info, track):
+                conn.execute(sql, params)
+            conn.execute(UPDATE_NOTE_SQL, (note_dir, int(complete), note_id))
+            conn.executemany(UPDATE_MEDIA_SQL, [(size, note_id, idx) for idx, size in present.items()])
+
+
+def reconcile(root, db_path=DB_PATH, workers=None, batch=5000, chunk=50):
+    """
+        扫描 root 下所有笔记目录写入数据库
+        :param workers: 扫描进程数, 默认 CPU 核数
+        :param batch: 每个事务写入的笔记数
+        :param chunk: 每个子任务扫描的用户目录数
+        返回 (笔记数, 媒体不全的笔记数)
+    """
+    start = time.perf_counter()
+    user_dirs = list_user_dirs(root)
+    logger.info(f'用户目录 {len(user_dirs)} 个, 开始扫描 {root}')
+    conn = init_db(db_path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    chunks = [user_dirs[i:i + chunk] for i in range(0, len(user_dirs), chunk)]
+    total = incomplete = 0
+    pending = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for records in executor.map(scan_user_dirs, chunks):
+            pending.extend(records)
+            incomplete += sum(1 for record in records if not record[4])
+            if len(pending) >= batch:
+                write_records(conn, pending)
+                total += len(pending)
+                pending = []
+                logger.info(f'已写入 {total} 篇 | {total / (time.perf_counter() - start):.0f} 篇/s')
+    write_records(conn, pending)
+    total += len(pending)
+    conn.close()
+    logger.info(f'补录完成 | 笔记 {total} 篇 | 媒体不全 {incomplete} 篇 | 用时 {time.perf_counter() - start:.1f}s')
+    return total, incomplete
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把磁盘上已有的笔记补录进数据库')
+    parser.add_argument('--root', help='媒体根目录, 默认使用 common_utils.init() 里的路径')
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--workers', type=int, default=None, help='扫描进程数, 默认 CPU 核数')
+    parser.add_argument('--batch', type=int, default=5000, help='每个事务写入的笔记数')
+    args = parser.parse_args(argv)
+    root = args.root
+    if root is None:
+        from xhs_utils.common_utils import init
+        root = init()[1]['media']
+    reconcile(root, args.db, args.workers, args.batch)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+// 嵌入式js引擎(V8/QuickJS)用的最小运行环境, 代替 node + jsdom
+// 只实现签名脚本实际用到的部分
+var global = globalThis;
+var self = globalThis;
+
+(function () {
+    var b64 = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/';
+
+    if (typeof globalThis.btoa !== 'function') {
+        globalThis.btoa = function (input) {
+            var str = String(input), out = '';
+            for (var i = 0; i < str.length; i += 3) {
+                var a = str.charCodeAt(i), b = str.charCodeAt(i + 1), c = str.charCodeAt(i + 2);
+                if (a > 255 || b > 255 || c > 255) {
+                    throw new Error('InvalidCharacterError: Invalid character');
+                }
+                var n = (a << 16) | ((b || 0) << 8) | (c || 0);
+                out += b64.charAt(n >> 18 & 63) + b64.charAt(n >> 12 & 63) +
+                    (i + 1 < str.length ? b64.charAt(n >> 6 & 63) : '=') +
+                    (i + 2 < str.length ? b64.charAt(n & 63) : '=');
+            }
+            return out;
+        };
+    }
+    if (typeof globalThis.atob !== 'function') {
+        globalThis.atob = function (input) {
+            var str = String(input).replace(/[\t\n\f\r =]/g, ''), out = '', buf = 0, bits = 0;
+            for (var i = 0; i < str.length; i++) {
+                var idx = b64.indexOf(str.charAt(i));
+                if (idx < 0) {
+                    throw new Error('InvalidCharacterError: Invalid character');
+                }
+                buf = (buf << 6) | idx;
+                bits += 6;
+                if (bits >= 8) {
+                    bits -= 8;
+                    out += String.fromCharCode(buf >> bits & 255);
+                }
+            }
+            return out;
+        };
+    }
+    if (typeof globalThis.console === 'undefined') {
+        globalThis.console = {};
+    }
+    ['log', 'info', 'debug', 'warn', 'error'].forEach(function (k) {
+        globalThis.console[k] = function () {};
+    });
+    // 签名脚本只注册定时器, 不依赖回调真正执行
+    // 引擎自带的定时器(py_mini_racer)会让context无法正常释放, 一律替换成空实现
+    globalThis.setTimeout = function () { return 0; };
+    globalThis.setInterval = function () { return 0; };
+    globalThis.clearTimeout = function () {};
+    globalThis.clearInterval = function () {};
+
+    function Element(tag) {
+        this.tagName = String(tag).toUpperCase();
+        this.nodeName = this.tagName;
+        this.attributes = {};
+        this.style = {};
+        this.childNodes = [];
+        this.children = this.childNodes;
+        this.innerHTML = '';
+        this.offsetHeight = 0;
+        this.offsetWidth = 0;
+    }
+    Element.prototype.getAttribute = function (k) {
+        return Object.prototype.hasOwnProperty.call(this.attributes, k) ? this.attributes[k] : null;
+    };
+    Element.prototype.setAttribute = function (k, v) {
+        this.attributes[k] = String(v);
+    };
+    Element.prototype.removeAttribute = function (k) {
+        delete this.attributes[k];
+    };
+    Element.prototype.appendChild = function (c) {
+        this.childNodes.push(c);
+        return c;
+    };
+    Element.prototype.removeChild = function (c) {
+        var i = this.childNodes.indexOf(c);
+        if (i >= 0) {
+            this.childNodes.splice(i, 1);
+        }
+        return c;
+    };
+    Element.prototype.remove = function () {};
+    Element.prototype.addEventListener = function () {};
+    Element.prototype.removeEventListener = function () {};
+    Element.prototype.getContext = function () { return null; };
+    Element.prototype.toDataURL = function () { return 'data:,'; };
+    Element.prototype.querySelector = function () { return null; };
+    Element.prototype.querySelectorAll = function () { return []; };
+    Element.prototype.getElementsByTagName = function () { return []; };
+
+    var html = new Element('html'), head = new Element('head'), body = new Element('body');
+    html.appendChild(head);
+    html.appendChild(body);
+    body.appendChild(new Element('p'));
+
+    function createWindow(url, userAgent) {
+        var win = Object.create(globalThis);
+        var match = /^(\w+:)\/\/([^/:]+)(:\d+)?(\/[^?#]*)?/.exec(url) || [];
+        var storage = {};
+        var localStorage = {
+            getItem: function (k) { return Object.prototype.hasOwnProperty.call(storage, k) ? storage[k] : null; },
+            setItem: function (k, v) { storage[k] = String(v); },
+            removeItem: function (k) { delete storage[k]; },
+            clear: function () { storage = {}; }
+        };
+        win.window = win;
+        win.self = win;
+        win.top = win;
+        win.parent = win;
+        win.document = {
+            cookie: '',
+            referrer: url,
+            URL: url,
+            readyState: 'complete',
+            documentElement: html,
+            head: head,
+            body: body,
+            createElement: function (tag) { return new Element(tag); },
+            getElementById: function () { return null; },
+            getElementsByTagName: function (tag) { return String(tag).toLowerCase() === 'p' ? body.childNodes : []; },
+            querySelector: function () { return null; },
+            querySelectorAll: function () { return []; },
+            addEventListener: function () {},
+            removeEventListener: function () {}
+        };
+        win.location = {
+            href: url,
+            origin: match[1] + '//' + match[2],
+            protocol: match[1],
+            host: match[2] + (match[3] || ''),
+            hostname: match[2],
+            port: (match[3] || '').slice(1),
+            pathname: match[4] || '/',
+            search: '',
+            hash: ''
+        };
+        win.navigator = {
+            userAgent: userAgent,
+            platform: 'Win32',
+            language: 'zh-CN',
+            languages: ['zh-CN', 'zh'],
+            webdriver: false,
+            cookieEnabled: true,
+            plugins: [],
+            mimeTypes: []
+        };
+        win.screen = { width: 1920, height: 1080, availWidth: 1920, availHeight: 1040, colorDepth: 24 };
+        win.localStorage = localStorage;
+        win.sessionStorage = localStorage;
+        win.addEventListener = function () {};
+        win.removeEventListener = function () {};
+        return win;
+    }
+
+    var jsdom = {
+        ResourceLoader: function (options) {
+            this.userAgent = options && options.userAgent;
+        },
+        JSDOM: function (markup, options) {
+            var ua = options && options.resources && options.resources.userAgent || '';
+            this.window = createWindow(options && options.url || 'about:blank', ua);
+        }
+    };
+
+    // xray 的两个 pack 文件已经由宿主提前执行, require 它们时什么都不用做
+    globalThis.require = function (name) {
+        if (name === 'jsdom') {
+            return jsdom;
+        }
+        if (/xhs_xray_pack\d\.js$/.test(name)) {
+            return {};
+        }
+        throw new Error('Cannot find module ' + name);
+    };
+})();
@@ -0,0 +1,57 @@
+// 常驻签名进程: 只加载一次签名脚本, 通过 stdin/stdout 按行收发 JSON
+// 请求: {"id": 1, "fn": "get_request_headers_params", "args": [api, data, a1]}
+// 响应: {"id": 1, "ok": true, "result": {...}} 或 {"id": 1, "ok": false, "error": "..."}
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const vm = require('vm');
+
+// stdout 是通信管道, 脚本里的 console.log 不能写进去
+console.log = function () {};
+console.info = function () {};
+console.debug = function () {};
+
+function load(file, names) {
+    const source = fs.readFileSync(path.join(__dirname, file), 'utf-8');
+    // 与 execjs 一样包在函数里执行, 两个脚本的顶层变量互不干扰
+    const wrapper = '(function (require) {\n' + source + '\n;return {' +
+        names.map(function (name) { return name + ': ' + name; }).join(', ') + '};\n})';
+    return vm.runInThisContext(wrapper, { filename: file })(require);
+}
+
+const fns = {};
+// xray 脚本会把 window 设为 global, 必须先于签名脚本加载
+Object.assign(fns, load('xhs_xray.js', ['traceId']));
+Object.assign(fns, load('xhs_xs_xsc_56.js', ['get_request_headers_params', 'get_request_headers_params_batch', 'get_xs']));
+
+function reply(msg) {
+    process.stdout.write(JSON.stringify(msg) + '\n');
+}
+
+const rl = readline.createInterface({ input: process.stdin, terminal: false });
+rl.on('line', function (line) {
+    if (!line.trim()) {
+        return;
+    }
+    let req;
+    try {
+        req = JSON.parse(line);
+    } catch (e) {
+        reply({ id: null, ok: false, error: 'invalid request: ' + e.message });
+        return;
+    }
+    try {
+        const fn = fns[req.fn];
+        if (typeof fn !== 'function') {
+            throw new Error('unknown function: ' + req.fn);
+        }
+        reply({ id: req.id, ok: true, result: fn.apply(null, req.args || []) });
+    } catch (e) {
+        reply({ id: req.id, ok: false, error: String(e && e.stack || e) });
+    }
+});
+rl.on('close', function () {
+    process.exit(0);
+});
+
+reply({ id: null, ok: true, ready: true });
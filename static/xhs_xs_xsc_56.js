@@ -3333,6 +3333,13 @@ function get_request_headers_params(api, data, a1){
     }
 }
 
+function get_request_headers_params_batch(reqs, a1){
+    // reqs: [[api, data], ...] 一次调用签名多个请求
+    return reqs.map(function (req) {
+        return get_request_headers_params(req[0], req[1], a1);
+    });
+}
+
 // let cc = "/api/sns/web/v1/note/like"
 //     let ii = {
 //         "note_oid": "6767de72000000001301984c"
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from apis import async_pc_apis
+from apis.async_pc_apis import AsyncXHS_Apis
+from xhs_utils import retry_util
+from xhs_utils.scheduler import TokenBucket
+
+BODY = bytes(range(256)) * 40
+
+
+def fake_sign(cookies_str, api, data=''):
+    return {'x-s': 'xs'}, {}, json.dumps(data) if data else data
+
+
+def bind(handler, seen):
+    async def route(request):
+        return await handler(request, seen)
+    return route
+
+
+async def run_server(routes, test):
+    """在本地起一个 aiohttp 服务, test(apis, server, seen) 里的请求都发到这个服务"""
+    seen = []
+    app = web.Application()
+    for method, path, handler in routes:
+        app.router.add_route(method, path, bind(handler, seen))
+    server = TestServer(app)
+    await server.start_server()
+    tokens = []
+
+    async def acquire():
+        tokens.append(len(tokens))
+    try:
+        async with AsyncXHS_Apis(acquire=acquire) as apis:
+            apis.base_url = str(server.make_url('')).rstrip('/')
+            await test(apis, server, seen)
+    finally:
+        await server.close()
+    return seen, tokens
+
+
+def api_responses(*responses):
+    """依次返回 responses 里的 (状态码, 内容)"""
+    responses = list(responses)
+
+    async def handler(request, seen):
+        seen.append(request.path)
+        status, body = responses.pop(0)
+        return web.Response(status=status, text=body if isinstance(body, str) else json.dumps(body))
+    return handler
+
+
+def test_retry_takes_a_token_per_attempt(monkeypatch):
+    monkeypatch.setattr(async_pc_apis, 'generate_request_params', fake_sign)
+    monkeypatch.setattr(retry_util, 'backoff_delay', lambda *args, **kwargs: 0)
+    results = []
+
+    async def test(apis, server, seen):
+        results.append(await apis.search_note('猫', 'a1=x'))
+    handler = api_responses((502, '<html>bad gateway</html>'), (200, {'success': True, 'msg': '成功', 'data': {'items': []}}))
+    seen, tokens = asyncio.run(run_server([('POST', '/api/sns/web/v1/search/notes', handler)], test))
+    assert results[0][0] is True
+    # 网络抖动重试一次, 每次请求前都拿了令牌
+    assert len(seen) == len(tokens) == 2
+
+
+def test_auth_failure_is_not_retried(monkeypatch):
+    monkeypatch.setattr(async_pc_apis, 'generate_request_params', fake_sign)
+    results = []
+
+    async def test(apis, server, seen):
+        results.append(await apis.get_user_note_info('u1', '', 'a1=x'))
+    handler = api_responses((200, {'success': False, 'msg': '未登录', 'code': -100}))
+    seen, tokens = asyncio.run(run_server([('GET', '/api/sns/web/v1/user_posted', handler)], test))
+    assert results[0][:2] == (False, '未登录')
+    assert len(seen) == len(tokens) == 1
+
+
+def test_token_bucket_spaces_requests():
+    bucket = TokenBucket(0.2)
+
+    async def main():
+        return await asyncio.gather(*[bucket.acquire_async() for _ in range(3)])
+    waits = sorted(asyncio.run(main()))
+    assert waits[0] == 0 and waits[2] > 0.3
+
+
+async def serve_media(request, seen):
+    seen.append(request.headers.get('Range'))
+    if request.headers.get('Range'):
+        start = int(request.headers['Range'][len('bytes='):-1])
+        if start >= len(BODY):
+            return web.Response(status=416, headers={'Content-Range': f'bytes */{len(BODY)}'})
+        return web.Response(status=206, body=BODY[start:],
+                            headers={'Content-Range': f'bytes {start}-{len(BODY) - 1}/{len(BODY)}'})
+    return web.Response(body=BODY)
+
+
+def download(tmp_path, part=None):
+    if part is not None:
+        (tmp_path / 'v.mp4.part').write_bytes(part)
+    results = []
+
+    async def test(apis, server, seen):
+        results.append(await apis.download_media(str(tmp_path), 'v', str(server.make_url('/v')), 'video'))
+    seen, tokens = asyncio.run(run_server([('GET', '/v', serve_media)], test))
+    assert results[0][0], results[0][1]
+    assert (tmp_path / 'v.mp4').read_bytes() == BODY
+    assert not (tmp_path / 'v.mp4.part').exists()
+    # 下载不占接口的令牌
+    assert tokens == []
+    return seen
+
+
+def test_download_media(tmp_path):
+    assert download(tmp_path) == [None]
+
+
+def test_download_media_resumes_part_file(tmp_path):
+    assert download(tmp_path, BODY[:1000]) == ['bytes=1000-']
+
+
+def test_download_media_complete_part_file(tmp_path):
+    assert download(tmp_path, BODY) == [f'bytes={len(BODY)}-']
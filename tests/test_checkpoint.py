@@ -0,0 +1,103 @@
+import pytest
+from apis.pc_apis import XHS_Apis
+from xhs_utils.db_util import NoteDB
+
+USER_URL = 'https://www.xiaohongshu.com/user/profile/5f2b6a3a0000000001006aa1?xsec_token=abc'
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = NoteDB(str(tmp_path / 'notes.db'))
+    yield db
+    db.close()
+
+
+def test_load_without_checkpoint(db):
+    checkpoint = db.checkpoint('user_posted:u1')
+    assert checkpoint.load() == ('', [])
+    assert checkpoint.recovered_pages == 0
+
+
+def test_save_then_load(db):
+    checkpoint = db.checkpoint('user_posted:u1')
+    checkpoint.load()
+    checkpoint.save('c1', [{'note_id': 'a'}, {'note_id': 'b'}])
+    checkpoint.save('c2', [{'note_id': 'c'}])
+    assert checkpoint.fetched_pages == 2
+
+    resumed = db.checkpoint('user_posted:u1')
+    assert resumed.load() == ('c2', [{'note_id': 'a'}, {'note_id': 'b'}, {'note_id': 'c'}])
+    assert (resumed.recovered_pages, resumed.recovered_items) == (2, 3)
+    # 续爬之后接着编号, 不覆盖已有的页
+    resumed.save('c3', [{'note_id': 'd'}])
+    assert db.checkpoint('user_posted:u1').load()[0] == 'c3'
+    assert len(db.checkpoint('user_posted:u1').load()[1]) == 4
+
+
+def test_jobs_are_separate(db):
+    db.checkpoint('comments:n1').save('c1', [{'id': 1}])
+    assert db.checkpoint('comments:n2').load() == ('', [])
+    assert db.checkpoint('comments:n1').load() == ('c1', [{'id': 1}])
+
+
+def test_clear(db):
+    checkpoint = db.checkpoint('comments:n1')
+    checkpoint.save('c1', [{'id': 1}])
+    checkpoint.clear()
+    assert db.checkpoint('comments:n1').load() == ('', [])
+    db.flush()
+    assert db.query('SELECT COUNT(*) FROM crawl_pages')[0][0] == 0
+
+
+def test_expired_checkpoint_is_dropped(db):
+    db.checkpoint('user_posted:u1').save('c1', [{'note_id': 'a'}])
+    db.write([("UPDATE crawl_checkpoints SET update_time = datetime('now', '-2 hours')", ())])
+    db.flush()
+    assert db.checkpoint('user_posted:u1').load() == ('c1', [{'note_id': 'a'}])
+
+    stale = db.checkpoint('user_posted:u1')
+    stale.max_age_hours = 1
+    assert stale.load() == ('', [])
+    assert stale.recovered_pages == 0
+    db.flush()
+    assert db.query('SELECT COUNT(*) FROM crawl_pages')[0][0] == 0
+
+
+def fake_user_pages(pages, fail_at=None):
+    """
+        假的 get_user_note_info, 第 fail_at 页(从 1 开始)请求失败
+        返回 (函数, 请求过的 cursor 列表)
+    """
+    calls = []
+
+    def get_user_note_info(user_id, cursor, cookies_str, xsec_token='', xsec_source='', proxies=None):
+        calls.append(cursor)
+        index = int(cursor or 0)
+        if fail_at is not None and index + 1 == fail_at:
+            return False, '网络错误', None
+        return True, 'success', {'data': {
+            'notes': [{'note_id': f'{index}-{i}'} for i in range(2)],
+            'cursor': str(index + 1),
+            'has_more': index + 1 < pages,
+        }}
+    return get_user_note_info, calls
+
+
+def test_user_notes_resume_after_failed_page(db):
+    apis = XHS_Apis()
+    apis.get_user_note_info, calls = fake_user_pages(5, fail_at=3)
+    success, msg, notes = apis.get_user_all_notes(USER_URL, '', checkpoint=db.checkpoint('user_posted:u1'))
+    assert not success
+    assert calls == ['', '1', '2']
+    assert len(notes) == 4
+
+    apis.get_user_note_info, calls = fake_user_pages(5)
+    checkpoint = db.checkpoint('user_posted:u1')
+    success, msg, notes = apis.get_user_all_notes(USER_URL, '', checkpoint=checkpoint)
+    assert success
+    # 从失败的第 3 页继续, 前两页不再请求
+    assert calls == ['2', '3', '4']
+    assert [note['note_id'] for note in notes] == [f'{p}-{i}' for p in range(5) for i in range(2)]
+    assert (checkpoint.recovered_pages, checkpoint.fetched_pages) == (2, 3)
+    # 成功后清除断点
+    assert db.checkpoint('user_posted:u1').load() == ('', [])
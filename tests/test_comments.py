@@ -0,0 +1,104 @@
+import time
+import urllib.parse
+from apis import pc_apis
+from apis.pc_apis import XHS_Apis
+
+NOTE_URL = 'https://www.xiaohongshu.com/explore/n1?xsec_token=tok'
+
+
+class FakeResponse():
+    def __init__(self, res_json):
+        self.res_json = res_json
+
+    def json(self):
+        return self.res_json
+
+
+class FakeSession():
+    """
+        一级评论两页, 每页两条; c1/c3 还有二级评论, 各两页
+        记录每次请求的路径和 x-s
+    """
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, headers=None, cookies=None, proxies=None):
+        path = url.split('edith.xiaohongshu.com')[1]
+        self.requests.append((path, headers['x-s']))
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(path).query, keep_blank_values=True))
+        if path.startswith('/api/sns/web/v2/comment/page'):
+            page = int(params['cursor'] or 0)
+            comments = [{'id': f'c{page * 2 + i + 1}', 'note_id': 'n1', 'sub_comments': [],
+                         'sub_comment_cursor': 's0', 'sub_comment_has_more': (page * 2 + i) % 2 == 0}
+                        for i in range(2)]
+            data = {'comments': comments, 'cursor': str(page + 1), 'has_more': page == 0}
+        else:
+            page = int(params['cursor'][1:])
+            data = {'comments': [{'id': f"{params['root_comment_id']}-{page}"}], 'cursor': f's{page + 1}',
+                    'has_more': page == 0}
+        return FakeResponse({'success': True, 'msg': '成功', 'data': data})
+
+
+def fake_signing(monkeypatch):
+    """单个签名的 x-s 为 single:<api>, 批量签名的为 batch:<api>, 返回每次批量签名的请求列表"""
+    batches = []
+
+    def generate_request_params(cookies_str, api, data=''):
+        return {'x-s': f'single:{api}'}, {}, data
+
+    def generate_request_params_batch(cookies_str, reqs):
+        batches.append([api for api, data in reqs])
+        return [({'x-s': f'batch:{api}', 'x-t': str(int(time.time() * 1000))}, data) for api, data in reqs], {}
+    monkeypatch.setattr(pc_apis, 'generate_request_params', generate_request_params)
+    monkeypatch.setattr(pc_apis, 'generate_request_params_batch', generate_request_params_batch)
+    return batches
+
+
+def test_sub_comment_first_pages_are_signed_per_page(monkeypatch):
+    batches = fake_signing(monkeypatch)
+    apis = XHS_Apis(session=FakeSession())
+    success, msg, comments = apis.get_note_all_comment(NOTE_URL, 'a1=x')
+    assert success, msg
+    assert [comment['id'] for comment in comments] == ['c1', 'c2', 'c3', 'c4']
+    assert [[sub['id'] for sub in comment['sub_comments']] for comment in comments] == [
+        ['c1-0', 'c1-1'], [], ['c3-0', 'c3-1'], []]
+
+    # 每页一级评论一次批量签名, 只包含还有二级评论的
+    assert [[urllib.parse.parse_qs(api.split('?')[1])['root_comment_id'] for api in batch] for batch in batches] == [
+        [['c1']], [['c3']]]
+    sub_requests = [(path, xs) for path, xs in apis.session.requests if path.startswith('/api/sns/web/v2/comment/sub')]
+    # 第一页二级评论用提前签好的, 之后的页 cursor 依赖上一页, 单独签名
+    assert [xs.split(':')[0] for path, xs in sub_requests] == ['batch', 'single', 'batch', 'single']
+    assert all(xs.split(':', 1)[1] == path for path, xs in sub_requests)
+
+
+def test_presigned_request_is_used_once():
+    apis = XHS_Apis()
+    comment = {'id': 'c1', 'note_id': 'n1', 'sub_comment_cursor': 's0'}
+    api = apis.inner_comment_api(comment, 's0', 'tok')
+    signed = {'c1': (api, {'x-s': 'batch', 'x-t': str(int(time.time() * 1000))}, {})}
+    apis.session = FakeSession()
+    apis.get_note_inner_comment(comment, 's0', 'tok', 'a1=x', signed=signed)
+    # 用过即移除, 退避重试时重新签名
+    assert signed == {}
+    assert apis.session.requests == [(api, 'batch')]
+
+
+def test_expired_presigned_request_is_signed_again(monkeypatch):
+    fake_signing(monkeypatch)
+    apis = XHS_Apis(session=FakeSession())
+    comment = {'id': 'c1', 'note_id': 'n1', 'sub_comment_cursor': 's0'}
+    api = apis.inner_comment_api(comment, 's0', 'tok')
+    stale = str(int((time.time() - pc_apis.SIGN_CACHE_TTL - 1) * 1000))
+    apis.get_note_inner_comment(comment, 's0', 'tok', 'a1=x', signed={'c1': (api, {'x-s': 'batch', 'x-t': stale}, {})})
+    assert apis.session.requests == [(api, f'single:{api}')]
+
+
+def test_every_comment_page_is_throttled(monkeypatch):
+    fake_signing(monkeypatch)
+    apis = XHS_Apis(session=FakeSession())
+    tokens = []
+    success, msg, comments = apis.get_note_all_comment(NOTE_URL, 'a1=x', acquire=lambda: tokens.append(len(tokens)))
+    assert success, msg
+    # 一级评论两页, 两条一级评论各两页二级评论
+    assert len(tokens) == len(apis.session.requests) == 6
@@ -0,0 +1,33 @@
+import os
+import pytest
+from xhs_utils.data_util import download_note, materialize_existing
+from xhs_utils.db_util import NoteDB
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = NoteDB(str(tmp_path / 'notes.db'))
+    yield db
+    db.close()
+
+
+def test_stub_note_is_not_materialized(db, tmp_path):
+    # 迁移时解析不了的旧数据
+    stub = {'note_id': 'n1', 'note_url': 'https://www.xiaohongshu.com/explore/n1'}
+    assert materialize_existing(db, stub, str(tmp_path / '关键词')) == 0
+    db.flush()
+    assert db.query('SELECT track, note_id FROM note_tracks') == [('关键词', 'n1')]
+
+
+def test_materialize_links_downloaded_note(db, tmp_path):
+    note_info = {'note_id': 'n2', 'note_url': 'https://www.xiaohongshu.com/explore/n2', 'note_type': '图集',
+                 'user_id': 'u1', 'home_url': '', 'nickname': '作者', 'avatar': '', 'title': '标题', 'desc': '',
+                 'liked_count': 1, 'collected_count': 0, 'comment_count': 0, 'share_count': 0,
+                 'video_cover': None, 'video_addr': None, 'image_list': [], 'tags': [],
+                 'upload_time': '', 'ip_location': ''}
+    db.save_note('n2', note_info['note_url'], note_info)
+    src_dir = download_note(note_info, str(tmp_path / 'user'))
+    db.set_media_dir('n2', src_dir, True)
+    db.flush()
+    assert materialize_existing(db, note_info, str(tmp_path / '关键词')) >= 1
+    assert os.path.exists(str(tmp_path / '关键词' / '作者_u1' / '标题_n2' / 'info.json'))
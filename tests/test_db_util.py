@@ -0,0 +1,63 @@
+import sqlite3
+import pytest
+from xhs_utils import db_util
+from xhs_utils.db_util import DBWriteError, NoteDB, init_db, note_statements
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = NoteDB(str(tmp_path / 'notes.db'))
+    yield db
+    db.close()
+
+
+def test_flush_raises_write_errors_once(db):
+    db.write([('INSERT INTO missing_table VALUES (1)', ())], key=('notes', 'bad'))
+    db.write([('INSERT OR IGNORE INTO note_tracks (track, note_id) VALUES (?,?)', ('t', 'good'))])
+    with pytest.raises(DBWriteError) as info:
+        db.flush()
+    assert [key for key, _ in info.value.errors] == [('notes', 'bad')]
+    # 同批的其他写入照常提交, 报过的错误不再重复抛出
+    assert db.query('SELECT note_id FROM note_tracks') == [('good',)]
+    db.flush()
+
+
+def test_checkpoint_load_leaves_errors_for_flush(db):
+    db.write([('INSERT INTO missing_table VALUES (1)', ())])
+    assert db.checkpoint('comments:n1').load() == ('', [])
+    with pytest.raises(DBWriteError):
+        db.flush()
+
+
+def test_failed_migration_rolls_back(tmp_path, monkeypatch):
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE downloaded_notes (url TEXT PRIMARY KEY, note_info TEXT)')
+    conn.executemany('INSERT INTO downloaded_notes VALUES (?,?)',
+                     [(f'https://www.xiaohongshu.com/explore/n{i}', str({'note_id': f'n{i}'})) for i in range(3)])
+    conn.commit()
+    conn.close()
+
+    calls = []
+
+    def broken_note_statements(note_id, url, note_info, track=None):
+        calls.append(note_id)
+        if len(calls) == 2:
+            raise RuntimeError('迁移到一半失败')
+        return note_statements(note_id, url, note_info, track)
+    monkeypatch.setattr(db_util, 'note_statements', broken_note_statements)
+    with pytest.raises(RuntimeError):
+        init_db(path)
+
+    # 建表和已转换的行一起回滚, 停在迁移 1
+    conn = sqlite3.connect(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == 1
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {'downloaded_notes'}
+    conn.close()
+
+    monkeypatch.undo()
+    conn = init_db(path)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == len(db_util.MIGRATIONS)
+    assert conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0] == 3
+    conn.close()
@@ -0,0 +1,47 @@
+import base64
+import json
+import re
+import pytest
+from xhs_utils.xray_util import generate_xray_traceid
+
+pytest.importorskip('py_mini_racer')
+from xhs_utils.embedded_signer import EmbeddedSigner  # noqa: E402
+
+A1 = '189d533c32bwp462awbnt4domm5ahdx406sgskfho50000420914'
+API = '/api/sns/web/v1/feed'
+
+
+@pytest.fixture(scope='module')
+def signer():
+    signer = EmbeddedSigner()
+    yield signer
+    signer.close()
+
+
+def test_headers_params_are_well_formed(signer):
+    ret = signer.call('get_request_headers_params', API, {'source_note_id': '6767de72000000001301984c'}, A1)
+    assert isinstance(ret['xt'], int) and len(str(ret['xt'])) == 13
+    # xs: XYW_ + base64(json), 只有 xhs_dom_shim.js 补齐了浏览器环境才能算出 payload
+    assert ret['xs'].startswith('XYW_')
+    xs = json.loads(base64.b64decode(ret['xs'][4:]))
+    assert xs['signSvn'] == '56' and xs['appId'] == 'xhs-pc-web'
+    assert re.fullmatch(r'[0-9a-f]+', xs['payload'])
+    assert re.fullmatch(r'[A-Za-z0-9+/=]{100,}', ret['xs_common'])
+
+
+def test_signature_depends_on_request(signer):
+    first = signer.call('get_request_headers_params', API, '', A1)
+    second = signer.call('get_request_headers_params', API + '?page=2', '', A1)
+    assert first['xs'] != second['xs']
+
+
+def test_batch_matches_single_shape(signer):
+    rets = signer.call('get_request_headers_params_batch', [[API, ''], [API + '?page=2', '']], A1)
+    assert len(rets) == 2 and all(ret['xs'].startswith('XYW_') for ret in rets)
+
+
+def test_xray_traceid_runs_in_shim(signer):
+    traceid = signer.call('traceId', 1729240000123)
+    assert re.fullmatch(r'[0-9a-f]{32}', traceid)
+    # 前40位只由时间戳决定
+    assert traceid[:10] == generate_xray_traceid(1729240000123, 0, 0)[:10]
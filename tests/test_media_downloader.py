@@ -0,0 +1,69 @@
+import threading
+from xhs_utils.media_downloader import CHUNK_SIZE, ByteBudget, fetch_media
+
+
+class FakeResponse():
+    def __init__(self, body, headers, on_chunk=None):
+        self.body = body
+        self.headers = headers
+        self.status_code = 200
+        self.on_chunk = on_chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            if self.on_chunk is not None:
+                self.on_chunk()
+            yield self.body[start:start + chunk_size]
+
+
+class FakeSession():
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, **kwargs):
+        return self.response
+
+
+def download(tmp_path, body, headers, budget):
+    used = []
+    res = FakeResponse(body, headers, on_chunk=lambda: used.append(budget.used))
+    fetch_media(str(tmp_path), 'v', 'https://sns-video.xhscdn.com/v', 'video', FakeSession(res), budget)
+    assert (tmp_path / 'v.mp4').read_bytes() == body
+    return used
+
+
+def test_budget_reserves_content_length(tmp_path):
+    budget = ByteBudget(64 * CHUNK_SIZE)
+    body = b'x' * (3 * CHUNK_SIZE + 5)
+    used = download(tmp_path, body, {'Content-Length': str(len(body))}, budget)
+    assert set(used) == {len(body)}
+    assert budget.used == 0
+
+
+def test_budget_without_content_length(tmp_path):
+    budget = ByteBudget(64 * CHUNK_SIZE)
+    assert set(download(tmp_path, b'x' * 10, {}, budget)) == {CHUNK_SIZE}
+
+
+def test_budget_blocks_large_downloads():
+    budget = ByteBudget(100)
+    entered = threading.Event()
+
+    def second_download():
+        with budget.hold(80):
+            entered.set()
+
+    with budget.hold(80):
+        threading.Thread(target=second_download, daemon=True).start()
+        # 80 + 80 超过上限, 第二个下载要等第一个结束
+        assert not entered.wait(0.2)
+    assert entered.wait(2)
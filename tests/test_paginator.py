@@ -0,0 +1,181 @@
+import threading
+from apis.paginator import Paginator, next_page, reached_note
+from apis.pc_apis import XHS_Apis
+
+
+class FakeFetch():
+    """
+        按 cursor 返回预先准备好的页, cursor 为 '' / '1' / '2' ...
+        :param pages: 每页的条目列表
+        :param fail_at: 这些页(从 0 开始)第一次请求时失败
+    """
+    def __init__(self, pages, fail_at=()):
+        self.pages = pages
+        self.fail_at = set(fail_at)
+        self.calls = []
+        self.threads = set()
+
+    def __call__(self, cursor):
+        self.calls.append(cursor)
+        self.threads.add(threading.get_ident())
+        index = int(cursor or 0)
+        if index in self.fail_at:
+            self.fail_at.discard(index)
+            return False, f'第{index}页失败', None
+        return True, 'success', {'data': {
+            'notes': self.pages[index],
+            'cursor': str(index + 1),
+            'has_more': index + 1 < len(self.pages),
+        }}
+
+
+def test_collects_all_pages():
+    fetch = FakeFetch([[1, 2], [3, 4], [5]])
+    success, msg, items = Paginator(fetch, 'notes').collect()
+    assert (success, items) == (True, [1, 2, 3, 4, 5])
+    assert fetch.calls == ['', '1', '2']
+
+
+def test_page_number_strategy():
+    def fetch(page):
+        return True, 'success', {'data': {'items': [page * 10], 'has_more': page < 3}}
+    paginator = Paginator(fetch, 'items', 1, get_next=next_page)
+    assert paginator.collect() == (True, 'success', [10, 20, 30])
+    assert paginator.cursor == 4
+
+
+def test_limit_stops_requesting():
+    fetch = FakeFetch([[1, 2], [3, 4], [5, 6]])
+    assert Paginator(fetch, 'notes', limit=3).collect()[2] == [1, 2, 3]
+    assert fetch.calls == ['', '1']
+
+
+def test_stop_on_empty_page():
+    fetch = FakeFetch([[1], [], [2]])
+    assert Paginator(fetch, 'notes', stop_on_empty='page').collect()[2] == [1]
+    assert fetch.calls == ['', '1']
+
+
+def test_stop_on_empty_total():
+    fetch = FakeFetch([[], [1]])
+    assert Paginator(fetch, 'notes', stop_on_empty='total').collect() == (True, 'success', [])
+    assert fetch.calls == ['']
+
+
+def test_break_and_resume_from_cursor():
+    fetch = FakeFetch([[1, 2], [3, 4], [5, 6]])
+    paginator = Paginator(fetch, 'notes')
+    seen = []
+    for item in paginator:
+        seen.append(item)
+        if item == 3:
+            break
+    # cursor 指向还没消费完的第二页
+    assert paginator.cursor == '1'
+    seen = seen[:2] + list(Paginator(fetch, 'notes', paginator.cursor))
+    assert seen == [1, 2, 3, 4, 5, 6]
+
+
+def test_failed_page_in_the_middle():
+    fetch = FakeFetch([[1, 2], [3, 4], [5, 6]], fail_at=[1])
+    pages = []
+    paginator = Paginator(fetch, 'notes', on_page=lambda cursor, items: pages.append((cursor, items)))
+    success, msg, items = paginator.collect()
+    assert (success, msg, items) == (False, '第1页失败', [1, 2])
+    assert paginator.cursor == '1'
+    assert pages == [('1', [1, 2])]
+    # 从失败的那一页重新开始
+    assert list(paginator) == [3, 4, 5, 6]
+
+
+def test_fetch_exception_is_a_failure():
+    def fetch(cursor):
+        raise ConnectionError('断网')
+    assert Paginator(fetch, 'notes').collect() == (False, '断网', [])
+
+
+def test_missing_items_key_is_a_failure():
+    def fetch(cursor):
+        return True, 'success', {'data': {'has_more': False}}
+    success, msg, items = Paginator(fetch, 'notes').collect()
+    assert not success and 'notes' in msg
+
+
+def test_missing_items_key_allowed():
+    def fetch(cursor):
+        return True, 'success', {'data': {}}
+    paginator = Paginator(fetch, 'items', has_more_key=None, allow_missing_items=True)
+    assert paginator.collect() == (True, 'success', [])
+    assert paginator.done
+
+
+def test_missing_has_more_is_a_failure():
+    def fetch(cursor):
+        return True, 'success', {'data': {'notes': [1], 'cursor': '1'}}
+    success, msg, items = Paginator(fetch, 'notes').collect()
+    assert not success and 'has_more' in msg
+
+
+def test_prefetch_requests_next_page_in_background():
+    fetch = FakeFetch([[1, 2], [3, 4], [5]])
+    assert Paginator(fetch, 'notes', prefetch=True).collect() == (True, 'success', [1, 2, 3, 4, 5])
+    assert fetch.calls == ['', '1', '2']
+    assert len(fetch.threads) == 2
+
+
+def test_prefetch_with_failed_page():
+    fetch = FakeFetch([[1], [2], [3]], fail_at=[1])
+    paginator = Paginator(fetch, 'notes', prefetch=True)
+    assert paginator.collect() == (False, '第1页失败', [1])
+    assert list(paginator) == [2, 3]
+
+
+def test_stop_when_and_on_page():
+    newest = '%08x' % 200 + '0' * 16
+    notes = [[{'note_id': '%08x' % t + '0' * 16} for t in (300, 250)],
+             [{'note_id': '%08x' % t + '0' * 16} for t in (210, 200, 150)],
+             [{'note_id': '%08x' % 100 + '0' * 16}]]
+    fetch = FakeFetch(notes)
+    pages = []
+    paginator = Paginator(fetch, 'notes', stop_when=reached_note(newest),
+                          on_page=lambda cursor, items: pages.append(cursor))
+    items = paginator.collect()[2]
+    assert [item['note_id'][:8] for item in items] == ['%08x' % t for t in (300, 250, 210)]
+    assert paginator.stopped and paginator.done
+    # 停在第二页中间, 不再翻页, 第二页也不记录断点
+    assert fetch.calls == ['', '1']
+    assert pages == ['1']
+
+
+def search_pages(pages, key='items'):
+    """按页码返回搜索结果, 翻到底的那页和搜索接口一样不带 items/users"""
+    calls = []
+
+    def fetch(page):
+        calls.append(page)
+        if page > len(pages):
+            return True, 'success', {'data': {'has_more': False}}
+        return True, 'success', {'data': {key: pages[page - 1], 'has_more': True}}
+    return fetch, calls
+
+
+def test_search_page_without_items_ends_results():
+    fetch, calls = search_pages([[1, 2], [3]])
+    paginator = Paginator(fetch, 'items', 1, get_next=next_page, allow_missing_items=True)
+    assert paginator.collect() == (True, 'success', [1, 2, 3])
+    assert calls == [1, 2, 3]
+
+
+def test_search_without_any_results():
+    fetch, calls = search_pages([], key='users')
+    assert Paginator(fetch, 'users', 1, get_next=next_page, allow_missing_items=True).collect() == (True, 'success', [])
+
+
+def test_search_some_note_and_user_end_without_items():
+    apis = XHS_Apis()
+    fetch, _ = search_pages([[{'id': 'n1'}], [{'id': 'n2'}]])
+    apis.search_note = lambda query, cookies_str, page, sort, note_type, proxies: fetch(page)
+    assert apis.search_some_note('猫', 10, '') == (True, 'success', [{'id': 'n1'}, {'id': 'n2'}])
+    fetch, _ = search_pages([[{'id': 'u1'}]], key='users')
+    apis.search_user = lambda query, cookies_str, page, proxies: fetch(page)
+    assert apis.search_some_user('猫', 10, '') == (True, 'success', [{'id': 'u1'}])
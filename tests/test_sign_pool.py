@@ -0,0 +1,79 @@
+import shutil
+import threading
+import time
+import pytest
+from xhs_utils import sign_pool
+from xhs_utils.sign_pool import SignWorker, SignWorkerError, SignWorkerPool
+
+pytestmark = pytest.mark.skipif(shutil.which('node') is None, reason='没有安装 node')
+
+# 和 xhs_sign_worker.js 一样按行收发, hang 永远不回复, 其他函数原样返回参数
+FAKE_WORKER = '''
+const readline = require('readline');
+process.stdout.write(JSON.stringify({ready: true}) + '\\n');
+readline.createInterface({input: process.stdin}).on('line', function (line) {
+    const req = JSON.parse(line);
+    if (req.fn !== 'hang') {
+        process.stdout.write(JSON.stringify({id: req.id, ok: true, result: req.args}) + '\\n');
+    }
+});
+'''
+
+
+@pytest.fixture
+def fake_worker(tmp_path, monkeypatch):
+    script = tmp_path / 'fake_worker.js'
+    script.write_text(FAKE_WORKER, encoding='utf-8')
+    monkeypatch.setattr(sign_pool, 'WORKER_SCRIPT', str(script))
+    monkeypatch.setattr(sign_pool, 'STATIC_DIR', str(tmp_path))
+
+
+def test_call_times_out_and_kills_worker(fake_worker):
+    worker = SignWorker(timeout=0.5)
+    assert worker.call('echo', 1, 'a') == [1, 'a']
+    start = time.monotonic()
+    with pytest.raises(SignWorkerError):
+        worker.call('hang')
+    assert time.monotonic() - start < 5
+    assert not worker.alive()
+
+
+def test_pool_respawns_after_timeout(fake_worker):
+    pool = SignWorkerPool(size=1, timeout=0.5)
+    try:
+        # 重启后重试仍然超时, 异常抛给调用方, 进程名额归还
+        with pytest.raises(SignWorkerError):
+            pool.call('hang')
+        assert pool.started == 0
+        assert pool.call('echo', 'ok') == ['ok']
+    finally:
+        pool.close()
+
+
+def test_waiting_call_wakes_when_respawn_fails(fake_worker):
+    pool = SignWorkerPool(size=1, timeout=0.5)
+    pool.warmup()
+    results = {}
+
+    def call(name, fn):
+        try:
+            results[name] = pool.call(fn)
+        except Exception as e:
+            results[name] = e
+
+    busy = threading.Thread(target=call, args=('busy', 'hang'), daemon=True)
+    busy.start()
+    time.sleep(0.1)
+    # 占着唯一进程的调用超时后重启失败, 等待中的调用不能一直卡住
+    pool.node_path = '/nonexistent/node'
+    waiting = threading.Thread(target=call, args=('waiting', 'echo'), daemon=True)
+    waiting.start()
+    busy.join(timeout=10)
+    waiting.join(timeout=10)
+    try:
+        assert not waiting.is_alive()
+        assert isinstance(results['busy'], Exception)
+        assert isinstance(results['waiting'], Exception)
+        assert pool.started == 0
+    finally:
+        pool.close()
@@ -0,0 +1,70 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import pytest
+from xhs_utils import xray_util
+from xhs_utils.xray_util import MAX_SEQ, generate_x_b3_traceid, generate_xray_traceid, next_seq
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+
+# (毫秒时间戳, 序号, 64位随机数, traceId), 由 static/xhs_xray.js 的 traceId 生成:
+# 固定 Int.SEQ 为序号, Math.random 依次返回随机数的低32位和高32位
+# 包含 (时间戳 << 23) 超过64位被截断的情况
+VECTORS = [
+    (0, 0, 0x0000000000000000, '00000000000000000000000000000000'),
+    (1, 1, 0x0000000000000001, '00000000008000010000000000000001'),
+    (1729240000123, 4194303, 0x123456789abcdef0, 'c94f5e333dbfffff123456789abcdef0'),
+    (1729240000123, 8388607, 0xffffffffffffffff, 'c94f5e333dffffffffffffffffffffff'),
+    (1729240000124, 0, 0x8000000000000001, 'c94f5e333e0000008000000000000001'),
+    (2199023255551, 77, 0x0badf00ddeadbeef, 'ffffffffff80004d0badf00ddeadbeef'),
+    (2199023267897, 8388000, 0xff00ff0000ff00ff, '000000181cfffda0ff00ff0000ff00ff'),
+    (4503599627370503, 123456, 0x2468ace013579bdf, '000000000381e2402468ace013579bdf'),
+]
+
+# 在 node 里按同样的方式重新生成上面的 traceId
+JS_TRACEIDS = '''
+console.log = function () {};
+const fs = require('fs'), vm = require('vm'), path = require('path');
+global.require = require('module').createRequire(path.join(process.cwd(), 'xhs_xray.js'));
+vm.runInThisContext(fs.readFileSync('./xhs_xray.js', 'utf8'));
+const Int = zc666(81422).Int;
+process.stdout.write(JSON.stringify(JSON.parse(process.argv[1]).map(function (c) {
+    const parts = [c[2], c[3]];
+    Int.SEQ = c[1];
+    Math.random = function () { return parts.shift() / 4294967296; };
+    return traceId(c[0]);
+})));
+'''
+
+
+@pytest.mark.parametrize('timestamp, seq, rand, expected', VECTORS)
+def test_xray_traceid_matches_js(timestamp, seq, rand, expected):
+    assert generate_xray_traceid(timestamp, seq, rand) == expected
+
+
+def test_xray_traceid_defaults():
+    first, second = generate_xray_traceid(), generate_xray_traceid()
+    assert re.fullmatch(r'[0-9a-f]{32}', first)
+    # 同一毫秒内靠序号区分
+    assert first[:16] != second[:16]
+
+
+def test_seq_wraps_like_js(monkeypatch):
+    monkeypatch.setattr(xray_util, '_seq', MAX_SEQ)
+    assert [next_seq(), next_seq(), next_seq()] == [MAX_SEQ, 0, 1]
+
+
+def test_x_b3_traceid():
+    assert re.fullmatch(r'[0-9a-f]{16}', generate_x_b3_traceid())
+    assert re.fullmatch(r'[0-9a-f]{32}', generate_x_b3_traceid(32))
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='没有安装 node')
+def test_vectors_still_match_js():
+    """xhs_xray.js 更新后重新核对, 不一致时按 JS 的输出更新 VECTORS"""
+    cases = [(timestamp, seq, rand & 0xffffffff, rand >> 32) for timestamp, seq, rand, _ in VECTORS]
+    out = subprocess.run(['node', '-e', JS_TRACEIDS, json.dumps(cases)], cwd=STATIC_DIR,
+                         capture_output=True, check=True, encoding='utf-8').stdout
+    assert json.loads(out) == [expected for *_, expected in VECTORS]
@@ -1,6 +1,15 @@
-def trans_cookies(cookies_str):
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def _parse_cookies(cookies_str):
     if '; ' in cookies_str:
         ck = {i.split('=')[0]: '='.join(i.split('=')[1:]) for i in cookies_str.split('; ')}
     else:
         ck = {i.split('=')[0]: '='.join(i.split('=')[1:]) for i in cookies_str.split(';')}
     return ck
+
+
+def trans_cookies(cookies_str):
+    # 同一个账号的cookies只解析一次, 返回副本避免调用方改到缓存
+    return dict(_parse_cookies(cookies_str))
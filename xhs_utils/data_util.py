@@ -3,17 +3,33 @@ import os
 import re
 import time
 import openpyxl
-import requests
 from loguru import logger
-from retry import retry
+from xhs_utils.media_downloader import fetch_media, get_downloader
+from xhs_utils.media_store import link_file
 
 
 def norm_str(str):
     new_str = re.sub(r"|[\\/:*?\"<>| ]+", "", str).replace('\n', '').replace('\r', '')
     return new_str
 
+COUNT_RE = re.compile(r"^(\d+\.?\d*)([万千]?)")
+
+def parse_count(count, default=0):
+    """点赞/收藏等数量转成整数: '1.2万' -> 12000, '10+' -> 10, 没有或解析不了返回 default"""
+    if isinstance(count, (int, float)):
+        return int(count)
+    match = COUNT_RE.match(str(count or '').replace(',', '').strip())
+    if not match:
+        return default
+    num, unit = match.groups()
+    return int(float(num) * {'万': 10000, '千': 1000}.get(unit, 1))
+
+# 已下载过的笔记出现在新的关键词/用户目录下时, 把已有的笔记目录硬链接过去
+MATERIALIZE_EXISTING = os.getenv('XHS_MATERIALIZE_EXISTING', '1') == '1'
+
+ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+
 def norm_text(text):
-    ILLEGAL_CHARACTERS_RE = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
     text = ILLEGAL_CHARACTERS_RE.sub(r'', text)
     return text
 
@@ -23,6 +39,15 @@ def timestamp_to_str(timestamp):
     dt = time.strftime("%Y-%m-%d %H:%M:%S", time_local)
     return dt
 
+def note_id_time(note_id):
+    """笔记id的前8位是发布时间的十六进制时间戳, 返回秒; 不是这种格式返回 None"""
+    if not isinstance(note_id, str) or len(note_id) != 24:
+        return None
+    try:
+        return int(note_id[:8], 16)
+    except ValueError:
+        return None
+
 def handle_user_info(data, user_id):
     home_url = f'https://www.xiaohongshu.com/user/profile/{user_id}'
     nickname = data['basic_info']['nickname']
@@ -175,35 +200,42 @@ def handle_comment_info(data):
         'ip_location': ip_location,
         'pictures': pictures,
     }
-def save_to_xlsx(datas, file_path, type='note'):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    if type == 'note':
-        headers = ['笔记id', '笔记url', '笔记类型', '用户id', '用户主页url', '昵称', '头像url', '标题', '描述', '点赞数量', '收藏数量', '评论数量', '分享数量', '视频封面url', '视频地址url', '图片地址url列表', '标签', '上传时间', 'ip归属地']
-    elif type == 'user':
-        headers = ['用户id', '用户主页url', '用户名', '头像url', '小红书号', '性别', 'ip地址', '介绍', '关注数量', '粉丝数量', '作品被赞和收藏数量', '标签']
-    else:
-        headers = ['笔记id', '笔记url', '评论id', '用户id', '用户主页url', '昵称', '头像url', '评论内容', '评论标签', '点赞数量', '上传时间', 'ip归属地', '图片地址url列表']
-    ws.append(headers)
+XLSX_HEADERS = {
+    'note': ['笔记id', '笔记url', '笔记类型', '用户id', '用户主页url', '昵称', '头像url', '标题', '描述', '点赞数量', '收藏数量', '评论数量', '分享数量', '视频封面url', '视频地址url', '图片地址url列表', '标签', '上传时间', 'ip归属地'],
+    'user': ['用户id', '用户主页url', '用户名', '头像url', '小红书号', '性别', 'ip地址', '介绍', '关注数量', '粉丝数量', '作品被赞和收藏数量', '标签'],
+    'comment': ['笔记id', '笔记url', '评论id', '用户id', '用户主页url', '昵称', '头像url', '评论内容', '评论标签', '点赞数量', '上传时间', 'ip归属地', '图片地址url列表'],
+}
+# Excel 每个工作表最多 1048576 行, 去掉表头
+XLSX_MAX_ROWS = 1048576 - 1
+
+def save_to_xlsx(datas, file_path, type='note', rows_per_sheet=XLSX_MAX_ROWS):
+    """
+        流式写入xlsx, 每行写完就落到临时文件, 内存占用和行数无关
+        :param datas: 字典的列表或生成器, 每个字典按字段顺序写成一行
+        :param type: note / user / comment, 决定表头
+        :param rows_per_sheet: 每个工作表最多的行数, 超过时接着写到新的工作表 Sheet2, Sheet3...
+        返回写入的行数
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    headers = XLSX_HEADERS.get(type, XLSX_HEADERS['comment'])
+    sub = ILLEGAL_CHARACTERS_RE.sub
+    ws = None
+    count = 0
     for data in datas:
-        data = {k: norm_text(str(v)) for k, v in data.items()}
-        ws.append(list(data.values()))
+        if count % rows_per_sheet == 0:
+            index = count // rows_per_sheet + 1
+            ws = wb.create_sheet('Sheet' if index == 1 else f'Sheet{index}')
+            ws.append(headers)
+        ws.append([sub('', v if isinstance(v, str) else str(v)) for v in data.values()])
+        count += 1
+    if ws is None:
+        wb.create_sheet('Sheet').append(headers)
     wb.save(file_path)
-    logger.info(f'数据保存至 {file_path}')
+    logger.info(f'数据保存至 {file_path} | {count} 行')
+    return count
 
 def download_media(path, name, url, type):
-    if type == 'image':
-        content = requests.get(url).content
-        with open(path + '/' + name + '.jpg', mode="wb") as f:
-            f.write(content)
-    elif type == 'video':
-        res = requests.get(url, stream=True)
-        size = 0
-        chunk_size = 1024 * 1024
-        with open(path + '/' + name + '.mp4', mode="wb") as f:
-            for data in res.iter_content(chunk_size=chunk_size):
-                f.write(data)
-                size += len(data)
+    fetch_media(path, name, url, type)
 
 def save_user_detail(user, path):
     with open(f'{path}/detail.txt', mode="w", encoding="utf-8") as f:
@@ -244,8 +276,8 @@ def save_note_detail(note, path):
         f.write(f"上传时间: {note['upload_time']}\n")
         f.write(f"ip归属地: {note['ip_location']}\n")
 
-@retry(tries=3, delay=1)
-def download_note(note_info, path):
+def note_dir(note_info, path):
+    """笔记保存的目录: {path}/{昵称}_{用户id}/{标题}_{笔记id}"""
     note_id = note_info['note_id']
     user_id = note_info['user_id']
     title = note_info['title']
@@ -254,23 +286,77 @@ def download_note(note_info, path):
     nickname = norm_str(nickname)
     if title.strip() == '':
         title = f'无标题'
-    save_path = f'{path}/{nickname}_{user_id}/{title}_{note_id}'
+    return f'{path}/{nickname}_{user_id}/{title}_{note_id}'
+
+def materialize_existing(db, note_info, save_path):
+    """
+        已下载的笔记出现在新的关键词/用户目录下时, 把已下载的笔记目录链接到 save_path 下, 不请求接口也不下载
+        已下载的目录取数据库里记录的 media_dir: 下载完成时写入, 更早下载的笔记用 reconcile.py 补录
+        :param db: NoteDB
+        返回链接的文件数, 当前目录下已经有、没有记录已下载的目录或者拼不出目录名时返回 0
+    """
+    note_id = note_info['note_id']
+    db.add_track(note_id, os.path.basename(save_path))
+    # 迁移时解析不了的旧数据只有笔记id和链接, 拼不出目录名
+    if any(key not in note_info for key in ('user_id', 'nickname', 'title')):
+        logger.debug(f'笔记 {note_id} 缺少作者或标题, 不链接')
+        return 0
+    dst_dir = note_dir(note_info, save_path)
+    if os.path.exists(f'{dst_dir}/info.json'):
+        return 0
+    src_dir = db.find_media_dir(note_id)
+    if not src_dir or not os.path.exists(f'{src_dir}/info.json'):
+        logger.debug(f'笔记 {note_id} 没有记录已下载的目录, 旧笔记可以先运行 reconcile.py')
+        return 0
+    count = materialize_note(src_dir, dst_dir)
+    logger.info(f'笔记已链接 {src_dir} -> {dst_dir} | 文件数: {count}')
+    return count
+
+def materialize_note(src_dir, dst_dir):
+    """
+        把已下载的笔记目录以硬链接的方式放到 dst_dir, 不发任何请求
+        跨盘时退回软链接/复制, 跳过没下载完的 .part 文件
+        返回链接的文件数
+    """
+    check_and_create_path(dst_dir)
+    count = 0
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        if name.endswith('.part') or not os.path.isfile(src):
+            continue
+        link_file(src, os.path.join(dst_dir, name), 'hardlink')
+        count += 1
+    return count
+
+def download_note(note_info, path):
+    save_path = note_dir(note_info, path)
     check_and_create_path(save_path)
     with open(f'{save_path}/info.json', mode='w', encoding='utf-8') as f:
         f.write(json.dumps(note_info) + '\n')
-    note_type = note_info['note_type']
     save_note_detail(note_info, save_path)
+    # 一篇笔记的所有媒体文件并发下载
+    jobs = [(save_path, os.path.splitext(file_name)[0], url, type) for _, file_name, url, type in note_media_files(note_info)]
+    get_downloader().download_all(jobs)
+    return save_path
+
+def note_media_files(note_info):
+    """
+        笔记目录里应有的媒体文件 [(序号, 文件名, url, type)]
+        图集是 image_{序号}.jpg, 跳过Live图; 视频是 cover.jpg 和 video.mp4
+    """
+    note_type = note_info['note_type']
+    files = []
     if note_type == '图集':
         for img_index, img_url in enumerate(note_info['image_list']):
             # 跳过Live图
             if "live" in img_url.lower():
-                print(f"跳过Live图: {img_url}")
+                logger.debug(f"跳过Live图: {img_url}")
                 continue
-            download_media(save_path, f'image_{img_index}', img_url, 'image')
+            files.append((img_index, f'image_{img_index}.jpg', img_url, 'image'))
     elif note_type == '视频':
-        download_media(save_path, 'cover', note_info['video_cover'], 'image')
-        download_media(save_path, 'video', note_info['video_addr'], 'video')
-    return save_path
+        files.append((0, 'cover.jpg', note_info['video_cover'], 'image'))
+        files.append((1, 'video.mp4', note_info['video_addr'], 'video'))
+    return files
 
 def check_and_create_path(path):
     if not os.path.exists(path):
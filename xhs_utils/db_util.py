@@ -0,0 +1,616 @@
+import ast
+import atexit
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import urllib.parse
+import zlib
+from loguru import logger
+from xhs_utils.data_util import note_id_time, parse_count, timestamp_to_str
+
+DB_PATH = os.getenv('XHS_DB_PATH', 'downloaded_notes.db')
+# 写线程攒够多少行或者等了多少毫秒就提交一次
+DB_BATCH_SIZE = int(os.getenv('XHS_DB_BATCH_SIZE', '200'))
+DB_BATCH_MS = float(os.getenv('XHS_DB_BATCH_MS', '200'))
+# 翻页断点超过多少小时不再续爬, cursor 可能已经失效
+CHECKPOINT_MAX_AGE_HOURS = float(os.getenv('XHS_CHECKPOINT_MAX_AGE_HOURS', '24'))
+
+SAVE_NOTE_SQL = '''INSERT OR IGNORE INTO notes
+    (note_id, url, note_type, user_id, title, liked_count, collected_count, comment_count, share_count,
+     upload_time, ip_location, payload)
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)'''
+SAVE_MEDIA_SQL = 'INSERT OR IGNORE INTO media (note_id, idx, type, url) VALUES (?,?,?,?)'
+SAVE_TRACK_SQL = 'INSERT OR IGNORE INTO note_tracks (track, note_id) VALUES (?,?)'
+# 笔记里只有昵称和头像, 不覆盖用户详情里的其他字段
+SAVE_NOTE_USER_SQL = '''INSERT INTO users (user_id, nickname, avatar) VALUES (?,?,?)
+    ON CONFLICT(user_id) DO UPDATE SET nickname = excluded.nickname, avatar = excluded.avatar'''
+SAVE_USER_SQL = '''INSERT OR REPLACE INTO users
+    (user_id, nickname, avatar, red_id, gender, ip_location, follows, fans, interaction, payload)
+    VALUES (?,?,?,?,?,?,?,?,?,?)'''
+SAVE_COMMENT_SQL = '''INSERT OR REPLACE INTO comments
+    (comment_id, note_id, user_id, like_count, upload_time, ip_location, content, payload)
+    VALUES (?,?,?,?,?,?,?,?)'''
+
+
+def note_id_from_url(url):
+    """
+        笔记链接里的笔记id, 去掉 xsec_token 等参数
+        https://www.xiaohongshu.com/explore/<note_id>?xsec_token=... -> <note_id>
+        不是链接时原样返回
+    """
+    path = urllib.parse.urlparse(url).path
+    return path.rstrip('/').split('/')[-1] if path else url
+
+
+def _execute_script(conn, script):
+    """
+        逐条执行建表语句
+        不能用 executescript: 它会先提交 migrate() 开启的事务, 之后的语句不在事务里, 迁移失败时回滚不掉
+    """
+    for sql in script.split(';'):
+        if sql.strip():
+            conn.execute(sql)
+
+
+def _migrate_note_id(conn):
+    """
+        downloaded_notes 改为以 note_id 为主键, 从旧的 url 回填
+        旧表的 url 有的带 xsec_token 有的不带, 同一篇笔记可能有多行, 只保留最早的一行
+    """
+    conn.create_function('note_id_from_url', 1, note_id_from_url, deterministic=True)
+    conn.execute('''CREATE TABLE downloaded_notes_new
+                    (note_id TEXT PRIMARY KEY,
+                     url TEXT,
+                     note_info TEXT,
+                     create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(downloaded_notes)')]
+    if columns:
+        create_time = 'create_time' if 'create_time' in columns else 'CURRENT_TIMESTAMP'
+        conn.execute(f'''INSERT OR IGNORE INTO downloaded_notes_new (note_id, url, note_info, create_time)
+                         SELECT note_id_from_url(url), url, note_info, {create_time}
+                         FROM downloaded_notes ORDER BY rowid''')
+        conn.execute('DROP TABLE downloaded_notes')
+    conn.execute('ALTER TABLE downloaded_notes_new RENAME TO downloaded_notes')
+
+
+def pack(data):
+    """原始数据压缩成 json 存库"""
+    return zlib.compress(json.dumps(data, ensure_ascii=False).encode('utf-8'))
+
+
+def unpack(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+
+def note_media(note_info):
+    """笔记的媒体列表 [(type, url)], 视频笔记是封面加视频"""
+    if note_info.get('note_type') == '视频':
+        return [('image', note_info.get('video_cover')), ('video', note_info.get('video_addr'))]
+    return [('image', url) for url in note_info.get('image_list') or []]
+
+
+def note_statements(note_id, url, note_info, track=None):
+    """记录一篇笔记要执行的 (sql, params) 列表: 笔记, 媒体, 作者, 所在目录"""
+    # 数量未知(比如迁移时解析不了的旧数据)存 NULL, 不当作 0
+    statements = [(SAVE_NOTE_SQL, (
+        note_id, url, note_info.get('note_type'), note_info.get('user_id'), note_info.get('title'),
+        parse_count(note_info.get('liked_count'), None), parse_count(note_info.get('collected_count'), None),
+        parse_count(note_info.get('comment_count'), None), parse_count(note_info.get('share_count'), None),
+        note_info.get('upload_time'), note_info.get('ip_location'), pack(note_info),
+    ))]
+    for idx, (type, media_url) in enumerate(note_media(note_info)):
+        statements.append((SAVE_MEDIA_SQL, (note_id, idx, type, media_url)))
+    if note_info.get('user_id'):
+        statements.append((SAVE_NOTE_USER_SQL, (note_info['user_id'], note_info.get('nickname'), note_info.get('avatar'))))
+    if track:
+        statements.append((SAVE_TRACK_SQL, (track, note_id)))
+    return statements
+
+
+def _migrate_structured(conn):
+    """
+        downloaded_notes 拆成 notes/users/comments/media/note_tracks, 原始数据压缩成 json
+        旧表里的 note_info 是 str(dict), 解析不了的只保留笔记id和链接
+    """
+    _execute_script(conn, '''
+        CREATE TABLE notes
+            (note_id TEXT PRIMARY KEY,
+             url TEXT,
+             note_type TEXT,
+             user_id TEXT,
+             title TEXT,
+             liked_count INTEGER,
+             collected_count INTEGER,
+             comment_count INTEGER,
+             share_count INTEGER,
+             upload_time TEXT,
+             ip_location TEXT,
+             payload BLOB,
+             create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE INDEX idx_notes_user_id ON notes (user_id);
+        CREATE INDEX idx_notes_upload_time ON notes (upload_time);
+        CREATE INDEX idx_notes_liked_count ON notes (liked_count);
+        CREATE TABLE users
+            (user_id TEXT PRIMARY KEY,
+             nickname TEXT,
+             avatar TEXT,
+             red_id TEXT,
+             gender TEXT,
+             ip_location TEXT,
+             follows INTEGER,
+             fans INTEGER,
+             interaction INTEGER,
+             payload BLOB,
+             update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE comments
+            (comment_id TEXT PRIMARY KEY,
+             note_id TEXT,
+             user_id TEXT,
+             like_count INTEGER,
+             upload_time TEXT,
+             ip_location TEXT,
+             content TEXT,
+             payload BLOB);
+        CREATE INDEX idx_comments_note_id ON comments (note_id);
+        CREATE INDEX idx_comments_user_id ON comments (user_id);
+        CREATE TABLE media
+            (note_id TEXT,
+             idx INTEGER,
+             type TEXT,
+             url TEXT,
+             PRIMARY KEY (note_id, idx));
+        CREATE TABLE note_tracks
+            (track TEXT,
+             note_id TEXT,
+             create_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+             PRIMARY KEY (track, note_id));
+        CREATE INDEX idx_note_tracks_note_id ON note_tracks (note_id);
+    ''')
+    converted = failed = 0
+    for note_id, url, note_info_str, create_time in conn.execute(
+            'SELECT note_id, url, note_info, create_time FROM downloaded_notes').fetchall():
+        try:
+            note_info = ast.literal_eval(note_info_str)
+            if not isinstance(note_info, dict):
+                raise ValueError(note_info_str[:50])
+            converted += 1
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+            note_info = {'note_id': note_id, 'note_url': url}
+            failed += 1
+        for sql, params in note_statements(note_id, url, note_info):
+            conn.execute(sql, params)
+        conn.execute('UPDATE notes SET create_time = ? WHERE note_id = ?', (create_time, note_id))
+    conn.execute('DROP TABLE downloaded_notes')
+    logger.info(f'已转换笔记 {converted} 篇, 无法解析 {failed} 篇')
+
+
+def _migrate_media_files(conn):
+    """
+        记录笔记目录和媒体文件是否齐全, 由 reconcile.py 扫描磁盘后填写
+        media.file_size 为空表示文件不存在或没下载完
+    """
+    conn.execute('ALTER TABLE media ADD COLUMN file_size INTEGER')
+    conn.execute('ALTER TABLE notes ADD COLUMN media_dir TEXT')
+    conn.execute('ALTER TABLE notes ADD COLUMN media_complete INTEGER')
+
+
+def _migrate_user_crawls(conn):
+    """
+        记录每个用户爬到的最新笔记和上次完整爬取的时间, 下次只取更新的笔记
+    """
+    conn.execute('''CREATE TABLE user_crawls
+                    (user_id TEXT PRIMARY KEY,
+                     newest_note_id TEXT,
+                     newest_note_time TEXT,
+                     last_complete_crawl TIMESTAMP)''')
+
+
+def _migrate_checkpoints(conn):
+    """
+        长翻页任务的断点: 下一页的 cursor 和已经取到的每一页
+    """
+    _execute_script(conn, '''
+        CREATE TABLE crawl_checkpoints
+            (job TEXT PRIMARY KEY,
+             cursor TEXT,
+             pages INTEGER,
+             update_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE crawl_pages
+            (job TEXT,
+             page INTEGER,
+             items BLOB,
+             PRIMARY KEY (job, page));
+    ''')
+
+
+def _migrate_unknown_counts(conn):
+    """
+        解析不了的旧数据之前把数量记成了 0, 改为 NULL 表示未知
+    """
+    conn.execute('''UPDATE notes SET liked_count = NULL, collected_count = NULL, comment_count = NULL, share_count = NULL
+                    WHERE user_id IS NULL''')
+
+
+# 按顺序执行, 执行到第几个记录在 PRAGMA user_version, 新的迁移只能追加在后面
+MIGRATIONS = [
+    _migrate_note_id,
+    _migrate_structured,
+    _migrate_media_files,
+    _migrate_user_crawls,
+    _migrate_checkpoints,
+    _migrate_unknown_counts,
+]
+
+
+def migrate(conn):
+    """执行还没执行过的迁移, 每个迁移一个事务"""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for index, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f'数据库迁移 {index}: {migration.__doc__.strip().splitlines()[0]}')
+        # sqlite3 模块不会在建表/删表前自动开启事务, 这里显式开启, 迁移失败时整体回滚
+        conn.execute('BEGIN')
+        try:
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {index}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return conn
+
+
+class KnownNotes():
+    """
+        已下载笔记id的内存集合, 启动时从数据库加载, 写入数据库时同步加入
+        不在集合里的笔记一定是新笔记, 不用查库; 在集合里的再去数据库取详情
+        没加载过时一律返回"可能存在", 退回到查库
+        其他进程新写入的笔记不会出现在这里, 最多多请求一次, 写库时 INSERT OR IGNORE 兜底
+    """
+    def __init__(self):
+        self.ids = set()
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def load(self, conn):
+        ids = {row[0] for row in conn.execute('SELECT note_id FROM notes')}
+        with self.lock:
+            self.ids |= ids
+            self.loaded = True
+        logger.info(f'已下载笔记: {len(self.ids)} 篇')
+
+    def add(self, note_id):
+        self.ids.add(note_id)
+
+    def might_contain(self, note_id):
+        return not self.loaded or note_id in self.ids
+
+    def filter_new(self, note_ids):
+        """过滤掉可能已下载的笔记, 返回一定是新笔记的id"""
+        if not self.loaded:
+            return []
+        return [note_id for note_id in note_ids if note_id not in self.ids]
+
+
+def connect(path=DB_PATH):
+    """打开数据库连接, 多个线程/进程同时写时等待而不是直接报 database is locked"""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA busy_timeout = 5000')
+    return conn
+
+
+def init_db(path=DB_PATH):
+    """建表并执行迁移, 返回连接"""
+    return migrate(connect(path))
+
+
+def find_note(conn, note_id):
+    """按笔记id查已下载的笔记, 返回 note_info, 没有返回 None"""
+    row = conn.execute('SELECT payload FROM notes WHERE note_id = ?', (note_id,)).fetchone()
+    return unpack(row[0]) if row else None
+
+
+def save_note(conn, note_id, url, note_info, track=None):
+    """记录已下载的笔记, 已存在时忽略"""
+    with conn:
+        for sql, params in note_statements(note_id, url, note_info, track):
+            conn.execute(sql, params)
+
+
+class DBWriteError(Exception):
+    """写线程提交失败, flush() 时抛给调用方"""
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} 条数据库写入失败: ' + '; '.join(f'{key}: {e}' for key, e in errors[:5]))
+
+
+class Checkpoint():
+    """
+        翻页断点, 传给 get_user_all_notes / get_note_all_comment
+        每消费完一页, 这一页的条目和下一页的 cursor 在同一个事务里写入
+        重试或重启后 load() 取回已经拿到的条目, 从记录的 cursor 继续翻页
+        :param db: NoteDB
+        :param job: 任务名, 比如 user_posted:<user_id>, comments:<note_id>
+        :param max_age_hours: 超过这个时间的断点丢弃, 从头开始
+    """
+    def __init__(self, db, job, max_age_hours=CHECKPOINT_MAX_AGE_HOURS):
+        self.db = db
+        self.job = job
+        self.max_age_hours = max_age_hours
+        self.pages = 0
+        self.recovered_pages = 0
+        self.recovered_items = 0
+        self.fetched_pages = 0
+
+    def load(self):
+        """返回 (cursor, 已取到的条目), 没有断点返回 ('', [])"""
+        # 同一进程里失败后马上重试时, 上一次最后写入的页可能还在队列里
+        # 别处的写入失败留给那边的 flush() 处理
+        self.db.flush(check=False)
+        rows = self.db.query('''SELECT cursor, pages FROM crawl_checkpoints
+                                WHERE job = ? AND update_time > datetime('now', ?)''',
+                             (self.job, f'-{self.max_age_hours} hours'))
+        if not rows:
+            self.clear()
+            return '', []
+        cursor, pages = rows[0]
+        items = []
+        for (payload,) in self.db.query('SELECT items FROM crawl_pages WHERE job = ? AND page < ? ORDER BY page',
+                                        (self.job, pages)):
+            items.extend(unpack(payload))
+        self.pages = self.recovered_pages = pages
+        self.recovered_items = len(items)
+        logger.info(f'断点续爬 {self.job} | 已恢复 {pages} 页 {len(items)} 条')
+        return cursor, items
+
+    def save(self, cursor, items):
+        self.db.write([
+            ('INSERT OR REPLACE INTO crawl_pages (job, page, items) VALUES (?,?,?)', (self.job, self.pages, pack(items))),
+            ('''INSERT OR REPLACE INTO crawl_checkpoints (job, cursor, pages, update_time)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)''', (self.job, cursor, self.pages + 1)),
+        ])
+        self.pages += 1
+        self.fetched_pages += 1
+
+    def clear(self):
+        self.db.write([
+            ('DELETE FROM crawl_pages WHERE job = ?', (self.job,)),
+            ('DELETE FROM crawl_checkpoints WHERE job = ?', (self.job,)),
+        ])
+        self.pages = 0
+
+
+class NoteDB():
+    """
+        进程内唯一的数据库入口
+        写: 只有一个写线程, 各处的写入放进队列, 攒够 batch_size 行或等了 batch_ms 毫秒一起提交
+        读: 每个线程一个只读连接, WAL 模式下读写互不阻塞
+        已经入队还没提交的笔记也能查到, 不会因为提交延迟重复下载
+        :param path: 数据库文件
+        :param batch_size: 每次提交最多的行数
+        :param batch_ms: 第一行入队后最多等多久提交
+    """
+    def __init__(self, path=DB_PATH, batch_size=DB_BATCH_SIZE, batch_ms=DB_BATCH_MS):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_ms = batch_ms
+        self.writer = init_db(path)
+        self.writer.execute('PRAGMA journal_mode = WAL')
+        # WAL 下 NORMAL 不会损坏数据库, 断电最多丢最后一次提交
+        self.writer.execute('PRAGMA synchronous = NORMAL')
+        self.known = KnownNotes()
+        self.known.load(self.writer)
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        # 提交失败的 (key, 异常), 下一次 flush() 抛出
+        self.errors = []
+        self.queue = queue.Queue()
+        self.local = threading.local()
+        self.thread = threading.Thread(target=self._write_loop, name='xhs-db-writer', daemon=True)
+        self.thread.start()
+
+    def _reader(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = connect(self.path)
+            conn.execute('PRAGMA query_only = 1')
+        return conn
+
+    def query(self, sql, params=()):
+        """在当前线程的只读连接上查询, 返回所有行"""
+        return self._reader().execute(sql, params).fetchall()
+
+    def write(self, statements, key=None):
+        """
+            写入放进队列, 不等提交
+            :param statements: [(sql, params), ...], 在同一个事务里执行
+            :param key: 入队时放进 pending 的 (表名, 主键), 提交后移除
+        """
+        self.queue.put((statements, key))
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.batch_ms / 1000
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    # 先提交手上的, 再退出
+                    self.queue.put(None)
+                    self.queue.task_done()
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _execute(self, batch):
+        with self.writer:
+            for statements, _ in batch:
+                for sql, params in statements:
+                    self.writer.execute(sql, params)
+
+    def _commit(self, batch):
+        try:
+            self._execute(batch)
+        except Exception:
+            # 整批失败时逐条重试, 一条坏数据不影响同批的其他写入
+            for item in batch:
+                try:
+                    self._execute([item])
+                except Exception as e:
+                    logger.error(f'数据库写入失败 {item[1]}: {e}')
+                    with self.pending_lock:
+                        self.errors.append((item[1], e))
+        finally:
+            with self.pending_lock:
+                for _, key in batch:
+                    if key is not None:
+                        self.pending.pop(key, None)
+            for _ in batch:
+                self.queue.task_done()
+
+    def flush(self, check=True):
+        """
+            等队列里的写入全部提交
+            :param check: 上次检查之后有写入失败时抛出 DBWriteError
+        """
+        self.queue.join()
+        if check:
+            with self.pending_lock:
+                errors, self.errors = self.errors, []
+            if errors:
+                raise DBWriteError(errors)
+
+    def might_contain(self, note_id):
+        return self.known.might_contain(note_id)
+
+    def find_note(self, note_id):
+        """按笔记id查已下载的笔记, 内存里没有的直接返回 None, 不查库"""
+        if not self.known.might_contain(note_id):
+            return None
+        with self.pending_lock:
+            note_info = self.pending.get(('notes', note_id))
+        if note_info is not None:
+            return note_info
+        return find_note(self._reader(), note_id)
+
+    def save_note(self, note_id, url, note_info, track=None):
+        """
+            记录已下载的笔记, 已存在时忽略, 不等提交
+            :param track: 笔记所在的目录, 比如 search_xxx / user_xxx
+        """
+        key = ('notes', note_id)
+        with self.pending_lock:
+            self.pending[key] = note_info
+        self.known.add(note_id)
+        self.write(note_statements(note_id, url, note_info, track), key)
+
+    def add_track(self, note_id, track):
+        """已下载的笔记出现在新的目录下"""
+        self.write([(SAVE_TRACK_SQL, (track, note_id))])
+
+    def set_media_dir(self, note_id, media_dir, complete=None):
+        """
+            记录笔记的媒体目录, 之后出现在别的目录下时从这里链接
+            :param complete: 媒体是否齐全, None 不修改
+        """
+        self.write([('UPDATE notes SET media_dir = ?, media_complete = COALESCE(?, media_complete) WHERE note_id = ?',
+                     (media_dir, None if complete is None else int(complete), note_id))])
+
+    def find_media_dir(self, note_id):
+        """笔记已下载好的目录, 没有记录返回 None"""
+        rows = self.query('SELECT media_dir FROM notes WHERE note_id = ?', (note_id,))
+        return rows[0][0] if rows else None
+
+    def save_user(self, user_info):
+        """记录 handle_user_info 处理后的用户详情"""
+        self.write([(SAVE_USER_SQL, (
+            user_info['user_id'], user_info.get('nickname'), user_info.get('avatar'), user_info.get('red_id'),
+            user_info.get('gender'), user_info.get('ip_location'), parse_count(user_info.get('follows'), None),
+            parse_count(user_info.get('fans'), None), parse_count(user_info.get('interaction'), None), pack(user_info),
+        ))])
+
+    def save_comments(self, comments):
+        """记录 handle_comment_info 处理后的评论"""
+        self.write([(SAVE_COMMENT_SQL, (
+            comment['comment_id'], comment.get('note_id'), comment.get('user_id'), parse_count(comment.get('like_count'), None),
+            comment.get('upload_time'), comment.get('ip_location'), comment.get('content'), pack(comment),
+        )) for comment in comments])
+
+    def get_user_crawl(self, user_id):
+        """上次爬取这个用户的记录 {newest_note_id, newest_note_time, last_complete_crawl}, 没有返回 None"""
+        rows = self.query('''SELECT newest_note_id, newest_note_time, last_complete_crawl
+                             FROM user_crawls WHERE user_id = ?''', (user_id,))
+        if not rows:
+            return None
+        return dict(zip(('newest_note_id', 'newest_note_time', 'last_complete_crawl'), rows[0]))
+
+    def save_user_crawl(self, user_id, note_ids):
+        """
+            用户的笔记全部处理完之后调用, 记录本次看到的最新笔记
+            :param note_ids: 本次翻到的笔记id, 为空时保留上次的记录, 只更新完成时间
+        """
+        # 置顶的旧笔记也会出现在 note_ids 里, 和上次的记录一起取最新的
+        crawl = self.get_user_crawl(user_id)
+        if crawl and crawl['newest_note_id']:
+            note_ids = list(note_ids) + [crawl['newest_note_id']]
+        newest = max(note_ids, key=lambda note_id: (note_id_time(note_id) or 0, note_id), default=None)
+        newest_time = note_id_time(newest) if newest else None
+        self.write([('''INSERT INTO user_crawls (user_id, newest_note_id, newest_note_time, last_complete_crawl)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(user_id) DO UPDATE SET
+                            newest_note_id = COALESCE(excluded.newest_note_id, newest_note_id),
+                            newest_note_time = COALESCE(excluded.newest_note_time, newest_note_time),
+                            last_complete_crawl = excluded.last_complete_crawl''',
+                     (user_id, newest, timestamp_to_str(newest_time * 1000) if newest_time else None))])
+
+    def checkpoint(self, job):
+        """翻页断点, 见 Checkpoint"""
+        return Checkpoint(self, job)
+
+    def top_notes(self, track=None, min_likes=0, limit=100):
+        """
+            点赞数超过 min_likes 的笔记, 按点赞数从高到低
+            :param track: 只看某个目录下的笔记, 比如 search_xxx
+            返回 [(note_id, title, liked_count, upload_time), ...]
+        """
+        if track is None:
+            return self.query('''SELECT note_id, title, liked_count, upload_time FROM notes
+                                 WHERE liked_count > ? ORDER BY liked_count DESC LIMIT ?''', (min_likes, limit))
+        return self.query('''SELECT n.note_id, n.title, n.liked_count, n.upload_time
+                             FROM note_tracks t JOIN notes n ON n.note_id = t.note_id
+                             WHERE t.track = ? AND n.liked_count > ?
+                             ORDER BY n.liked_count DESC LIMIT ?''', (track, min_likes, limit))
+
+    def close(self):
+        """提交剩下的写入并停止写线程"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.errors:
+            logger.error(f'关闭数据库时还有 {len(self.errors)} 条写入失败没有处理')
+        self.writer.close()
+
+
+_db = None
+_db_lock = threading.Lock()
+
+
+def get_db():
+    """进程内共用的 NoteDB, 第一次使用时建表迁移并加载已下载笔记id"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = NoteDB()
+                # 写线程是守护线程, 退出前把队列里的写入提交掉
+                atexit.register(_db.close)
+    return _db
@@ -0,0 +1,72 @@
+import atexit
+import os
+import threading
+import weakref
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+
+# 按顺序执行: 运行环境 -> xray 依赖 -> xray -> 签名脚本
+SCRIPTS = [
+    ('xhs_dom_shim.js', None),
+    ('xhs_xray_pack1.js', None),
+    ('xhs_xray_pack2.js', None),
+    ('xhs_xray.js', ['traceId']),
+    ('xhs_xs_xsc_56.js', ['get_request_headers_params', 'get_request_headers_params_batch', 'get_xs']),
+]
+
+
+def read_script(name):
+    with open(os.path.join(STATIC_DIR, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def wrap_script(source, names):
+    """与 execjs 一样包在函数里执行, 导出的函数挂到 __xhs 上"""
+    if not names:
+        return source
+    exports = ', '.join(f'{name}: {name}' for name in names)
+    return ('var __xhs = globalThis.__xhs || (globalThis.__xhs = {});\n'
+            '(function (require) {\n' + source + f'\n;Object.assign(__xhs, {{{exports}}});\n}})(require);')
+
+
+class EmbeddedSigner():
+    """
+        在python进程内的V8(py_mini_racer)里执行签名脚本, 没有子进程也没有IPC
+        V8 context 不能跨线程共享, 每个线程各自持有一个
+        没有 warmup: 在预热线程里建的 context 签名线程用不上, 只会多占一份内存
+    """
+    def __init__(self):
+        from py_mini_racer import MiniRacer
+        self.MiniRacer = MiniRacer
+        self.sources = [wrap_script(read_script(name), names) for name, names in SCRIPTS]
+        self.local = threading.local()
+        # 线程结束后context随之回收, 这里只留弱引用
+        self.contexts = weakref.WeakSet()
+        self.lock = threading.Lock()
+        # 没有显式释放的context会让解释器退出时卡住
+        atexit.register(self.close)
+
+    def _context(self):
+        ctx = getattr(self.local, 'ctx', None)
+        if ctx is None:
+            ctx = self.MiniRacer()
+            try:
+                for source in self.sources:
+                    ctx.eval(source)
+            except Exception:
+                ctx.close()
+                raise
+            self.local.ctx = ctx
+            with self.lock:
+                self.contexts.add(ctx)
+        return ctx
+
+    def call(self, fn, *args):
+        return self._context().call(f'__xhs.{fn}', *args)
+
+    def close(self):
+        with self.lock:
+            contexts = list(self.contexts)
+            self.contexts.clear()
+        for ctx in contexts:
+            ctx.close()
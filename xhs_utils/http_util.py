@@ -0,0 +1,82 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import cookiejar
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+
+# 连接池: pool_connections 是缓存的主机数, pool_maxsize 是每个主机保持的长连接数(一般不小于并发线程数)
+HTTP_POOL_CONNECTIONS = int(os.getenv('XHS_HTTP_POOL_CONNECTIONS', '10'))
+HTTP_POOL_MAXSIZE = int(os.getenv('XHS_HTTP_POOL_MAXSIZE', '32'))
+
+
+def parse_timeout(value):
+    """'5,15' -> (5.0, 15.0) 即 (连接超时, 读取超时); 只写一个数时两者相同"""
+    parts = [float(v) for v in value.split(',')]
+    return parts[0] if len(parts) == 1 else (parts[0], parts[1])
+
+
+# 各类请求的 (连接超时, 读取超时) 秒, 读取超时指两次收到数据之间的最长间隔
+API_TIMEOUT = parse_timeout(os.getenv('XHS_API_TIMEOUT', '5,20'))
+IMAGE_TIMEOUT = parse_timeout(os.getenv('XHS_IMAGE_TIMEOUT', '5,30'))
+VIDEO_TIMEOUT = parse_timeout(os.getenv('XHS_VIDEO_TIMEOUT', '5,60'))
+# 单个视频从发出请求到下载完的总时长上限(秒)
+VIDEO_DEADLINE = float(os.getenv('XHS_VIDEO_DEADLINE', '900'))
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """调用方没有传 timeout 时使用默认超时, 避免连接挂起后线程永远卡住"""
+    def __init__(self, *args, timeout=API_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class NoCookiePolicy(cookiejar.DefaultCookiePolicy):
+    """
+        session 不保存也不发送自己的 cookie
+        多个账号共用一个 session 时, 服务端下发的 cookie 不能串到别的账号上, cookie 只由每次请求显式传入
+    """
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def create_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, timeout=API_TIMEOUT):
+    """
+        创建带连接池的 session, 同一主机的请求复用 TCP+TLS 连接
+        :param pool_connections: 缓存连接池的主机数
+        :param pool_maxsize: 每个主机最多保持的连接数
+        :param timeout: 默认的 (连接超时, 读取超时)
+    """
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, timeout=timeout)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.cookies.set_policy(NoCookiePolicy())
+    return session
+
+
+def preconnect(session, url, proxies=None, num=1):
+    """
+        预先建立连接放进连接池, 第一批请求不用再等握手
+        :param url: 要预连接的地址, 只用到协议和主机
+        :param num: 建立的连接数, 并发发出才会各自占用一个连接
+        返回成功建立的连接数
+    """
+    def head():
+        try:
+            session.head(url, proxies=proxies)
+            return True
+        except requests.RequestException as e:
+            logger.warning(f'预连接失败 {url}: {e}')
+            return False
+
+    with ThreadPoolExecutor(max_workers=num) as executor:
+        return sum(executor.map(lambda _: head(), range(num)))
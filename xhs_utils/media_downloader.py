@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+import requests
+from xhs_utils.http_util import IMAGE_TIMEOUT, VIDEO_DEADLINE, VIDEO_TIMEOUT, create_session
+from xhs_utils.media_store import get_media_store
+from xhs_utils.retry_util import call_with_backoff
+
+# 同时下载的文件数, 每个CDN域名的并发上限, 全局在途字节上限
+MEDIA_WORKERS = int(os.getenv('XHS_MEDIA_WORKERS', '16'))
+MEDIA_PER_HOST = int(os.getenv('XHS_MEDIA_PER_HOST', '8'))
+MEDIA_MAX_BYTES_IN_FLIGHT = int(os.getenv('XHS_MEDIA_MAX_BYTES_IN_FLIGHT', str(64 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+
+
+class ByteBudget():
+    """
+        全局在途字节预算, 每个下载按还要接收的字节数占用, 超出时等待其他下载结束
+        单次申请超过上限时按上限计, 避免永远等不到
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def hold(self, size):
+        size = max(1, min(size, self.limit))
+        with self.cond:
+            while self.used + size > self.limit:
+                self.cond.wait()
+            self.used += size
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.used -= size
+                self.cond.notify_all()
+
+
+class IncompleteDownloadError(ConnectionError):
+    """收到的字节数和 Content-Length 对不上, 已下载的部分保留在 .part 里等待续传"""
+
+
+def parse_total_size(res, offset):
+    """从 Content-Range 或 Content-Length 得到文件总大小, 未知时返回 None"""
+    content_range = res.headers.get('Content-Range')
+    if content_range and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    length = res.headers.get('Content-Length')
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def fetch_media(path, name, url, type, session=requests, budget=None):
+    """
+        下载单个图片或视频, 文件名与原来一致: 图片 name.jpg, 视频 name.mp4
+        分块写入 name.xxx.part, 大小校验通过后原子改名, 内存占用只有一个分块
+        .part 已有内容时用 Range 从断点续传, 服务端不支持或者压缩了响应时从头下载
+        :param session: requests 或者带连接池的 Session
+        :param budget: ByteBudget, 按还要接收的字节数(Content-Length)占用, 大小未知时占一个分块
+        返回文件路径
+    """
+    file_path = path + '/' + name + ('.jpg' if type == 'image' else '.mp4')
+    if os.path.exists(file_path):
+        # 只有校验过的文件才会改成正式文件名, 存在即完整
+        return file_path
+    part_path = file_path + '.part'
+    timeout = IMAGE_TIMEOUT if type == 'image' else VIDEO_TIMEOUT
+    # 读取超时只管两次收到数据的间隔, 慢速但不断流的连接靠总时长上限兜底
+    deadline = time.monotonic() + VIDEO_DEADLINE if type == 'video' else None
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    # 要求服务端不压缩, Content-Length 和断点都按文件本身的字节算
+    headers = {'Accept-Encoding': 'identity'}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+    res = session.get(url, stream=True, timeout=timeout, headers=headers)
+    with res:
+        if offset and res.status_code == 416:
+            # 416 带着 bytes */总大小, .part 正好是完整文件时直接改名
+            if parse_total_size(res, 0) == offset:
+                os.replace(part_path, file_path)
+                return file_path
+            # 大小对不上, 说明服务端的文件变了, 丢掉重下
+            os.remove(part_path)
+            raise IncompleteDownloadError(f'断点无效, 重新下载: {url}')
+        res.raise_for_status()
+        # 服务端仍然压缩时, 写入的是解压后的字节, 和线上的偏移对不上, 不能续传
+        encoded = res.headers.get('Content-Encoding', 'identity').lower() != 'identity'
+        if offset and (res.status_code != 206 or encoded):
+            # 服务端忽略了 Range, 返回的是完整文件
+            offset = 0
+        total = parse_total_size(res, offset)
+        size = offset
+        reserve = total - offset if total is not None else CHUNK_SIZE
+        try:
+            with open(part_path, mode='ab' if offset else 'wb') as f, \
+                    budget.hold(reserve) if budget is not None else nullcontext():
+                for data in res.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(data)
+                    size += len(data)
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise TimeoutError(f'视频下载超过 {VIDEO_DEADLINE}s, 已下载 {size} 字节: {url}')
+        except BaseException:
+            if encoded:
+                os.remove(part_path)
+            raise
+        if encoded:
+            # 压缩时 Content-Length 是线上的字节数
+            size = res.raw.tell()
+    if total is not None and size != total:
+        if encoded:
+            os.remove(part_path)
+        raise IncompleteDownloadError(f'文件不完整 {size}/{total} 字节: {url}')
+    os.replace(part_path, file_path)
+    return file_path
+
+
+class MediaDownloader():
+    """
+        笔记媒体的并发下载器, 一篇笔记的图片/封面/视频同时下载
+        使用单独的连接池访问 xhscdn, 每个域名有并发上限, 全局有在途字节上限
+        :param workers: 同时下载的文件数
+        :param per_host: 每个域名的并发上限, 也是每个域名保持的连接数
+        :param max_bytes_in_flight: 全局在途字节上限
+        :param store: MediaStore, 传入时已知地址直接从媒体库链接, 新下载的文件存进媒体库
+    """
+    def __init__(self, workers=MEDIA_WORKERS, per_host=MEDIA_PER_HOST, max_bytes_in_flight=MEDIA_MAX_BYTES_IN_FLIGHT,
+                 store=None):
+        self.per_host = per_host
+        self.store = store
+        self.session = create_session(pool_maxsize=per_host, timeout=IMAGE_TIMEOUT)
+        self.budget = ByteBudget(max_bytes_in_flight)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='xhs-media')
+        self.host_limits = {}
+        self.lock = threading.Lock()
+
+    def _host_limit(self, host):
+        with self.lock:
+            limit = self.host_limits.get(host)
+            if limit is None:
+                limit = self.host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return limit
+
+    def _fetch(self, path, name, url, type):
+        """
+            下载单个文件, 受域名并发上限约束
+            只对网络抖动和限流重试, 同一个CDN域名连续失败时熔断
+        """
+        host = urllib.parse.urlparse(url).netloc
+        with self._host_limit(host):
+            return call_with_backoff(host, fetch_media, path, name, url, type, self.session, self.budget)
+
+    def download(self, path, name, url, type):
+        """下载单个文件, 启用媒体库时先查媒体库"""
+        if self.store is not None:
+            return self.store.fetch(path, name, url, type, self._fetch)
+        return self._fetch(path, name, url, type)
+
+    def download_all(self, jobs):
+        """
+            并发下载一批文件, 全部结束后才返回
+            :param jobs: [(path, name, url, type), ...]
+            有失败时抛出第一个异常
+        """
+        futures = [self.executor.submit(self.download, *job) for job in jobs]
+        wait(futures)
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+
+_downloader = None
+_downloader_lock = threading.Lock()
+
+
+def get_downloader():
+    """进程内共用的下载器, 第一次使用时创建"""
+    global _downloader
+    if _downloader is None:
+        with _downloader_lock:
+            if _downloader is None:
+                _downloader = MediaDownloader(store=get_media_store())
+    return _downloader
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import urllib.parse
+from contextlib import contextmanager
+from loguru import logger
+
+# 内容寻址的媒体库目录, 为空表示不启用, 媒体直接下载到笔记目录
+MEDIA_STORE_DIR = os.getenv('XHS_MEDIA_STORE', '')
+# 笔记目录里的文件怎么指向媒体库: hardlink / symlink / copy, 硬链接失败(跨盘)时依次退回
+MEDIA_LINK_MODE = os.getenv('XHS_MEDIA_LINK_MODE', 'hardlink')
+
+# xhscdn 图片地址里 /时间戳/签名/ 两段每次请求都不一样, 不能当作缓存的key
+_VOLATILE_SEGMENT = re.compile(r'^(\d{8,}|[0-9a-f]{32})$')
+
+
+def url_key(url):
+    """
+        媒体地址的稳定部分: 去掉域名, 参数, 以及开头的时间戳和签名
+        不同CDN节点和不同时间拿到的同一张图 key 相同
+    """
+    segments = urllib.parse.urlparse(url).path.strip('/').split('/')
+    while len(segments) > 1 and _VOLATILE_SEGMENT.match(segments[0]):
+        segments.pop(0)
+    return '/'.join(segments)
+
+
+def file_sha256(file_path):
+    h = hashlib.sha256()
+    with open(file_path, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def link_file(src, dst, mode=MEDIA_LINK_MODE):
+    """
+        把 src 放到 dst, 按 hardlink -> symlink -> copy 的顺序尝试, 从 mode 指定的那一种开始
+        dst 已存在时覆盖, 返回实际使用的方式
+    """
+    modes = ['hardlink', 'symlink', 'copy']
+    tmp = dst + '.link'
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    for m in modes[modes.index(mode):]:
+        try:
+            if m == 'hardlink':
+                os.link(src, tmp)
+            elif m == 'symlink':
+                os.symlink(os.path.abspath(src), tmp)
+            else:
+                shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+            return m
+        except OSError:
+            if m == 'copy':
+                raise
+    return None
+
+
+class MediaStore():
+    """
+        内容寻址的媒体库: 文件按 sha256 命名, 存在 blobs/ab/cd/ 下
+        index.db 记录媒体地址的稳定key到文件的映射, 已知地址直接链接, 不再下载
+        笔记目录的结构不变, 里面的文件是指向媒体库的硬链接(或软链接/副本)
+        :param root: 媒体库目录
+        :param link_mode: hardlink / symlink / copy
+    """
+    def __init__(self, root, link_mode=MEDIA_LINK_MODE):
+        self.root = root
+        self.link_mode = link_mode
+        os.makedirs(os.path.join(root, 'blobs'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False)
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS url_blobs
+                             (url_key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL)''')
+        self.conn.commit()
+        self.lock = threading.Lock()
+        # 同一个地址同时只有一个线程下载, 其余的等它下完直接命中
+        self.key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256[2:4], sha256)
+
+    def lookup(self, url):
+        """已知地址返回媒体库里的文件路径, 否则返回 None"""
+        with self.lock:
+            row = self.conn.execute('SELECT sha256 FROM url_blobs WHERE url_key = ?', (url_key(url),)).fetchone()
+        if row is None:
+            return None
+        blob = self.blob_path(row[0])
+        return blob if os.path.exists(blob) else None
+
+    def add(self, url, file_path):
+        """把下载好的文件移进媒体库并登记地址, 内容相同的文件只保留一份, 返回媒体库里的路径"""
+        sha256 = file_sha256(file_path)
+        blob = self.blob_path(sha256)
+        size = os.path.getsize(file_path)
+        if os.path.exists(blob):
+            os.remove(file_path)
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(file_path, blob)
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO url_blobs VALUES (?,?,?)', (url_key(url), sha256, size))
+            self.conn.commit()
+        return blob
+
+    @contextmanager
+    def _key_lock(self, key):
+        """按 url_key 加锁, 没有线程在用的锁随即删掉"""
+        with self.lock:
+            entry = self.key_locks.get(key)
+            if entry is None:
+                entry = self.key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.key_locks[key]
+
+    def fetch(self, path, name, url, type, download):
+        """
+            把媒体放到笔记目录, 文件名与 fetch_media 一致
+            :param download: 真正下载的函数, 参数与 fetch_media 的 (path, name, url, type) 相同
+            返回文件路径
+        """
+        file_path = path + '/' + name + ('.jpg' if type == 'image' else '.mp4')
+        key = url_key(url)
+        blob = self.lookup(url)
+        hit = blob is not None
+        if not hit:
+            with self._key_lock(key):
+                # 等锁期间别的线程可能已经下载好了
+                blob = self.lookup(url)
+                hit = blob is not None
+                if not hit:
+                    # 临时目录按地址区分, 中断后重跑可以接着 .part 续传, key 锁保证同一时间只有一个线程在写
+                    staging = os.path.join(self.root, 'tmp', hashlib.sha1(key.encode('utf-8')).hexdigest())
+                    os.makedirs(staging, exist_ok=True)
+                    blob = self.add(url, download(staging, name, url, type))
+                    shutil.rmtree(staging, ignore_errors=True)
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            logger.debug(f'媒体库命中 {key}')
+        link_file(blob, file_path, self.link_mode)
+        return file_path
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_media_store():
+    """进程内共用的媒体库, 没有配置 XHS_MEDIA_STORE 时返回 None"""
+    global _store
+    if not MEDIA_STORE_DIR:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MediaStore(MEDIA_STORE_DIR)
+    return _store
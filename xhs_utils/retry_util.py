@@ -0,0 +1,258 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+import requests
+from loguru import logger
+
+# 失败分类
+TRANSIENT = 'transient'    # 网络抖动, 超时, 5xx, 返回的不是json
+THROTTLED = 'throttled'    # 被限流/风控
+AUTH = 'auth'              # 登录过期, cookie 失效
+NOT_FOUND = 'not_found'    # 笔记不存在/已删除, 重试也没用
+UNKNOWN = 'unknown'
+
+RETRYABLE = (TRANSIENT, THROTTLED)
+
+RETRY_TRIES = int(os.getenv('XHS_RETRY_TRIES', '3'))
+# 退避: 第n次重试等待 uniform(0, min(cap, base * 2**n)) 秒, 限流用更长的 base
+RETRY_BASE = float(os.getenv('XHS_RETRY_BASE', '2'))
+RETRY_THROTTLE_BASE = float(os.getenv('XHS_RETRY_THROTTLE_BASE', '30'))
+RETRY_CAP = float(os.getenv('XHS_RETRY_CAP', '300'))
+# 熔断: 连续失败多少次后暂停, 暂停多久(秒), 再次熔断时暂停时间翻倍
+BREAKER_THRESHOLD = int(os.getenv('XHS_BREAKER_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.getenv('XHS_BREAKER_COOLDOWN', '60'))
+BREAKER_MAX_COOLDOWN = float(os.getenv('XHS_BREAKER_MAX_COOLDOWN', '1800'))
+
+THROTTLE_CODES = {300012, 300013, 461, 471, 429}
+AUTH_CODES = {-100, -101, -104}
+NOT_FOUND_CODES = {-510000, -510001, 404}
+THROTTLE_WORDS = ('频次', '频繁', '稍后再试', '风险', 'too many')
+AUTH_WORDS = ('登录', '未登录', 'login')
+NOT_FOUND_WORDS = ('不存在', '已删除', '无法浏览', '违规')
+TRANSIENT_WORDS = ('timed out', 'timeout', 'connection', 'max retries', 'remotedisconnected',
+                   'expecting value', 'temporarily', 'bad gateway', 'service unavailable',
+                   'cannot connect', 'server disconnected')
+
+
+class CircuitOpenError(Exception):
+    """接口处于熔断期, 请求没有发出"""
+
+
+def classify_message(msg, code=None):
+    msg = str(msg).lower()
+    if code in THROTTLE_CODES or any(w in msg for w in THROTTLE_WORDS):
+        return THROTTLED
+    if code in AUTH_CODES or any(w in msg for w in AUTH_WORDS):
+        return AUTH
+    if code in NOT_FOUND_CODES or any(w in msg for w in NOT_FOUND_WORDS):
+        return NOT_FOUND
+    return None
+
+
+def classify_result(success, msg, res_json):
+    """
+        给 XHS_Apis 的 (success, msg, res_json) 分类, 成功返回 None
+        res_json 为空说明请求本身出错(网络/超时/返回的不是json), 只能按异常信息判断
+    """
+    if success:
+        return None
+    if res_json is None:
+        category = classify_message(msg)
+        if category is not None:
+            return category
+        return TRANSIENT if any(w in str(msg).lower() for w in TRANSIENT_WORDS) else UNKNOWN
+    return classify_message(msg, res_json.get('code')) or UNKNOWN
+
+
+def classify_exception(e):
+    """给下载等直接抛出的异常分类"""
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        status = e.response.status_code
+        if status in THROTTLE_CODES:
+            return THROTTLED
+        if status >= 500:
+            return TRANSIENT
+        return NOT_FOUND if status in (403, 404, 410) else UNKNOWN
+    if isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                      ConnectionError, TimeoutError)):
+        return TRANSIENT
+    return UNKNOWN
+
+
+def backoff_delay(attempt, base=RETRY_BASE, cap=RETRY_CAP):
+    """指数退避加全抖动, attempt 从0开始"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker():
+    """
+        单个接口的熔断器
+        连续失败 threshold 次后熔断 cooldown 秒, 期间直接拒绝请求
+        熔断期过后放行一个试探请求, 成功则恢复, 失败则熔断时间翻倍
+    """
+    def __init__(self, name, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.failures < self.threshold:
+                return True
+            if time.monotonic() < self.open_until or self.probing:
+                return False
+            # 半开: 只放行一个试探请求
+            self.probing = True
+            return True
+
+    def remaining(self):
+        return max(0.0, self.open_until - time.monotonic())
+
+    def record_success(self):
+        with self.lock:
+            if self.failures >= self.threshold:
+                logger.info(f'熔断恢复 | 接口: {self.name}')
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures < self.threshold:
+                return
+            if self.probing:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self.probing = False
+            self.open_until = time.monotonic() + self.cooldown
+            logger.warning(f'接口熔断 | 接口: {self.name} | 连续失败: {self.failures} | 暂停: {self.cooldown:.0f}s')
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name):
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+
+def with_backoff(fn=None, endpoint=None, tries=RETRY_TRIES):
+    """
+        装饰 XHS_Apis 里返回 (success, msg, res_json) 的方法
+        网络抖动和限流按指数退避重试, 登录失效/不存在等直接返回不重试
+        同一接口连续失败时熔断, 熔断期内直接返回失败, 不再发请求
+        XHS_Apis 设置了 acquire 时, 每次重试前先调用它拿一个频率控制的令牌, 第一次请求的令牌由调用方申请
+    """
+    if fn is None:
+        return functools.partial(with_backoff, endpoint=endpoint, tries=tries)
+    name = endpoint or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        breaker = get_breaker(name)
+        for attempt in range(tries):
+            if not breaker.allow():
+                return False, f'接口熔断中, {breaker.remaining():.0f}s 后恢复: {name}', None
+            success, msg, res_json = fn(*args, **kwargs)
+            category = classify_result(success, msg, res_json)
+            if category is None:
+                breaker.record_success()
+                return success, msg, res_json
+            if category not in RETRYABLE:
+                # 接口本身是通的, 不算熔断的失败
+                breaker.record_success()
+                logger.warning(f'请求失败 | 接口: {name} | 类型: {category} | 原因: {msg}')
+                return success, msg, res_json
+            breaker.record_failure()
+            if attempt == tries - 1:
+                logger.warning(f'请求失败 | 接口: {name} | 类型: {category} | 原因: {msg}')
+                return success, msg, res_json
+            delay = backoff_delay(attempt, RETRY_THROTTLE_BASE if category == THROTTLED else RETRY_BASE)
+            logger.warning(f'请求失败, {delay:.1f}s 后重试 | 接口: {name} | 类型: {category} | 原因: {msg}')
+            time.sleep(delay)
+            # 退避之后的重试同样要过频率控制, 不能绕过令牌桶连续发请求
+            acquire = getattr(args[0], 'acquire', None) if args else None
+            if acquire is not None:
+                acquire()
+        return success, msg, res_json
+    return wrapper
+
+
+def with_backoff_async(fn=None, endpoint=None, tries=RETRY_TRIES):
+    """
+        with_backoff 的异步版本, 装饰 AsyncXHS_Apis 里返回 (success, msg, res_json) 的协程方法
+        分类、退避和熔断与同步版本一致, 和同名的同步接口共用熔断器
+        AsyncXHS_Apis 设置了 acquire 时, 每次请求(包括第一次)前 await 它拿令牌:
+        异步版本会在内部并发展开请求, 调用方没法逐个申请
+    """
+    if fn is None:
+        return functools.partial(with_backoff_async, endpoint=endpoint, tries=tries)
+    name = endpoint or fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        breaker = get_breaker(name)
+        acquire = getattr(args[0], 'acquire', None) if args else None
+        for attempt in range(tries):
+            if not breaker.allow():
+                return False, f'接口熔断中, {breaker.remaining():.0f}s 后恢复: {name}', None
+            if acquire is not None:
+                await acquire()
+            success, msg, res_json = await fn(*args, **kwargs)
+            category = classify_result(success, msg, res_json)
+            if category is None:
+                breaker.record_success()
+                return success, msg, res_json
+            if category not in RETRYABLE:
+                breaker.record_success()
+                logger.warning(f'请求失败 | 接口: {name} | 类型: {category} | 原因: {msg}')
+                return success, msg, res_json
+            breaker.record_failure()
+            if attempt == tries - 1:
+                logger.warning(f'请求失败 | 接口: {name} | 类型: {category} | 原因: {msg}')
+                return success, msg, res_json
+            delay = backoff_delay(attempt, RETRY_THROTTLE_BASE if category == THROTTLED else RETRY_BASE)
+            logger.warning(f'请求失败, {delay:.1f}s 后重试 | 接口: {name} | 类型: {category} | 原因: {msg}')
+            await asyncio.sleep(delay)
+        return success, msg, res_json
+    return wrapper
+
+
+def call_with_backoff(name, fn, *args, tries=RETRY_TRIES, **kwargs):
+    """
+        调用会抛异常的函数(比如下载), 只对网络抖动和限流重试
+        :param name: 熔断器的名字, 下载时用 CDN 域名
+    """
+    breaker = get_breaker(name)
+    for attempt in range(tries):
+        if not breaker.allow():
+            raise CircuitOpenError(f'{name} 熔断中, {breaker.remaining():.0f}s 后恢复')
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            category = classify_exception(e)
+            if category not in RETRYABLE:
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt == tries - 1:
+                raise
+            delay = backoff_delay(attempt, RETRY_THROTTLE_BASE if category == THROTTLED else RETRY_BASE)
+            logger.warning(f'{name} 失败, {delay:.1f}s 后重试 | 类型: {category} | 原因: {e}')
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
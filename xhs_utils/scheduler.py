@@ -0,0 +1,102 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from loguru import logger
+
+
+class TokenBucket():
+    """
+        令牌桶限速, 所有线程共用
+        :param interval: 平均每隔多少秒发放一个令牌
+        :param burst: 桶容量, 空闲之后最多可以连续拿到的令牌数
+        :param jitter: 每个令牌额外随机推迟 0~jitter 秒, 模拟真人操作
+        每次申请时在锁内预约一个发放时间, 在锁外等待, 等待期间其他线程照常预约
+    """
+    def __init__(self, interval, burst=1, jitter=0.0):
+        self.interval = interval
+        self.burst = burst
+        self.jitter = jitter
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def reserve(self):
+        """预约一个令牌, 返回需要等待的秒数"""
+        with self.lock:
+            now = time.monotonic()
+            t = max(self.next_time, now - (self.burst - 1) * self.interval)
+            self.next_time = t + self.interval + random.uniform(0, self.jitter)
+            return max(0.0, t - now)
+
+    def acquire(self):
+        """拿到令牌才返回, 返回实际等待的秒数"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return wait_time
+
+    async def acquire_async(self):
+        """acquire 的异步版本, 等待时不阻塞事件循环, 和同步的调用共用同一个桶"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+        return wait_time
+
+
+class Scheduler():
+    """
+        爬取调度: 接口请求按令牌桶限速, 媒体下载和落盘放到后台线程
+        等下一个接口令牌的时间里, 上一篇笔记的下载和保存同时在跑
+        :param interval: 接口请求的平均间隔(秒)
+        :param burst: 允许的突发请求数
+        :param jitter: 每次请求额外随机推迟 0~jitter 秒
+        :param workers: 后台线程数
+    """
+    def __init__(self, interval, burst=1, jitter=0.0, workers=4):
+        self.bucket = TokenBucket(interval, burst, jitter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='xhs-bg')
+
+    def acquire(self):
+        """申请一次接口请求的许可"""
+        wait_time = self.bucket.acquire()
+        if wait_time > 0:
+            logger.debug(f'频率控制 | 等待 {wait_time:.2f}s')
+        return wait_time
+
+    async def acquire_async(self):
+        """申请一次接口请求的许可, 给 AsyncXHS_Apis 用"""
+        wait_time = await self.bucket.acquire_async()
+        if wait_time > 0:
+            logger.debug(f'频率控制 | 等待 {wait_time:.2f}s')
+        return wait_time
+
+    def submit(self, fn, *args, **kwargs):
+        """把下载/保存之类不占接口额度的工作放到后台执行, 返回 Future"""
+        return self.executor.submit(self._run, fn, *args, **kwargs)
+
+    @staticmethod
+    def _run(fn, *args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            logger.error(f'后台任务失败 {getattr(fn, "__name__", fn)}: {e}')
+            raise
+
+    @staticmethod
+    def wait(futures, on_done=None):
+        """
+            等待一批后台任务结束
+            :param on_done: 每完成一个任务调用一次 on_done(future), 可用于上报进度
+            返回失败的任务数
+        """
+        failed = 0
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failed += 1
+            if on_done is not None:
+                on_done(future)
+        return failed
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,65 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+class SignCache():
+    """
+        签名结果的 LRU 缓存, 相同 (a1, api, data) 在有效期内直接复用, 不再调用js
+        :param maxsize: 最多缓存的条数, 超出时淘汰最久未使用的
+        :param ttl: 有效期(秒), 按签名里的 x-t 时间戳计算, 而不是按放入缓存的时间
+    """
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl_ms = int(ttl * 1000)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    @staticmethod
+    def make_key(a1, api, data=''):
+        # 与 json.dumps 默认行为一致保持字段顺序, 顺序不同签名也不同
+        if not isinstance(data, str):
+            data = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
+        return a1, api, data
+
+    def get(self, key):
+        now_ms = int(time.time() * 1000)
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            if now_ms - int(value[1]) >= self.ttl_ms:
+                del self.entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'expired': self.expired,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
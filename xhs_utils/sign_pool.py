@@ -0,0 +1,187 @@
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+WORKER_SCRIPT = os.path.join(STATIC_DIR, 'xhs_sign_worker.js')
+# 等签名结果最多多少秒, 超时认为进程卡死, 杀掉重启
+SIGN_TIMEOUT = float(os.getenv('XHS_SIGN_TIMEOUT', '10'))
+# 启动时加载脚本比一次签名慢得多, 单独设置
+SIGN_START_TIMEOUT = float(os.getenv('XHS_SIGN_START_TIMEOUT', '30'))
+
+
+class SignWorkerError(Exception):
+    """签名进程异常退出或通信失败"""
+
+
+class SignWorker():
+    """
+        常驻的 node 签名进程
+        签名脚本只在启动时加载一次, 之后每次签名只是一次管道往返
+        stdout 由后台线程逐行读进队列, 等待结果可以设超时, windows 的管道也适用
+        :param timeout: 等一次签名结果的秒数
+        :param start_timeout: 等进程启动完成的秒数
+    """
+    def __init__(self, node_path='node', timeout=SIGN_TIMEOUT, start_timeout=SIGN_START_TIMEOUT):
+        self.node_path = node_path
+        self.timeout = timeout
+        self.seq = 0
+        self.lines = queue.Queue()
+        self.proc = subprocess.Popen(
+            [node_path, WORKER_SCRIPT],
+            cwd=STATIC_DIR,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding='utf-8',
+            bufsize=1,
+        )
+        threading.Thread(target=self._read_loop, name='xhs-sign-reader', daemon=True).start()
+        ready = self._read(start_timeout)
+        if not ready.get('ready'):
+            self.close()
+            raise SignWorkerError(f'签名进程启动失败: {ready}')
+
+    def _read_loop(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        # 进程退出, 唤醒正在等结果的线程
+        self.lines.put(None)
+
+    def _read(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            # 等进程真正退出, 否则 alive() 可能还是 True, 被放回进程池
+            self.proc.kill()
+            self.proc.wait()
+            raise SignWorkerError(f'签名进程 {timeout}s 没有响应, 已结束进程')
+        if line is None:
+            raise SignWorkerError(f'签名进程已退出, 退出码: {self.proc.poll()}')
+        return json.loads(line)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def call(self, fn, *args):
+        self.seq += 1
+        request = json.dumps({'id': self.seq, 'fn': fn, 'args': args}, ensure_ascii=False)
+        try:
+            self.proc.stdin.write(request + '\n')
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise SignWorkerError(f'签名进程写入失败: {e}')
+        res = self._read()
+        if res.get('id') != self.seq:
+            self.proc.kill()
+            raise SignWorkerError(f'签名进程响应错乱: {res}')
+        if not res['ok']:
+            # js 内部抛错, 进程本身没问题
+            raise RuntimeError(res['error'])
+        return res['result']
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.wait(timeout=3)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+
+class SignWorkerPool():
+    """
+        node 签名进程池
+        :param size: 进程数量, 决定同时能签名的线程数
+        :param node_path: node 可执行文件
+        :param timeout: 等一次签名结果的秒数
+        进程崩溃或超时没有响应时会自动重启并重试一次
+    """
+    def __init__(self, size=4, node_path=None, timeout=SIGN_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.node_path = node_path or shutil.which('node') or 'node'
+        self.idle = []
+        # 进程放回空闲列表或者名额归还时唤醒等待的线程
+        self.cond = threading.Condition()
+        self.started = 0
+        self.closed = False
+
+    def _put_idle(self, worker):
+        with self.cond:
+            self.idle.append(worker)
+            self.cond.notify()
+
+    def _release(self):
+        """归还一个进程名额, 等待的线程可以自己启动新进程"""
+        with self.cond:
+            self.started -= 1
+            self.cond.notify()
+
+    def _acquire(self):
+        with self.cond:
+            while not self.idle and self.started >= self.size:
+                if self.closed:
+                    raise SignWorkerError('签名进程池已关闭')
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.started += 1
+        try:
+            return SignWorker(self.node_path, self.timeout)
+        except Exception:
+            self._release()
+            raise
+
+    def _spawn_idle(self):
+        try:
+            self._put_idle(SignWorker(self.node_path, self.timeout))
+        except Exception:
+            self._release()
+            raise
+
+    def warmup(self):
+        """并行启动还没启动的进程, 避免第一批请求各自承担冷启动"""
+        with self.cond:
+            n = self.size - self.started
+            self.started += n
+        if n <= 0:
+            return
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [executor.submit(self._spawn_idle) for _ in range(n)]
+        for future in futures:
+            future.result()
+
+    def call(self, fn, *args):
+        worker = self._acquire()
+        try:
+            try:
+                return worker.call(fn, *args)
+            except SignWorkerError as e:
+                logger.warning(f'签名进程异常, 正在重启: {e}')
+                worker.close()
+                worker = None
+                worker = SignWorker(self.node_path, self.timeout)
+                return worker.call(fn, *args)
+        finally:
+            if worker is not None and worker.alive() and not self.closed:
+                self._put_idle(worker)
+            else:
+                if worker is not None:
+                    worker.close()
+                self._release()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.cond.notify_all()
+        for worker in idle:
+            worker.close()
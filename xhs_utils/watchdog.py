@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from loguru import logger
+
+# 任务多久没有进展算卡住(分钟)
+WATCHDOG_STALL_MINUTES = float(os.getenv('XHS_WATCHDOG_STALL_MINUTES', '10'))
+
+
+class TaskWatchdog():
+    """
+        任务看门狗: 任务每推进一步调用 beat 上报所处阶段
+        超过 stall_seconds 没有上报的 processing 任务, 在 task_status 里标记 stalled 和卡住的阶段
+        :param task_status: Flask 里的 task_status 字典
+        :param stall_seconds: 多少秒没有进展算卡住
+        :param check_interval: 检查间隔(秒)
+    """
+    def __init__(self, task_status, stall_seconds=WATCHDOG_STALL_MINUTES * 60, check_interval=30):
+        self.task_status = task_status
+        self.stall_seconds = stall_seconds
+        self.check_interval = check_interval
+        self.beats = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def beat(self, task_id, stage):
+        """上报任务进展, stage 为当前所处的阶段"""
+        status = self.task_status[task_id]
+        with self.lock:
+            self.beats[task_id] = (time.time(), stage)
+        status["stage"] = stage
+        status["last_progress_time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        if status.pop("stalled", False):
+            status.pop("stalled_seconds", None)
+            status.pop("stuck_stage", None)
+            logger.info(f"任务恢复 | ID: {task_id} | 阶段: {stage}")
+
+    def check(self):
+        """检查一遍所有任务, 返回卡住的任务id列表"""
+        now = time.time()
+        stalled = []
+        with self.lock:
+            beats = list(self.beats.items())
+        for task_id, (last, stage) in beats:
+            status = self.task_status.get(task_id, {})
+            if status.get("status") != "processing":
+                with self.lock:
+                    self.beats.pop(task_id, None)
+                continue
+            idle = now - last
+            if idle < self.stall_seconds:
+                continue
+            if not status.get("stalled"):
+                logger.warning(f"任务卡住 | ID: {task_id} | 阶段: {stage} | 已 {idle:.0f}s 没有进展")
+            status.update({"stalled": True, "stuck_stage": stage, "stalled_seconds": int(idle)})
+            stalled.append(task_id)
+        return stalled
+
+    def _run(self):
+        while not self.stop_event.wait(self.check_interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"看门狗检查失败: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='xhs-watchdog', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
@@ -1,39 +1,111 @@
 import json
-import math
-import random
+import os
+import shutil
+import threading
+import time
 import execjs
+from loguru import logger
 from xhs_utils.cookie_util import trans_cookies
+from xhs_utils.sign_cache import SignCache
+from xhs_utils.sign_pool import STATIC_DIR, SignWorkerPool
+from xhs_utils.xray_util import generate_x_b3_traceid, generate_xray_traceid
 
-try:
-    js = execjs.compile(open(r'../static/xhs_xs_xsc_56.js', 'r', encoding='utf-8').read())
-except:
-    js = execjs.compile(open(r'static/xhs_xs_xsc_56.js', 'r', encoding='utf-8').read())
-    a = execjs.get().name
-    print(a)
+# 签名后端 node_pool: 常驻node进程池  embedded: 进程内V8(py_mini_racer)  execjs: 每次调用都新起node进程
+SIGN_BACKEND = os.getenv('XHS_SIGN_BACKEND', 'node_pool')
+SIGN_POOL_SIZE = int(os.getenv('XHS_SIGN_POOL_SIZE', '4'))
+# 签名缓存, 条数为0时不启用; 有效期按 x-t 计算(秒)
+SIGN_CACHE_SIZE = int(os.getenv('XHS_SIGN_CACHE_SIZE', '0'))
+SIGN_CACHE_TTL = float(os.getenv('XHS_SIGN_CACHE_TTL', '60'))
+sign_cache = SignCache(SIGN_CACHE_SIZE, SIGN_CACHE_TTL) if SIGN_CACHE_SIZE > 0 else None
 
-try:
-    xray_js = execjs.compile(open(r'../static/xhs_xray.js', 'r', encoding='utf-8').read())
-except:
-    xray_js = execjs.compile(open(r'static/xhs_xray.js', 'r', encoding='utf-8').read())
+IMPORT_TIME = time.perf_counter()
+
+
+class ExecjsSigner():
+    def __init__(self):
+        with open(os.path.join(STATIC_DIR, 'xhs_xs_xsc_56.js'), 'r', encoding='utf-8') as f:
+            self.js = execjs.compile(f.read(), cwd=STATIC_DIR)
+        with open(os.path.join(STATIC_DIR, 'xhs_xray.js'), 'r', encoding='utf-8') as f:
+            self.xray_js = execjs.compile(f.read(), cwd=STATIC_DIR)
+        logger.debug(f'execjs 运行时: {execjs.get().name}')
+
+    def call(self, fn, *args):
+        if fn == 'traceId':
+            return self.xray_js.call(fn, *args)
+        return self.js.call(fn, *args)
+
+
+def create_signer(backend=SIGN_BACKEND):
+    """
+        按配置创建签名后端, 不可用时退回 execjs
+        :param backend: node_pool / embedded / execjs
+    """
+    if backend == 'node_pool' and shutil.which('node'):
+        return SignWorkerPool(SIGN_POOL_SIZE)
+    if backend == 'embedded':
+        try:
+            from xhs_utils.embedded_signer import EmbeddedSigner
+            return EmbeddedSigner()
+        except ImportError as e:
+            logger.warning(f'嵌入式签名后端不可用, 退回 execjs: {e}')
+    return ExecjsSigner()
+
+
+_signer = None
+_signer_lock = threading.Lock()
+_first_sign_done = False
+
+
+def get_signer():
+    """第一次签名时才加载签名脚本, 导入本模块不再有js编译开销"""
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                start = time.perf_counter()
+                _signer = create_signer()
+                logger.info(f'签名后端 {type(_signer).__name__} 初始化耗时 {time.perf_counter() - start:.3f}s')
+    return _signer
+
+
+def warmup():
+    """
+        预热签名后端: 加载脚本, node 后端同时启动进程, 适合在Flask启动时放到后台线程执行
+        embedded 后端的 context 按线程创建, 只能在签名线程第一次签名时初始化
+        返回预热耗时(秒)
+    """
+    start = time.perf_counter()
+    signer = get_signer()
+    if hasattr(signer, 'warmup'):
+        signer.warmup()
+    elapsed = time.perf_counter() - start
+    logger.info(f'签名后端预热完成 耗时 {elapsed:.3f}s (距模块导入 {time.perf_counter() - IMPORT_TIME:.3f}s)')
+    return elapsed
 
-def generate_x_b3_traceid(len=16):
-    x_b3_traceid = ""
-    for t in range(len):
-        x_b3_traceid += "abcdef0123456789"[math.floor(16 * random.random())]
-    return x_b3_traceid
 
 def generate_xs_xs_common(a1, api, data=''):
-    ret = js.call('get_request_headers_params', api, data, a1)
+    global _first_sign_done
+    if sign_cache is not None:
+        key = SignCache.make_key(a1, api, data)
+        cached = sign_cache.get(key)
+        if cached is not None:
+            return cached
+    start = time.perf_counter()
+    ret = get_signer().call('get_request_headers_params', api, data, a1)
+    if not _first_sign_done:
+        _first_sign_done = True
+        now = time.perf_counter()
+        logger.info(f'首次签名完成 耗时 {now - start:.3f}s (距模块导入 {now - IMPORT_TIME:.3f}s)')
     xs, xt, xs_common = ret['xs'], ret['xt'], ret['xs_common']
+    if sign_cache is not None:
+        sign_cache.put(key, (xs, xt, xs_common))
     return xs, xt, xs_common
 
 def generate_xs(a1, api, data=''):
-    ret = js.call('get_xs', api, data, a1)
+    ret = get_signer().call('get_xs', api, data, a1)
     xs, xt = ret['X-s'], ret['X-t']
     return xs, xt
 
-def generate_xray_traceid():
-    return xray_js.call('traceId')
 def get_common_headers():
     return {
         "authority": "www.xiaohongshu.com",
@@ -76,8 +148,7 @@ def get_request_headers_template():
         "x-xray-traceid": generate_xray_traceid()
     }
 
-def generate_headers(a1, api, data=''):
-    xs, xt, xs_common = generate_xs_xs_common(a1, api, data)
+def build_headers(xs, xt, xs_common, data=''):
     x_b3_traceid = generate_x_b3_traceid()
     headers = get_request_headers_template()
     headers['x-s'] = xs
@@ -88,12 +159,40 @@ def generate_headers(a1, api, data=''):
         data = json.dumps(data, separators=(',', ':'), ensure_ascii=False)
     return headers, data
 
+def generate_headers(a1, api, data=''):
+    xs, xt, xs_common = generate_xs_xs_common(a1, api, data)
+    return build_headers(xs, xt, xs_common, data)
+
+def generate_headers_batch(a1, reqs):
+    """
+        一次js调用签名多个请求
+        :param a1: cookies中的a1
+        :param reqs: [(api, data), ...] data为空时传''
+        返回 [(headers, data), ...] 顺序与reqs一致
+    """
+    reqs = [(api, data) for api, data in reqs]
+    if not reqs:
+        return []
+    rets = get_signer().call('get_request_headers_params_batch', [[api, data] for api, data in reqs], a1)
+    return [build_headers(ret['xs'], ret['xt'], ret['xs_common'], data) for ret, (api, data) in zip(rets, reqs)]
+
 def generate_request_params(cookies_str, api, data=''):
     cookies = trans_cookies(cookies_str)
     a1 = cookies['a1']
     headers, data = generate_headers(a1, api, data)
     return headers, cookies, data
 
+def generate_request_params_batch(cookies_str, reqs):
+    """
+        批量生成请求参数, 适用于提前知道后续N个请求的场景(翻页预取, 二级评论展开)
+        :param cookies_str: 你的cookies
+        :param reqs: [(api, data), ...]
+        返回 [(headers, data), ...], cookies
+    """
+    cookies = trans_cookies(cookies_str)
+    a1 = cookies['a1']
+    return generate_headers_batch(a1, reqs), cookies
+
 def splice_str(api, params):
     url = api + '?'
     for key, value in params.items():
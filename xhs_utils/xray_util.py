@@ -0,0 +1,43 @@
+import random
+import threading
+import time
+
+# 对应 xhs_xray.js 里的 Int.MAX_SEQ / Int.SEQ
+MAX_SEQ = 2 ** 23 - 1
+UINT64_MASK = 2 ** 64 - 1
+
+_seq = random.randint(0, MAX_SEQ)
+_seq_lock = threading.Lock()
+
+
+def next_seq():
+    global _seq
+    with _seq_lock:
+        if _seq > MAX_SEQ:
+            _seq = 0
+        seq = _seq
+        _seq += 1
+    return seq
+
+
+def generate_xray_traceid(timestamp=None, seq=None, rand=None):
+    """
+        生成 x-xray-traceid, 移植自 static/xhs_xray.js 的 traceId
+        前16位: (毫秒时间戳 << 23 | 自增序号) 截断为64位后的16进制
+        后16位: 64位随机数的16进制
+        :param timestamp: 毫秒时间戳, 默认当前时间
+        :param seq: 序号, 默认取全局自增序号
+        :param rand: 64位随机数, 默认随机生成
+    """
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    if seq is None:
+        seq = next_seq()
+    if rand is None:
+        rand = random.getrandbits(64)
+    return '%016x%016x' % (((timestamp << 23) | seq) & UINT64_MASK, rand)
+
+
+def generate_x_b3_traceid(len=16):
+    """生成 len 位的16进制 x-b3-traceid, 一次取够随机位, 不再逐字符拼接"""
+    return '%0*x' % (len, random.getrandbits(4 * len))